@@ -1,19 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import sqlite3
-import bcrypt
-import pyotp
-import qrcode
-import io
-import base64
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import secrets
+import base64
+import hashlib
+import json
+import time
 from datetime import datetime, timedelta
 import jwt
 from functools import wraps
-import requests
+from db import ConnectionPool
+from cache import CacheSync, GenerationCache, UserStatusCache
+from hashing import PasswordHasher, HashingBusyError
+from sweeper import ExpirySweeper
+from storage import open_user_store
+from ratelimit import RateLimiter, RATE_LIMIT_DB, route_limits
+import outbox
+import logs
+import metrics
+import profiling
+import qr
+import responses
+from responses import error_body
+
+log = logs.get_logger('backend')
 
 app = Flask(__name__)
+metrics.instrument_flask(app, 'backend')
+# Request IDs and sampled JSON access records
+logs.instrument_flask(app, 'backend')
+# orjson / MessagePack responses negotiated through Accept
+responses.install(app)
 CORS(
     app,
     supports_credentials=True,
@@ -24,53 +42,162 @@ CORS(
 
 @app.after_request
 def after_request(response):
+    # Launchers never send Origin; only browsers need (and read) CORS headers
+    if 'Origin' not in request.headers:
+        return response
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Access-Control-Allow-Credentials,Access-Control-Allow-Origin')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS,PUT,DELETE')
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+def load_secret_key(path):
+    """JWT signing key from SECRET_KEY, else from a key file created once
+
+    Every worker process must sign with the same key, so a generated key is
+    written next to users.db and reused by all workers and restarts.
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    # Write a temp file then hard-link it into place: exactly one process wins
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        os.link(tmp_path, path)
+        log.info("Generated JWT signing key", extra={'path': path})
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    with open(path) as f:
+        return f.read().strip()
+
 # Configuration
-SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_hex(32))
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', 'secret.key')
+SECRET_KEY = load_secret_key(SECRET_KEY_FILE)
 ADMIN_KEY = os.environ.get('ADMIN_KEY', 'rAwwIzAd-RGz8eYGo_6ymz8Wd4EFEnBC6R--MWQ8gK8')
 DATABASE = 'users.db'
+DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL', 'http://localhost:3001/webhook/register')
+
+# Admin requests sending X-Profile run under a profiler; GET /auth/profiles
+# lists the saved files (plus the always-on sampler's windows, if enabled)
+profile_sampler = profiling.instrument_flask(app, 'backend', ADMIN_KEY, '/auth')
+
+# When enabled, /auth/validate trusts the HWID/expiry claims signed into the
+# token as long as its security generation is current, skipping the database
+STATELESS_VALIDATION = os.environ.get('STATELESS_VALIDATION', 'false').lower() == 'true'
+GENERATION_CACHE_TTL = float(os.environ.get('GENERATION_CACHE_TTL', 60))
+
+# Set by gunicorn.conf.py. Each worker caches statuses and generations for
+# itself, so with several workers invalidations are shared through users.db
+WORKER_COUNT = int(os.environ.get('SILICA_WORKERS', 1))
+
+# Access tokens are short-lived JWTs; launchers renew them through
+# /auth/refresh with a rotating refresh token instead of a full login
+ACCESS_TOKEN_HOURS = float(os.environ.get('ACCESS_TOKEN_HOURS', 1))
+REFRESH_TOKEN_DAYS = float(os.environ.get('REFRESH_TOKEN_DAYS', 30))
+
+# Per-thread pooled SQLite connections (WAL, tuned pragmas, statement cache)
+db_pool = ConnectionPool(DATABASE)
+
+# Every users query goes through the store: 'sqlite' (users.db) or 'memory'
+# (tests and benchmarks; single process, nothing persisted)
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'sqlite')
+user_store = open_user_store(STORAGE_ENGINE, db_pool)
+
+# Cached (hwid, is_active, expires_at) per user for /auth/validate
+user_cache = UserStatusCache()
+
+# bcrypt work runs on a bounded pool so it cannot stall cheap requests
+password_hasher = PasswordHasher()
+
+# user_id -> security generation; bumping it revokes outstanding tokens
+token_generations = GenerationCache(max_size=100000, ttl=GENERATION_CACHE_TTL)
+
+def forget_generation(user_id):
+    """Drop a cached generation (None: all of them)"""
+    if user_id is None:
+        token_generations.clear()
+    else:
+        token_generations.pop(user_id)
+
+# Another worker's reset-hwid, deactivation or expiry change must reach this
+# worker's caches before they answer again: every invalidation is logged and
+# replayed by the other workers (CACHE_SYNC_INTERVAL)
+cache_sync = None
+if WORKER_COUNT > 1:
+    cache_sync = CacheSync(user_store)
+    user_cache.on_invalidate = cache_sync.publish
+    cache_sync.add_target(user_cache.forget)
+    cache_sync.add_target(forget_generation)
+
+def sync_caches():
+    """Apply invalidations made by other workers before answering from cache"""
+    if cache_sync is not None:
+        cache_sync.poll()
+
+# Throttles bcrypt-heavy routes and QR rendering per client IP, email and
+# Discord ID. Buckets live in their own SQLite file so every gunicorn worker
+# shares them.
+rate_limiter = RateLimiter(ConnectionPool(RATE_LIMIT_DB))
+RATE_LIMIT_DEFAULTS = {
+    'login': {'ip': '20/60', 'email': '10/300'},
+    'register': {'ip': '5/3600', 'email': '3/3600', 'discord_id': '3/3600'},
+    'qr': {'ip': '30/60'}
+}
+RATE_LIMITS = {route: route_limits(route, defaults) for route, defaults in RATE_LIMIT_DEFAULTS.items()}
+
+# Behind Railway/Render/Fly the client address is in X-Forwarded-For; only
+# trust as many hops as there are proxies in front of the app
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Deactivates expired licenses in the background (EXPIRY_SWEEP_INTERVAL)
+expiry_sweeper = ExpirySweeper(user_store)
+
+# Delivers queued Discord bot webhooks with retries
+outbox_dispatcher = outbox.OutboxDispatcher(db_pool)
+
+@expiry_sweeper.on_expired
+def forget_expired_users(users):
+    """Drop swept users from the validation cache"""
+    for user in users:
+        user_cache.invalidate(user['id'])
+    log.info("Deactivated expired accounts", extra={'count': len(users)})
+
+@expiry_sweeper.on_expiring_soon
+def log_expiring_users(users):
+    """Report licenses about to expire"""
+    for user in users:
+        log.info("License expiring soon", extra={'email': user['email'], 'expires_at': user['expires_at']})
 
 app.config['SECRET_KEY'] = SECRET_KEY
 
 def init_db():
-    """Initialize the database with users table"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            hwid TEXT,
-            totp_secret TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            last_login TIMESTAMP,
-            is_active BOOLEAN DEFAULT 1,
-            discord_id TEXT,
-            note TEXT
-        )
-    ''')
-    
-    # Ensure new columns exist when upgrading from older schema
-    cursor.execute("PRAGMA table_info(users)")
-    existing_cols = [row[1] for row in cursor.fetchall()]
-    
-    if 'expires_at' not in existing_cols:
-        cursor.execute('ALTER TABLE users ADD COLUMN expires_at TIMESTAMP')
-    if 'discord_id' not in existing_cols:
-        cursor.execute('ALTER TABLE users ADD COLUMN discord_id TEXT')
-    if 'note' not in existing_cols:
-        cursor.execute('ALTER TABLE users ADD COLUMN note TEXT')
-    
-    conn.commit()
-    conn.close()
+    """Initialize the users storage and the outbox table"""
+    user_store.init_schema()
+
+def normalize_email(email):
+    """Canonical form used for every email lookup (matches the stored value)"""
+    if email is None:
+        return None
+    return email.lower().strip()
+
+def normalize_discord_id(discord_id):
+    """Discord snowflakes are stored and looked up as trimmed strings"""
+    if discord_id is None:
+        return None
+    discord_id = str(discord_id).strip()
+    return discord_id or None
 
 def require_admin(f):
     """Decorator to require admin key for certain endpoints"""
@@ -82,28 +209,86 @@ def require_admin(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def generate_totp_qr(email, secret):
-    """Generate QR code for TOTP setup"""
-    totp_uri = pyotp.totp.TOTP(secret).provisioning_uri(
-        name=email,
-        issuer_name="Silica Client"
-    )
-    
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(totp_uri)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
+def extend_expiry(current_expiry, is_active, days):
+    """New (expiry, is_active) after adding days to a subscription"""
+    if current_expiry:
+        new_expiry = datetime.fromisoformat(current_expiry) + timedelta(days=days)
+    else:
+        new_expiry = datetime.now() + timedelta(days=days)
     
-    # Convert to base64 for easy transmission
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode()
+    # Accounts deactivated by the expiry sweeper come back when extended
+    if current_expiry and not is_active and new_expiry > datetime.now():
+        is_active = 1
     
-    return img_base64
+    return new_expiry, is_active
+
+def shorten_expiry(current_expiry, days):
+    """New expiry after removing days, never earlier than now"""
+    new_expiry = datetime.fromisoformat(current_expiry) - timedelta(days=days)
+    if new_expiry < datetime.now():
+        new_expiry = datetime.now()
+    return new_expiry
+
+def expiry_shortened(current_expiry, new_expiry):
+    """Whether new_expiry ends the license before current_expiry (None never expires)"""
+    return current_expiry is None or new_expiry < datetime.fromisoformat(current_expiry)
+
+def issue_access_token(user_id, email, hwid, license_expires_at, generation):
+    """Sign a JWT; the status claims allow stateless validation"""
+    with metrics.timed('jwt_encode'):
+        return jwt.encode({
+            'user_id': user_id,
+            'email': email,
+            'hwid': hwid,
+            'lic_exp': license_expires_at,
+            'gen': generation,
+            'exp': datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_HOURS)
+        }, SECRET_KEY, algorithm='HS256')
+
+def hash_refresh_token(refresh_token):
+    """Refresh tokens are random, so a plain SHA-256 is enough to store them"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def issue_refresh_token(user_id, hwid, generation, family_id=None):
+    """Create a refresh token bound to hwid; a login starts a new family"""
+    refresh_token = secrets.token_urlsafe(32)
+    user_store.create_refresh_token(
+        user_id, hash_refresh_token(refresh_token), family_id or secrets.token_hex(16),
+        hwid, generation, time.time() + REFRESH_TOKEN_DAYS * 86400
+    )
+    return refresh_token
+
+def rate_limited(route):
+    """Decorator rejecting over-limit requests before the route does any work"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            data = request.get_json(silent=True)
+            data = data if isinstance(data, dict) else {}
+            email = data.get('email')
+            identities = {
+                # Trusted callers (the Discord bot) register on behalf of many users
+                'ip': None if request.headers.get('X-Admin-Key') == ADMIN_KEY else request.remote_addr,
+                'email': normalize_email(email) if isinstance(email, str) else None,
+                'discord_id': normalize_discord_id(data.get('discord_id') or data.get('discord_user_id'))
+            }
+            retry_after = rate_limiter.hit(route, RATE_LIMITS[route], identities)
+            if retry_after:
+                response = jsonify(error_body('Too many attempts, please try again later'))
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def busy_response():
+    """503 returned when the password hashing pool is saturated or timed out"""
+    response = jsonify(error_body('Server busy, please retry shortly'))
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 @app.route('/auth/register', methods=['POST'])
+@rate_limited('register')
 def register():
     """Register a new user"""
     try:
@@ -112,38 +297,28 @@ def register():
         if not data or 'email' not in data:
             return jsonify({'error': 'Email is required'}), 400
         
-        email = data['email'].lower().strip()
-        discord_id = data.get('discord_id')
+        email = normalize_email(data['email'])
+        discord_id = normalize_discord_id(data.get('discord_id'))
         discord_username = data.get('discord_username')
         is_active = data.get('is_active', False)
         duration_days = data.get('duration_days', 0)
+        include_qr = data.get('include_qr', False)
         
-        # Generate random password
-        password = secrets.token_urlsafe(12)
-        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-        
-        # Generate TOTP secret
-        totp_secret = pyotp.random_base32()
-        totp = pyotp.TOTP(totp_secret)
-        
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(totp.provisioning_uri(email, issuer_name="Silica Client"))
-        qr.make(fit=True)
+        # Check if email already exists
+        if user_store.email_exists(email):
+            return jsonify({'error': 'Email already registered'}), 400
         
-        # Create QR code image
-        img_buffer = io.BytesIO()
-        qr.make_image(fill_color="black", back_color="white").save(img_buffer, format='PNG')
-        qr_code = f"data:image/png;base64,{base64.b64encode(img_buffer.getvalue()).decode()}"
+        # Discord IDs are unique (idx_users_discord_id)
+        if discord_id and user_store.discord_exists(discord_id):
+            return jsonify({'error': 'Discord account already registered'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        # Generate random password (hashed only once the account can be created)
+        password = secrets.token_urlsafe(12)
+        password_hash = password_hasher.hash(password)
         
-        # Check if email already exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'Email already registered'}), 400
+        # Generate TOTP secret (pyotp is loaded on first use, see qr.py)
+        import pyotp
+        totp_secret = pyotp.random_base32()
         
         # Calculate expiration if duration is provided
         expires_at = None
@@ -151,25 +326,54 @@ def register():
             expires_at = datetime.now() + timedelta(days=duration_days)
         
         # Insert new user
-        cursor.execute('''
-            INSERT INTO users (email, password_hash, totp_secret, is_active, discord_id, expires_at, note)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (email, password_hash, totp_secret, is_active, discord_id, expires_at, discord_username))
-        
-        conn.commit()
-        conn.close()
+        user_store.create_user(email, password_hash, totp_secret, is_active,
+                               discord_id=discord_id, expires_at=expires_at, note=discord_username)
         
-        return jsonify({
+        response = {
             'success': True,
             'message': 'Registration successful',
             'password': password,
-            'totp_secret': totp_secret,
-            'qr_code': qr_code
-        }), 200
+            'totp_secret': totp_secret
+        }
+        
+        # QR image only when asked for ("svg" or any truthy value for PNG);
+        # otherwise clients can fetch it later from /auth/qr
+        if include_qr:
+            response['qr_code'] = qr.qr_data_uri(email, totp_secret, 'svg' if include_qr == 'svg' else 'png')
         
+        return jsonify(response), 200
+        
+    except HashingBusyError:
+        return busy_response()
     except Exception as e:
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
+@app.route('/auth/qr', methods=['POST'])
+@rate_limited('qr')
+def totp_qr():
+    """Render the TOTP setup QR code for an email/secret pair (SVG or PNG)"""
+    try:
+        data = request.get_json()
+        
+        if not data or 'email' not in data or 'totp_secret' not in data:
+            return jsonify({'error': 'Email and totp_secret are required'}), 400
+        
+        email = normalize_email(data['email'])
+        totp_secret = data['totp_secret']
+        fmt = data.get('format', request.args.get('format', 'svg'))
+        
+        if fmt not in qr.CONTENT_TYPES:
+            return jsonify({'error': 'Format must be svg or png'}), 400
+        
+        image = qr.render_qr(qr.provisioning_uri(email, totp_secret), fmt)
+        
+        response = app.response_class(image, mimetype=qr.CONTENT_TYPES[fmt])
+        response.headers['Cache-Control'] = 'private, max-age=300'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'QR generation failed: {str(e)}'}), 500
+
 @app.route('/auth/activate', methods=['POST'])
 @require_admin
 def activate_user():
@@ -180,38 +384,31 @@ def activate_user():
         if not data or 'email' not in data or 'duration_days' not in data:
             return jsonify({'error': 'Email and duration_days are required'}), 400
         
-        email = data['email'].lower().strip()
+        email = normalize_email(data['email'])
         duration_days = int(data['duration_days'])
         
         if duration_days <= 0:
             return jsonify({'error': 'Duration must be positive'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        user = cursor.fetchone()
-        if not user:
-            conn.close()
-            return jsonify({'error': 'User not found'}), 404
-        
         # Calculate expiration date
         expires_at = datetime.now() + timedelta(days=duration_days)
         
-        # Activate user and set duration
-        cursor.execute('''
-            UPDATE users 
-            SET is_active = 1, expires_at = ?
-            WHERE email = ?
-        ''', (expires_at, email))
+        account = user_store.get_account(email)
+        if not account:
+            return jsonify({'error': 'User not found'}), 404
         
-        if cursor.rowcount == 0:
-            conn.close()
-            return jsonify({'error': 'Failed to activate user'}), 500
+        # Activate user and set duration; a shorter license must revoke
+        # tokens that carry the old expiry claim
+        shortened = expiry_shortened(account.expires_at, expires_at)
+        user = user_store.update_user(email, {'is_active': 1, 'expires_at': expires_at},
+                                      bump_generation=shortened)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
-        conn.commit()
-        conn.close()
+        user_id, generation = user
+        user_cache.invalidate(user_id)
+        if shortened:
+            token_generations.put(user_id, generation)
         
         return jsonify({
             'success': True,
@@ -222,89 +419,130 @@ def activate_user():
         return jsonify({'error': f'Activation failed: {str(e)}'}), 500
 
 @app.route('/auth/login', methods=['POST'])
+@rate_limited('login')
 def login():
     """Login a user"""
     try:
         data = request.get_json()
         
         if not data or 'email' not in data or 'password' not in data or 'totp' not in data:
-            return jsonify({'error': 'Email, password and TOTP code are required'}), 400
+            return jsonify(error_body('Email, password and TOTP code are required')), 400
         
-        email = data['email'].lower().strip()
+        email = normalize_email(data['email'])
         password = data['password']
         totp_code = data['totp']
         hwid = data.get('hwid')
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
         # Get user data
-        cursor.execute('''
-            SELECT id, password_hash, totp_secret, hwid, is_active, expires_at
-            FROM users 
-            WHERE email = ?
-        ''', (email,))
-        
-        user = cursor.fetchone()
+        user = user_store.get_login(email)
         if not user:
-            conn.close()
-            return jsonify({'error': 'Invalid credentials'}), 401
+            return jsonify(error_body('Invalid credentials')), 401
         
-        user_id, stored_hash, totp_secret, stored_hwid, is_active, expires_at = user
+        user_id, stored_hash, totp_secret, stored_hwid, is_active, expires_at, generation = user
+        
+        # Check if account has expired (before is_active: the sweeper deactivates expired accounts)
+        if expires_at and datetime.now() > datetime.fromisoformat(expires_at):
+            return jsonify(error_body('Account has expired. Please contact an admin.')), 403
         
         # Check if user is active
         if not is_active:
-            conn.close()
-            return jsonify({'error': 'Account not activated. Please wait for admin approval.'}), 403
-        
-        # Check if account has expired
-        if expires_at and datetime.now() > datetime.fromisoformat(expires_at):
-            conn.close()
-            return jsonify({'error': 'Account has expired. Please contact an admin.'}), 403
+            return jsonify(error_body('Account not activated. Please wait for admin approval.')), 403
         
         # Verify password
-        if not bcrypt.checkpw(password.encode(), stored_hash):
-            conn.close()
-            return jsonify({'error': 'Invalid credentials'}), 401
+        if not password_hasher.verify(password, stored_hash):
+            return jsonify(error_body('Invalid credentials')), 401
         
         # Verify TOTP
+        import pyotp
         totp = pyotp.TOTP(totp_secret)
         if not totp.verify(totp_code):
-            conn.close()
-            return jsonify({'error': 'Invalid 2FA code'}), 401
+            return jsonify(error_body('Invalid 2FA code')), 401
         
         # Check HWID
         if stored_hwid is None:
             # First login - store HWID
-            cursor.execute('UPDATE users SET hwid = ?, last_login = ? WHERE id = ?',
-                         (hwid, datetime.now(), user_id))
+            user_store.record_login(user_id, hwid=hwid)
         elif stored_hwid != hwid:
-            conn.close()
-            return jsonify({'error': 'Hardware ID mismatch. Contact admin to reset.'}), 403
+            return jsonify(error_body('Hardware ID mismatch. Contact admin to reset.')), 403
         else:
             # Update last login
-            cursor.execute('UPDATE users SET last_login = ? WHERE id = ?',
-                         (datetime.now(), user_id))
+            user_store.record_login(user_id)
         
-        conn.commit()
-        conn.close()
+        if stored_hwid is None:
+            user_cache.invalidate(user_id)
+        token_generations.put(user_id, generation)
         
-        # Generate JWT token
-        token = jwt.encode({
-            'user_id': user_id,
-            'email': email,
-            'exp': datetime.utcnow() + timedelta(hours=24)
-        }, SECRET_KEY, algorithm='HS256')
+        # Hashes made under an older cost policy are upgraded off the request path
+        if password_hasher.needs_rehash(stored_hash):
+            password_hasher.rehash_later(
+                password, lambda new_hash: user_store.replace_password_hash(user_id, stored_hash, new_hash))
+        
+        # Generate JWT token plus a refresh token for renewing it later
+        bound_hwid = hwid if stored_hwid is None else stored_hwid
+        token = issue_access_token(user_id, email, bound_hwid, expires_at, generation)
+        refresh_token = issue_refresh_token(user_id, bound_hwid, generation)
         
         return jsonify({
             'success': True,
             'message': 'Login successful',
-            'token': token
+            'token': token,
+            'refresh_token': refresh_token
         }), 200
         
+    except HashingBusyError:
+        return busy_response()
     except Exception as e:
         return jsonify({'error': f'Login failed: {str(e)}'}), 500
 
+@app.route('/auth/refresh', methods=['POST'])
+def refresh():
+    """Trade a refresh token for a new access token and a rotated refresh token"""
+    try:
+        data = request.get_json()
+        
+        if not data or not isinstance(data.get('refresh_token'), str):
+            return jsonify(error_body('Refresh token is required')), 400
+        
+        hwid = data.get('hwid')
+        status, record = user_store.claim_refresh_token(hash_refresh_token(data['refresh_token']), time.time())
+        
+        if status == 'reused':
+            # Either the client or an attacker holds a stolen copy: end the session everywhere,
+            # including access tokens already minted from it (the store bumped the generation)
+            user_cache.invalidate(record.user_id)
+            token_generations.put(record.user_id, record.user_generation)
+            log.warning("Refresh token reuse, revoked the user's tokens", extra={'user_id': record.user_id})
+            return jsonify(error_body('Refresh token reuse detected. Please log in again.')), 401
+        if status == 'expired':
+            return jsonify(error_body('Refresh token has expired')), 401
+        if status != 'ok':
+            return jsonify(error_body('Invalid refresh token')), 401
+        
+        # Same rules as /auth/validate, against the user's current row
+        if record.hwid != hwid:
+            error = 'Hardware ID mismatch', 403
+        elif record.security_generation != record.user_generation:
+            error = 'Refresh token has been revoked', 401
+        else:
+            error = check_user_status((record.user_hwid, record.is_active, record.license_expires_at), hwid)
+        if error:
+            user_store.revoke_refresh_family(record.family_id)
+            return jsonify(error_body(error[0])), error[1]
+        
+        token_generations.put(record.user_id, record.user_generation)
+        token = issue_access_token(record.user_id, record.email, hwid, record.license_expires_at, record.user_generation)
+        refresh_token = issue_refresh_token(record.user_id, hwid, record.user_generation, record.family_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Token refreshed',
+            'token': token,
+            'refresh_token': refresh_token
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Token refresh failed: {str(e)}'}), 500
+
 @app.route('/auth/reset-hwid', methods=['POST'])
 @require_admin
 def reset_hwid():
@@ -315,20 +553,16 @@ def reset_hwid():
         if not data or 'email' not in data:
             return jsonify({'error': 'Email is required'}), 400
         
-        email = data['email'].lower().strip()
-        
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        email = normalize_email(data['email'])
         
-        # Update user's HWID to null
-        cursor.execute('UPDATE users SET hwid = NULL WHERE email = ?', (email,))
-        
-        if cursor.rowcount == 0:
-            conn.close()
+        # Update user's HWID to null; tokens bound to the old HWID must stop validating
+        user = user_store.update_user(email, {'hwid': None}, bump_generation=True)
+        if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        conn.commit()
-        conn.close()
+        user_id, generation = user
+        user_cache.invalidate(user_id)
+        token_generations.put(user_id, generation)
         
         return jsonify({
             'success': True,
@@ -338,43 +572,182 @@ def reset_hwid():
     except Exception as e:
         return jsonify({'error': f'HWID reset failed: {str(e)}'}), 500
 
+# Page sizes for /auth/users
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+
+def encode_users_cursor(created_at, user_id):
+    """Opaque keyset cursor pointing just past (created_at, id)"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, user_id]).encode()).decode()
+
+def decode_users_cursor(cursor_token):
+    """Inverse of encode_users_cursor; raises ValueError on malformed input"""
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor_token.encode()))
+        return str(created_at), int(user_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def user_list_row(row):
+    """Shape a storage.UserListRow for JSON output"""
+    return {
+        'email': row.email,
+        'created_at': row.created_at,
+        'last_login': row.last_login,
+        'is_active': bool(row.is_active),
+        'hwid_status': 'Set' if row.has_hwid else 'Not Set',
+        'expires_at': row.expires_at
+    }
+
 @app.route('/auth/users', methods=['GET'])
 @require_admin
 def list_users():
-    """List all users (admin only)"""
+    """List users newest first, page by page or as an NDJSON stream (admin only)
+    
+    Query parameters: limit, cursor, active=0|1, expired=0|1, hwid=set|unset,
+    include_total=1 and format=ndjson.
+    """
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT email, created_at, last_login, is_active, 
-                   CASE WHEN hwid IS NOT NULL THEN 'Set' ELSE 'Not Set' END as hwid_status,
-                   expires_at
-            FROM users
-            ORDER BY created_at DESC
-        ''')
-        
-        users = []
-        for row in cursor.fetchall():
-            users.append({
-                'email': row[0],
-                'created_at': row[1],
-                'last_login': row[2],
-                'is_active': bool(row[3]),
-                'hwid_status': row[4],
-                'expires_at': row[5]
-            })
-        
-        conn.close()
+        stream = request.args.get('format') == 'ndjson'
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({'error': 'Limit must be positive'}), 400
+        if not stream:
+            limit = min(limit or USERS_PAGE_DEFAULT, USERS_PAGE_MAX)
+        
+        filters = {}
+        
+        active = request.args.get('active')
+        if active in ('0', '1'):
+            filters['active'] = int(active)
+        
+        expired = request.args.get('expired')
+        if expired in ('0', '1'):
+            filters['expired'] = expired == '1'
+            filters['now'] = datetime.now()
+        
+        hwid_filter = request.args.get('hwid')
+        if hwid_filter in ('set', 'unset'):
+            filters['hwid'] = hwid_filter
+        
+        after = None
+        cursor_token = request.args.get('cursor')
+        if cursor_token:
+            try:
+                after = decode_users_cursor(cursor_token)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+        
+        if stream:
+            def generate():
+                for rows in user_store.stream_users(filters, after, limit):
+                    yield ''.join(json.dumps(user_list_row(row)) + '\n' for row in rows)
+            
+            return Response(generate(), mimetype='application/x-ndjson')
         
-        return jsonify({
+        # One extra row tells us whether another page exists
+        rows = user_store.list_users(filters, after, limit + 1)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_users_cursor(rows[-1].created_at, rows[-1].id)
+        
+        result = {
             'success': True,
-            'users': users
-        }), 200
+            'users': [user_list_row(row) for row in rows],
+            'next_cursor': next_cursor
+        }
+        
+        if request.args.get('include_total') == '1':
+            result['total'] = user_store.count_users(filters)
+        
+        return jsonify(result), 200
         
     except Exception as e:
         return jsonify({'error': f'Failed to list users: {str(e)}'}), 500
 
+@app.route('/auth/sweep-expired', methods=['POST'])
+@require_admin
+def sweep_expired():
+    """Run the expiry sweeper immediately (admin only)"""
+    try:
+        expired, warned = expiry_sweeper.sweep()
+        return jsonify({
+            'success': True,
+            'expired': expired,
+            'expiring_soon': warned,
+            'sweeper': expiry_sweeper.stats()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Expiry sweep failed: {str(e)}'}), 500
+
+@app.route('/auth/outbox', methods=['GET'])
+@require_admin
+def outbox_stats():
+    """Webhook outbox queue state (admin only)"""
+    try:
+        return jsonify({
+            'success': True,
+            'outbox': outbox_dispatcher.stats()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to read outbox: {str(e)}'}), 500
+
+@app.route('/auth/outbox/retry', methods=['POST'])
+@require_admin
+def outbox_retry():
+    """Re-queue dead-lettered webhooks (admin only)"""
+    try:
+        count = outbox_dispatcher.retry_dead()
+        return jsonify({
+            'success': True,
+            'message': f'Re-queued {count} messages',
+            'requeued': count
+        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to re-queue messages: {str(e)}'}), 500
+
+@app.route('/auth/upstream-stats', methods=['GET'])
+@require_admin
+def upstream_stats():
+    """Outbound HTTP latency/error counters per upstream (admin only)"""
+    # Imported here: http_client pulls in requests, which startup avoids
+    import http_client
+    return jsonify({
+        'success': True,
+        'upstreams': http_client.upstream_stats()
+    }), 200
+
+@app.route('/auth/cache-stats', methods=['GET'])
+@require_admin
+def cache_stats():
+    """User status cache hit/miss counters (admin only)"""
+    return jsonify({
+        'success': True,
+        'user_cache': user_cache.stats(),
+        'cache_sync': cache_sync.stats() if cache_sync else None
+    }), 200
+
+@app.route('/auth/rate-limit-stats', methods=['GET'])
+@require_admin
+def rate_limit_stats():
+    """Rate limiter decisions and configured limits (admin only)"""
+    return jsonify({
+        'success': True,
+        'rate_limiter': rate_limiter.stats(),
+        'limits': {route: {kind: f'{count}/{period:g}' for kind, (count, period) in limits.items()}
+                   for route, limits in RATE_LIMITS.items()}
+    }), 200
+
+@app.route('/auth/hash-stats', methods=['GET'])
+@require_admin
+def hash_stats():
+    """Password hashing pool queue metrics (admin only)"""
+    return jsonify({
+        'success': True,
+        'password_pool': password_hasher.stats()
+    }), 200
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint"""
@@ -388,7 +761,6 @@ def root():
 def health_check():
     """Health check endpoint"""
     try:
-        print("🏥 Health check endpoint accessed")
         return jsonify({
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
@@ -402,22 +774,14 @@ def health_check():
 def check_discord():
     """Check if a Discord user already has an account"""
     try:
-        discord_id = request.args.get('discord_id')
+        discord_id = normalize_discord_id(request.args.get('discord_id'))
         
         if not discord_id:
             return jsonify({'error': 'Discord ID is required'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT id FROM users WHERE discord_id = ?', (discord_id,))
-        user = cursor.fetchone()
-        
-        conn.close()
-        
         return jsonify({
             'success': True,
-            'has_account': user is not None
+            'has_account': user_store.discord_exists(discord_id)
         }), 200
         
     except Exception as e:
@@ -433,39 +797,27 @@ def add_duration():
         if not data or 'email' not in data or 'days' not in data:
             return jsonify({'error': 'Email and days are required'}), 400
         
-        email = data['email'].lower().strip()
+        email = normalize_email(data['email'])
         days = int(data['days'])
         
         if days <= 0:
             return jsonify({'error': 'Days must be positive'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
         # Get current expiry
-        cursor.execute('SELECT expires_at, discord_id FROM users WHERE email = ?', (email,))
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
+        account = user_store.get_account(email)
+        if not account:
             return jsonify({'error': 'User not found'}), 404
         
-        current_expiry, discord_id = result
+        discord_id = account.discord_id
         
         # Calculate new expiry
-        if current_expiry:
-            new_expiry = datetime.fromisoformat(current_expiry) + timedelta(days=days)
-        else:
-            new_expiry = datetime.now() + timedelta(days=days)
+        new_expiry, is_active = extend_expiry(account.expires_at, account.is_active, days)
         
         # Update expiry
-        cursor.execute('''
-            UPDATE users 
-            SET expires_at = ?
-            WHERE email = ?
-        ''', (new_expiry.isoformat(), email))
-        
-        conn.commit()
-        conn.close()
+        user = user_store.update_user(email, {'expires_at': new_expiry, 'is_active': is_active})
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        user_cache.invalidate(user[0])
         
         return jsonify({
             'success': True,
@@ -487,41 +839,32 @@ def remove_duration():
         if not data or 'email' not in data or 'days' not in data:
             return jsonify({'error': 'Email and days are required'}), 400
         
-        email = data['email'].lower().strip()
+        email = normalize_email(data['email'])
         days = int(data['days'])
         
         if days <= 0:
             return jsonify({'error': 'Days must be positive'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
         # Get current expiry
-        cursor.execute('SELECT expires_at, discord_id FROM users WHERE email = ?', (email,))
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
+        account = user_store.get_account(email)
+        if not account:
             return jsonify({'error': 'User not found'}), 404
         
-        current_expiry, discord_id = result
-        if not current_expiry:
-            conn.close()
+        discord_id = account.discord_id
+        if not account.expires_at:
             return jsonify({'error': 'User has no expiry date set'}), 400
         
         # Calculate new expiry
-        new_expiry = datetime.fromisoformat(current_expiry) - timedelta(days=days)
-        if new_expiry < datetime.now():
-            new_expiry = datetime.now()
+        new_expiry = shorten_expiry(account.expires_at, days)
         
-        # Update expiry
-        cursor.execute('''
-            UPDATE users 
-            SET expires_at = ?
-            WHERE email = ?
-        ''', (new_expiry.isoformat(), email))
+        # Update expiry; outstanding tokens carry the old expiry claim
+        user = user_store.update_user(email, {'expires_at': new_expiry}, bump_generation=True)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
-        conn.commit()
-        conn.close()
+        user_id, generation = user
+        user_cache.invalidate(user_id)
+        token_generations.put(user_id, generation)
         
         return jsonify({
             'success': True,
@@ -533,6 +876,177 @@ def remove_duration():
     except Exception as e:
         return jsonify({'error': f'Failed to remove duration: {str(e)}'}), 500
 
+# Largest number of emails accepted by the *-batch admin endpoints
+ADMIN_BATCH_MAX = int(os.environ.get('ADMIN_BATCH_MAX', 1000))
+
+def parse_batch_emails(data):
+    """Normalized, de-duplicated emails of a batch request, or an error message"""
+    if not data or not isinstance(data.get('emails'), list) or not data['emails']:
+        return None, 'A list of emails is required'
+    if len(data['emails']) > ADMIN_BATCH_MAX:
+        return None, f'At most {ADMIN_BATCH_MAX} emails per batch'
+    
+    emails = []
+    seen = set()
+    for email in data['emails']:
+        if not isinstance(email, str):
+            return None, 'Emails must be strings'
+        email = normalize_email(email)
+        if email and email not in seen:
+            seen.add(email)
+            emails.append(email)
+    return emails, None
+
+def batch_response(results):
+    """Common response body of the *-batch admin endpoints"""
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({
+        'success': True,
+        'updated': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }), 200
+
+@app.route('/auth/activate-batch', methods=['POST'])
+@require_admin
+def activate_batch():
+    """Activate many users for the same duration (admin only)"""
+    try:
+        data = request.get_json()
+        emails, error = parse_batch_emails(data)
+        if error:
+            return jsonify({'error': error}), 400
+        if 'duration_days' not in data:
+            return jsonify({'error': 'duration_days is required'}), 400
+        
+        duration_days = int(data['duration_days'])
+        if duration_days <= 0:
+            return jsonify({'error': 'Duration must be positive'}), 400
+        
+        expires_at = datetime.now() + timedelta(days=duration_days)
+        
+        def plan(email, user):
+            return {'is_active': 1, 'expires_at': expires_at}, {
+                'success': True,
+                'new_expiry': expires_at.isoformat(),
+                'discord_id': user.discord_id
+            }
+        
+        def shortens(user, changes):
+            return expiry_shortened(user.expires_at, expires_at)
+        
+        # Only users whose license gets shorter have tokens to revoke
+        results, changed = user_store.update_batch(emails, plan, bump_generation=shortens)
+        
+        for email, user in changed:
+            user_cache.invalidate(user.id)
+            if shortens(user, None):
+                token_generations.put(user.id, user.security_generation + 1)
+        
+        return batch_response(results)
+        
+    except Exception as e:
+        return jsonify({'error': f'Activation failed: {str(e)}'}), 500
+
+@app.route('/auth/add-duration-batch', methods=['POST'])
+@require_admin
+def add_duration_batch():
+    """Add the same number of days to many subscriptions (admin only)"""
+    try:
+        data = request.get_json()
+        emails, error = parse_batch_emails(data)
+        if error:
+            return jsonify({'error': error}), 400
+        if 'days' not in data:
+            return jsonify({'error': 'days is required'}), 400
+        
+        days = int(data['days'])
+        if days <= 0:
+            return jsonify({'error': 'Days must be positive'}), 400
+        
+        def plan(email, user):
+            user_id, current_expiry, is_active, discord_id, _ = user
+            new_expiry, is_active = extend_expiry(current_expiry, is_active, days)
+            return {'expires_at': new_expiry, 'is_active': is_active}, {
+                'success': True,
+                'new_expiry': new_expiry.isoformat(),
+                'discord_id': discord_id
+            }
+        
+        results, changed = user_store.update_batch(emails, plan)
+        
+        for email, user in changed:
+            user_cache.invalidate(user.id)
+        
+        return batch_response(results)
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to add duration: {str(e)}'}), 500
+
+@app.route('/auth/remove-duration-batch', methods=['POST'])
+@require_admin
+def remove_duration_batch():
+    """Remove the same number of days from many subscriptions (admin only)"""
+    try:
+        data = request.get_json()
+        emails, error = parse_batch_emails(data)
+        if error:
+            return jsonify({'error': error}), 400
+        if 'days' not in data:
+            return jsonify({'error': 'days is required'}), 400
+        
+        days = int(data['days'])
+        if days <= 0:
+            return jsonify({'error': 'Days must be positive'}), 400
+        
+        def plan(email, user):
+            user_id, current_expiry, _, discord_id, _ = user
+            if not current_expiry:
+                return None, {'success': False, 'error': 'User has no expiry date set'}
+            new_expiry = shorten_expiry(current_expiry, days)
+            return {'expires_at': new_expiry}, {
+                'success': True,
+                'new_expiry': new_expiry.isoformat(),
+                'discord_id': discord_id
+            }
+        
+        # Outstanding tokens carry the old expiry claim
+        results, changed = user_store.update_batch(emails, plan, bump_generation=True)
+        
+        for email, user in changed:
+            user_cache.invalidate(user.id)
+            token_generations.put(user.id, user.security_generation + 1)
+        
+        return batch_response(results)
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to remove duration: {str(e)}'}), 500
+
+@app.route('/auth/reset-hwid-batch', methods=['POST'])
+@require_admin
+def reset_hwid_batch():
+    """Reset the HWID of many users (admin only)"""
+    try:
+        data = request.get_json()
+        emails, error = parse_batch_emails(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        def plan(email, user):
+            return {'hwid': None}, {'success': True, 'discord_id': user.discord_id}
+        
+        # Tokens bound to the old HWID must stop validating
+        results, changed = user_store.update_batch(emails, plan, bump_generation=True)
+        
+        for email, user in changed:
+            user_cache.invalidate(user.id)
+            token_generations.put(user.id, user.security_generation + 1)
+        
+        return batch_response(results)
+        
+    except Exception as e:
+        return jsonify({'error': f'HWID reset failed: {str(e)}'}), 500
+
 @app.route('/auth/reset-account', methods=['POST'])
 @require_admin
 def reset_account():
@@ -543,25 +1057,16 @@ def reset_account():
         if not data or 'email' not in data:
             return jsonify({'error': 'Email is required'}), 400
         
-        email = data['email'].lower().strip()
-        
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        email = normalize_email(data['email'])
         
-        # Get Discord ID before deleting
-        cursor.execute('SELECT discord_id FROM users WHERE email = ?', (email,))
-        result = cursor.fetchone()
+        # Delete user, keeping the Discord ID for the response
+        result = user_store.delete_user(email)
         if not result:
-            conn.close()
             return jsonify({'error': 'User not found'}), 404
         
-        discord_id = result[0]
-        
-        # Delete user
-        cursor.execute('DELETE FROM users WHERE email = ?', (email,))
-        
-        conn.commit()
-        conn.close()
+        user_id, discord_id = result
+        user_cache.invalidate(user_id)
+        token_generations.pop(user_id)
         
         return jsonify({
             'success': True,
@@ -577,38 +1082,16 @@ def reset_account():
 def get_user_info():
     """Get detailed user information"""
     try:
-        email = request.args.get('email')
+        email = normalize_email(request.args.get('email'))
         
         if not email:
             return jsonify({'error': 'Email is required'}), 400
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT email, discord_id, is_active, expires_at, last_login, 
-                   created_at, hwid, note
-            FROM users 
-            WHERE email = ?
-        ''', (email,))
-        
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
+        user = user_store.get_info(email)
+        if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        user = {
-            'email': result[0],
-            'discord_id': result[1],
-            'is_active': bool(result[2]),
-            'expires_at': result[3],
-            'last_login': result[4],
-            'created_at': result[5],
-            'hwid': result[6],
-            'note': result[7]
-        }
-        
-        conn.close()
+        user['is_active'] = bool(user['is_active'])
         
         return jsonify({
             'success': True,
@@ -628,25 +1111,12 @@ def set_note():
         if not data or 'email' not in data or 'note' not in data:
             return jsonify({'error': 'Email and note are required'}), 400
         
-        email = data['email'].lower().strip()
+        email = normalize_email(data['email'])
         note = data['note']
         
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET note = ?
-            WHERE email = ?
-        ''', (note, email))
-        
-        if cursor.rowcount == 0:
-            conn.close()
+        if not user_store.update_user(email, {'note': note}):
             return jsonify({'error': 'User not found'}), 404
         
-        conn.commit()
-        conn.close()
-        
         return jsonify({
             'success': True,
             'message': f'Updated note for {email}'
@@ -660,22 +1130,10 @@ def set_note():
 def reset_all_users():
     """Reset all users (admin only)"""
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
         # Reset all users
-        cursor.execute('''
-            UPDATE users 
-            SET hwid = NULL,
-                is_active = 0,
-                expires_at = NULL,
-                last_login = NULL
-        ''')
-        
-        affected_rows = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+        affected_rows = user_store.reset_all()
+        user_cache.clear()
+        token_generations.clear()
         
         return jsonify({
             'success': True,
@@ -686,6 +1144,121 @@ def reset_all_users():
     except Exception as e:
         return jsonify({'error': f'Failed to reset users: {str(e)}'}), 500
 
+# Largest number of tokens accepted by /auth/validate-batch
+VALIDATE_BATCH_MAX = int(os.environ.get('VALIDATE_BATCH_MAX', 500))
+
+def decode_access_token(token):
+    """Decode a login JWT, returning (payload, None) or (None, (error, status))"""
+    try:
+        with metrics.timed('jwt_decode'):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        if 'user_id' not in payload or 'email' not in payload:
+            return None, ('Invalid token', 401)
+        return payload, None
+    except jwt.ExpiredSignatureError:
+        return None, ('Token has expired', 401)
+    except jwt.InvalidTokenError:
+        return None, ('Invalid token', 401)
+
+def check_user_status(user, hwid):
+    """Apply the activation, expiry and HWID rules to (hwid, is_active, expires_at)"""
+    stored_hwid, is_active, expires_at = user
+    
+    # Check if account has expired (before is_active: the sweeper deactivates expired accounts)
+    if expires_at and datetime.now() > datetime.fromisoformat(expires_at):
+        return 'Account has expired', 403
+    
+    # Check if user is active
+    if not is_active:
+        return 'Account not activated', 403
+    
+    # Check HWID
+    if stored_hwid != hwid:
+        return 'Hardware ID mismatch', 403
+    
+    return None
+
+def check_token_generation(payload, generation):
+    """Reject tokens minted before the user's last security generation bump"""
+    if 'gen' in payload and payload['gen'] != generation:
+        return 'Token has been revoked', 401
+    return None
+
+def check_token_claims(payload, hwid):
+    """Try to answer from the token and the in-memory generation map alone.
+    
+    Returns None when the user's stored status must be consulted, otherwise
+    an (error, status) pair where error is None for a valid token.
+    """
+    if 'gen' not in payload:
+        return None
+    
+    generation = token_generations.get(payload['user_id'])
+    if generation is None:
+        return None
+    
+    error = check_token_generation(payload, generation)
+    if error:
+        return error
+    
+    if not STATELESS_VALIDATION:
+        return None
+    
+    # Failing claims may just be stale (e.g. after an extension), so only a
+    # passing check is answered here
+    if check_user_status((payload.get('hwid'), True, payload.get('lic_exp')), hwid):
+        return None
+    return None, 200
+
+def validate_without_db(token, hwid):
+    """Decode a token and try to validate it from its claims and the status cache
+    
+    Returns (payload, result) where result is an (error, status) pair (error
+    is None for a valid token), or None when load_and_validate() must run.
+    Never blocks in a single process, so the ASGI entry point calls it on
+    the event loop; only gunicorn workers poll the shared invalidation log.
+    """
+    payload, error = decode_access_token(token)
+    if error:
+        return None, error
+    
+    sync_caches()
+    
+    # Answer from the token claims when the generation is known
+    result = check_token_claims(payload, hwid)
+    if result is not None:
+        return payload, result
+    
+    user = user_cache.get(payload['user_id'], payload['email'])
+    if user is None:
+        return payload, None
+    return payload, check_user_status(user, hwid) or (None, 200)
+
+def load_and_validate(payload, hwid):
+    """Finish a validation with the user's row from the database (blocking)"""
+    user_id = payload['user_id']
+    user_email = payload['email']
+    generation = user_cache.generation
+    row = user_store.get_status(user_id, user_email)
+    if not row:
+        return 'User not found', 404
+    
+    user = row[:3]
+    user_cache.put(user_id, user_email, user, generation)
+    token_generations.put(user_id, row.security_generation)
+    return check_token_generation(payload, row.security_generation) or check_user_status(user, hwid) or (None, 200)
+
+def validation_body(payload, result):
+    """JSON body and status code for a finished validation"""
+    error, status = result
+    if error:
+        return error_body(error), status
+    return {
+        'success': True,
+        'message': 'Token valid',
+        'user': payload['email']
+    }, 200
+
 @app.route('/auth/validate', methods=['POST'])
 def validate_token():
     """Validate a JWT token and HWID"""
@@ -693,65 +1266,103 @@ def validate_token():
         data = request.get_json()
         
         if not data or 'token' not in data or 'hwid' not in data:
-            return jsonify({'error': 'Token and HWID are required'}), 400
+            return jsonify(error_body('Token and HWID are required')), 400
         
-        token = data['token']
         hwid = data['hwid']
+        payload, result = validate_without_db(data['token'], hwid)
+        if result is None:
+            result = load_and_validate(payload, hwid)
         
-        # Decode JWT token
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            user_email = payload['email']
-            user_id = payload['user_id']
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-        
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Get user data
-        cursor.execute('''
-            SELECT hwid, is_active, expires_at
-            FROM users 
-            WHERE id = ? AND email = ?
-        ''', (user_id, user_email))
+        body, status = validation_body(payload, result)
+        return jsonify(body), status
         
-        user = cursor.fetchone()
-        if not user:
-            conn.close()
-            return jsonify({'error': 'User not found'}), 404
-        
-        stored_hwid, is_active, expires_at = user
+    except Exception as e:
+        return jsonify({'error': f'Validation failed: {str(e)}'}), 500
+
+@app.route('/auth/validate-batch', methods=['POST'])
+def validate_batch():
+    """Validate many token/HWID pairs with a single database query"""
+    try:
+        data = request.get_json()
         
-        # Check if user is active
-        if not is_active:
-            conn.close()
-            return jsonify({'error': 'Account not activated'}), 403
+        if not data or not isinstance(data.get('items'), list):
+            return jsonify({'error': 'A list of items is required'}), 400
         
-        # Check if account has expired
-        if expires_at and datetime.now() > datetime.fromisoformat(expires_at):
-            conn.close()
-            return jsonify({'error': 'Account has expired'}), 403
+        items = data['items']
+        if len(items) > VALIDATE_BATCH_MAX:
+            return jsonify({'error': f'At most {VALIDATE_BATCH_MAX} items per batch'}), 400
         
-        # Check HWID
-        if stored_hwid != hwid:
-            conn.close()
-            return jsonify({'error': 'Hardware ID mismatch'}), 403
+        sync_caches()
         
-        conn.close()
+        # Decode every token first, collecting the users we still need
+        results = [None] * len(items)
+        decoded = []
+        missing_ids = set()
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or 'token' not in item or 'hwid' not in item:
+                results[index] = {'error': 'Token and HWID are required', 'status': 400}
+                continue
+            
+            payload, error = decode_access_token(item['token'])
+            if not error:
+                error = check_token_claims(payload, item['hwid'])
+            if error:
+                if error[0]:
+                    results[index] = {'error': error[0], 'status': error[1]}
+                else:
+                    results[index] = {
+                        'success': True,
+                        'message': 'Token valid',
+                        'user': payload['email'],
+                        'status': 200
+                    }
+                continue
+            
+            user = user_cache.get(payload['user_id'], payload['email'])
+            if user is None:
+                missing_ids.add(payload['user_id'])
+            decoded.append((index, payload, item['hwid'], user))
+        
+        # Fetch all cache misses at once
+        fetched = {}
+        if missing_ids:
+            generation = user_cache.generation
+            fetched = user_store.get_statuses(missing_ids)
+            for user_id, (email, status) in fetched.items():
+                user_cache.put(user_id, email, status[:3], generation)
+                token_generations.put(user_id, status.security_generation)
+        
+        for index, payload, hwid, user in decoded:
+            error = None
+            if user is None:
+                email, status = fetched.get(payload['user_id'], (None, None))
+                if not status or email != payload['email']:
+                    results[index] = {'error': 'User not found', 'status': 404}
+                    continue
+                user = status[:3]
+                error = check_token_generation(payload, status.security_generation)
+            
+            error = error or check_user_status(user, hwid)
+            if error:
+                results[index] = {'error': error[0], 'status': error[1]}
+            else:
+                results[index] = {
+                    'success': True,
+                    'message': 'Token valid',
+                    'user': payload['email'],
+                    'status': 200
+                }
         
         return jsonify({
             'success': True,
-            'message': 'Token valid',
-            'user': user_email
+            'results': results
         }), 200
         
     except Exception as e:
         return jsonify({'error': f'Validation failed: {str(e)}'}), 500
 
 @app.route('/auth/trigger-discord-register', methods=['POST'])
+@rate_limited('register')
 def trigger_discord_register():
     """Simulate a Discord !register command from website purchase"""
     try:
@@ -760,8 +1371,8 @@ def trigger_discord_register():
         if not data or 'email' not in data or 'discord_user_id' not in data:
             return jsonify({'error': 'Email and discord_user_id are required'}), 400
         
-        email = data['email'].lower().strip()
-        discord_user_id = data['discord_user_id']
+        email = normalize_email(data['email'])
+        discord_user_id = normalize_discord_id(data['discord_user_id'])
         product_type = data.get('product_type', 'monthly')
         payment_method = data.get('payment_method', 'unknown')
         payment_proof = data.get('payment_proof', '')
@@ -771,32 +1382,20 @@ def trigger_discord_register():
         # Calculate duration based on product type
         duration_days = 30 if product_type == 'monthly' else 1000
         
+        # Check if email already exists
+        if user_store.email_exists(email):
+            return jsonify({'error': 'Email already registered'}), 400
+        
+        if user_store.discord_exists(discord_user_id):
+            return jsonify({'error': 'Discord account already registered'}), 400
+        
         # Generate random password (same as Discord bot does)
         password = secrets.token_urlsafe(12)
-        password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        password_hash = password_hasher.hash(password)
         
         # Generate TOTP secret (same as Discord bot does)
+        import pyotp
         totp_secret = pyotp.random_base32()
-        totp = pyotp.TOTP(totp_secret)
-        
-        # Generate QR code (same as Discord bot does)
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(totp.provisioning_uri(email, issuer_name="Silica Client"))
-        qr.make(fit=True)
-        
-        # Create QR code image
-        img_buffer = io.BytesIO()
-        qr.make_image(fill_color="black", back_color="white").save(img_buffer, format='PNG')
-        qr_code = f"data:image/png;base64,{base64.b64encode(img_buffer.getvalue()).decode()}"
-        
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Check if email already exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'Email already registered'}), 400
         
         # Create note with purchase info
         note_parts = [f"DiscordID: {discord_user_id}"]
@@ -811,61 +1410,64 @@ def trigger_discord_register():
         
         note = " | ".join(note_parts)
         
+        # The bot attaches the QR code to the DM as a PNG
+        qr_code = qr.qr_data_uri(email, totp_secret, 'png')
+        
         # Insert new user with INACTIVE status (same as Discord !register)
-        # Admin will need to activate after verifying payment
-        cursor.execute('''
-            INSERT INTO users (email, password_hash, totp_secret, is_active, discord_id, note)
-            VALUES (?, ?, ?, 0, ?, ?)
-        ''', (email, password_hash, totp_secret, discord_user_id, note))
-        
-        conn.commit()
-        conn.close()
-        
-        # Call Discord bot webhook to send DM
-        try:
-            webhook_response = requests.post('http://localhost:3001/webhook/register', json={
-                'discord_user_id': discord_user_id,
-                'email': email,
-                'password': password,
-                'totp_secret': totp_secret,
-                'qr_code': qr_code,
-                'product_type': product_type,
-                'is_active': False,
-                'duration_days': duration_days
-            }, timeout=10)
-            
-            if webhook_response.status_code == 200:
-                return jsonify({
-                    'success': True,
-                    'message': 'Registration complete! Check your Discord DMs for login credentials.',
-                    'status': 'dm_sent'
-                }), 200
-            else:
-                return jsonify({
-                    'success': True,
-                    'message': 'Account created but could not send Discord DM. Contact admin for credentials.',
-                    'status': 'dm_failed',
-                    'discord_error': webhook_response.text
-                }), 200
-                
-        except requests.exceptions.RequestException as webhook_error:
-            return jsonify({
-                'success': True,
-                'message': 'Account created but Discord bot is offline. Contact admin for credentials.',
-                'status': 'bot_offline',
-                'webhook_error': str(webhook_error)
-            }), 200
+        # Admin will need to activate after verifying payment. The Discord DM
+        # is queued in the same transaction as the account, so the
+        # credentials cannot be lost if the bot is slow or down
+        message = ('discord_register', DISCORD_WEBHOOK_URL, {
+            'discord_user_id': discord_user_id,
+            'email': email,
+            'password': password,
+            'totp_secret': totp_secret,
+            'qr_code': qr_code,
+            'product_type': product_type,
+            'is_active': False,
+            'duration_days': duration_days
+        })
+        
+        user_store.create_user(email, password_hash, totp_secret, 0,
+                               discord_id=discord_user_id, note=note, message=message)
+        outbox_dispatcher.notify()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Registration complete! Your login credentials will arrive in your Discord DMs shortly.',
+            'status': 'dm_queued'
+        }), 200
         
+    except HashingBusyError:
+        return busy_response()
     except Exception as e:
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
 
+def start_background_tasks():
+    """Start this process's background threads (expiry sweeper, outbox, profiler)"""
+    expiry_sweeper.start()
+    outbox_dispatcher.start()
+    profile_sampler.start()
+
+# Set by gunicorn.conf.py (the app is preloaded in the gunicorn master and
+# each forked worker starts its threads from post_fork) and by asgi.py (which
+# starts them from its lifespan handler): only initialise the schema here
+MANAGED_STARTUP = os.environ.get('SILICA_MANAGED_STARTUP') == '1'
+
 # Initialize database when module is imported
-print("🔧 Initializing database...")
+log.info("Initializing database")
 try:
     init_db()
-    print("✅ Database initialized successfully")
-except Exception as e:
-    print(f"❌ Database initialization failed: {str(e)}")
+    rate_limiter.create_table()
+    log.info("Database initialized")
+    if MANAGED_STARTUP:
+        # SQLite handles must not be shared with forked workers
+        db_pool.close_all()
+        rate_limiter.pool.close_all()
+    else:
+        start_background_tasks()
+except Exception:
+    log.exception("Database initialization failed")
     raise
 
 if __name__ == '__main__':
@@ -0,0 +1,267 @@
+"""
+ASGI entry point for the Silica auth backend
+
+    cd backend && uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+/auth/validate and /health are answered on the event loop: token decoding,
+the claim check and the status cache never block, and only a cache miss
+goes to a small SQLite executor, so one process can hold thousands of
+launcher connections. Every other route runs the unchanged Flask views
+(app.py) on a thread pool, which is also where bcrypt and admin queries
+happen. Outbox webhooks are delivered with an async HTTP client.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+
+# app.py must leave the background tasks to the lifespan handler below
+os.environ['SILICA_MANAGED_STARTUP'] = '1'
+
+import app as flask_backend  # noqa: E402
+import http_client  # noqa: E402
+import logs  # noqa: E402
+import metrics  # noqa: E402
+import outbox  # noqa: E402
+import responses  # noqa: E402
+
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+ASGI_DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 8))
+ASGI_MAX_BODY = int(os.environ.get('ASGI_MAX_BODY', 1024 * 1024))
+
+# Same headers the Flask after_request hook adds to browser (Origin) requests
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type,Authorization,Access-Control-Allow-Credentials,Access-Control-Allow-Origin'),
+    (b'access-control-allow-methods', b'GET,POST,OPTIONS,PUT,DELETE'),
+    (b'access-control-allow-credentials', b'true')
+]
+
+wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='wsgi')
+db_executor = ThreadPoolExecutor(max_workers=ASGI_DB_THREADS, thread_name_prefix='sqlite')
+
+http = None
+
+
+async def post_json_async(url, payload):
+    """Async twin of outbox.post_json: returns (delivered, retryable, error)"""
+    started = time.perf_counter()
+    try:
+        response = await http.post(url, json=payload)
+    except httpx.HTTPError as e:
+        metrics.upstream_latency.observe(time.perf_counter() - started, 'discord-bot', 'error')
+        return False, True, str(e) or type(e).__name__
+    failed = response.status_code >= 500
+    metrics.upstream_latency.observe(time.perf_counter() - started, 'discord-bot', 'error' if failed else 'ok')
+    if response.status_code < 300:
+        return True, False, None
+    retryable = failed or response.status_code in (408, 429)
+    return False, retryable, f'HTTP {response.status_code}: {response.text[:500]}'
+
+
+async def read_body(receive):
+    """Whole request body, or None when it exceeds ASGI_MAX_BODY"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def header(scope, name):
+    """First value of a request header (name in lowercase bytes), or None"""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def send_json(send, scope, body, status, request_id=None):
+    """Send body as JSON or MessagePack (per Accept), with CORS headers for browsers"""
+    mimetype = responses.response_mimetype(header(scope, b'accept'))
+    payload = responses.encode(body, mimetype)
+    headers = [(b'content-type', mimetype.encode()),
+               (b'content-length', str(len(payload)).encode()),
+               (b'vary', b'Accept')]
+    if request_id is not None:
+        headers.append((b'x-request-id', request_id.encode('latin-1')))
+    if header(scope, b'origin') is not None:
+        headers += CORS_HEADERS
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def validate(scope, body):
+    """/auth/validate: cache and claim checks inline, database misses on db_executor"""
+    try:
+        data = responses.decode(body, header(scope, b'content-type'))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'token' not in data or 'hwid' not in data:
+        return responses.error_body('Token and HWID are required'), 400
+
+    try:
+        hwid = data['hwid']
+        payload, result = flask_backend.validate_without_db(data['token'], hwid)
+        if result is None:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(db_executor, flask_backend.load_and_validate, payload, hwid)
+        return flask_backend.validation_body(payload, result)
+    except Exception as e:
+        return {'error': f'Validation failed: {str(e)}'}, 500
+
+
+async def health(scope, body):
+    return {
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'service': 'Silica Auth Server',
+        'version': '1.0.0',
+        'server': 'asgi'
+    }, 200
+
+
+NATIVE_ROUTES = {
+    ('POST', '/auth/validate'): validate,
+    ('GET', '/health'): health
+}
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for running one ASGI request through the Flask app"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body))
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def call_flask(scope, body, send):
+    """Run the Flask app on wsgi_executor, streaming its response body"""
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    # One thread produces the whole response: streaming views keep that
+    # thread's pooled SQLite connection open between chunks
+    def run():
+        headers_sent = []
+
+        def start_response(status, headers, exc_info=None):
+            headers_sent.append({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            })
+
+        result = flask_backend.app(wsgi_environ(scope, body), start_response)
+        try:
+            send_from_thread(headers_sent[-1])
+            for chunk in result:
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    await loop.run_in_executor(wsgi_executor, run)
+
+
+async def lifespan(receive, send):
+    global http
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            http = httpx.AsyncClient(
+                timeout=httpx.Timeout(outbox.OUTBOX_TIMEOUT, connect=http_client.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=http_client.HTTP_POOL_SIZE)
+            )
+            # Routes notify whichever dispatcher app.outbox_dispatcher names
+            dispatcher = outbox.AsyncOutboxDispatcher(flask_backend.db_pool, send=post_json_async)
+            flask_backend.outbox_dispatcher = dispatcher
+            dispatcher.start()
+            flask_backend.expiry_sweeper.start()
+            flask_backend.profile_sampler.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            flask_backend.outbox_dispatcher.stop()
+            flask_backend.expiry_sweeper.stop()
+            flask_backend.profile_sampler.stop()
+            await http.aclose()
+            wsgi_executor.shutdown(wait=False)
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return await send_json(send, scope, responses.error_body('Request body too large'), 413)
+
+    handler = NATIVE_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await call_flask(scope, body, send)
+
+    started = time.perf_counter()
+    request_id = logs.new_request_id(header(scope, b'x-request-id'))
+    context = logs.current_request_id.set(request_id)
+    try:
+        response, status = await handler(scope, body)
+        await send_json(send, scope, response, status, request_id)
+    finally:
+        logs.current_request_id.reset(context)
+    elapsed = time.perf_counter() - started
+    metrics.http_requests.inc(scope['path'], scope['method'], status)
+    metrics.http_latency.observe(elapsed, scope['path'], scope['method'])
+    metrics.registry.flush()
+    client = scope.get('client')
+    logs.access(request_id, scope['method'], scope['path'], scope['path'], status, elapsed * 1000,
+                client[0] if client else None, service='backend')
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Silica Client Authentication Backend
+Bulk user import/export for users.db
+
+Streams users between users.db and CSV/NDJSON files without going through
+/auth/register: password hashes and TOTP secrets are taken as-is, rows are
+written with large executemany batches and secondary indexes are rebuilt
+once after the load.
+
+    python bulk_users.py export users.ndjson
+    python bulk_users.py export - --format csv > users.csv
+    python bulk_users.py import users.ndjson --on-conflict skip
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import bcrypt
+import pyotp
+
+import hashing
+
+# Columns carried by an export and accepted by an import (besides `password`)
+COLUMNS = [
+    'email', 'password_hash', 'totp_secret', 'hwid', 'created_at', 'expires_at',
+    'last_login', 'is_active', 'discord_id', 'note', 'security_generation'
+]
+
+BATCH_SIZE = 10000
+CONFLICT_CHOICES = ['fail', 'skip', 'replace']
+
+
+class RowError(Exception):
+    """A row that cannot be imported (reported with its line number)"""
+
+
+def open_database(path):
+    if not os.path.exists(path):
+        sys.exit(f"❌ Database {path} not found")
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+        sys.exit("❌ No users table yet - start the backend once (python start.py) to create the schema")
+    return conn
+
+
+def detect_format(path, requested):
+    if requested != 'auto':
+        return requested
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(stream, fmt):
+    """Yield (line_number, dict) pairs from a CSV or NDJSON stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            raise RowError(f'line {line_number}: invalid JSON ({e})')
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def build_row(record, hash_password):
+    """Turn one input record into a users row tuple (in COLUMNS order)"""
+    record = {key: (value if value != '' else None) for key, value in record.items()}
+
+    email = record.get('email')
+    if not email:
+        raise RowError('missing email')
+
+    password_hash = record.get('password_hash')
+    if password_hash is None and record.get('password') is not None:
+        password_hash = hash_password(record['password'])
+    if password_hash is None:
+        raise RowError('missing password_hash (or password)')
+    if isinstance(password_hash, str):
+        if not password_hash.startswith('$2'):
+            raise RowError('password_hash is not a bcrypt hash')
+        # register stores the raw bcrypt bytes
+        password_hash = password_hash.encode()
+
+    totp_secret = record.get('totp_secret')
+    if totp_secret is None:
+        totp_secret = pyotp.random_base32()
+
+    discord_id = record.get('discord_id')
+    if discord_id is not None:
+        discord_id = str(discord_id).strip() or None
+
+    is_active = record.get('is_active')
+    generation = record.get('security_generation')
+    return (
+        str(email).lower().strip(),
+        password_hash,
+        str(totp_secret).strip().upper(),
+        record.get('hwid'),
+        record.get('created_at'),
+        str(record['expires_at']).replace('T', ' ') if record.get('expires_at') else None,
+        record.get('last_login'),
+        1 if is_active is None else int(to_bool(is_active)),
+        discord_id,
+        record.get('note'),
+        int(generation) if generation is not None else 0
+    )
+
+
+def build_insert(on_conflict):
+    """INSERT statement for one row in COLUMNS order"""
+    # created_at has a column default that an explicit NULL would override
+    placeholders = ['COALESCE(?, CURRENT_TIMESTAMP)' if column == 'created_at' else '?' for column in COLUMNS]
+    sql = f'''
+        INSERT{' OR IGNORE' if on_conflict == 'skip' else ''} INTO users ({', '.join(COLUMNS)})
+        VALUES ({', '.join(placeholders)})
+    '''
+    if on_conflict == 'replace':
+        # Update in place so user ids (and the tokens built on them) survive;
+        # the generation bump revokes tokens issued for the old row contents
+        updates = [f'{column} = excluded.{column}' for column in COLUMNS
+                   if column not in ('email', 'created_at', 'security_generation')]
+        updates.append('security_generation = MAX(users.security_generation + 1, excluded.security_generation)')
+        sql += f"ON CONFLICT(email) DO UPDATE SET {', '.join(updates)}"
+    return sql
+
+
+def check_discord_owner(conn, row, pending):
+    """Reject a replace row whose discord_id belongs to another email"""
+    # replace matches on email only; the discord_id UNIQUE index would
+    # otherwise abort the whole batch. pending holds the unflushed rows
+    email, discord_id = row[0], row[COLUMNS.index('discord_id')]
+    if discord_id is None:
+        return
+    owner = pending.get(discord_id)
+    if owner is None:
+        found = conn.execute('SELECT email FROM users WHERE discord_id = ?', (discord_id,)).fetchone()
+        owner = found[0] if found else None
+    if owner is not None and owner != email:
+        raise RowError(f'discord_id {discord_id} belongs to {owner} (replace matches on email only)')
+    pending[discord_id] = email
+
+
+def secondary_indexes(conn):
+    """(name, sql) of every non-unique index on users, safe to drop during a load"""
+    rows = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'users' AND sql IS NOT NULL
+    ''').fetchall()
+    # Unique indexes stay: they are what enforces --on-conflict
+    return [(name, sql) for name, sql in rows if 'UNIQUE' not in sql.upper()]
+
+
+def import_users(args):
+    conn = open_database(args.database)
+    fmt = detect_format(args.input, args.format)
+    stream = sys.stdin if args.input == '-' else open(args.input, newline='' if fmt == 'csv' else None)
+
+    rounds = None
+    def hash_password(password):
+        nonlocal rounds
+        if rounds is None:
+            print("⚠️  Plaintext passwords found, hashing them (slow; prefer password_hash)", file=sys.stderr)
+            # Same cost policy as the backend (BCRYPT_ROUNDS)
+            rounds = hashing.resolve_rounds()
+        return bcrypt.hashpw(str(password).encode(), bcrypt.gensalt(rounds))
+
+    insert_sql = build_insert(args.on_conflict)
+
+    dropped = []
+    if not args.keep_indexes:
+        dropped = secondary_indexes(conn)
+        # Until they are rebuilt, the backend must not trust the schema stamp
+        conn.execute('PRAGMA user_version = 0')
+        for name, _ in dropped:
+            conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    started = time.perf_counter()
+    read = inserted = rejected = 0
+    batch = []
+    # discord_id -> email of the rows in batch, for --on-conflict replace
+    pending = {}
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        conn.execute('BEGIN DEFERRED')
+        try:
+            before = conn.total_changes
+            conn.executemany(insert_sql, batch)
+            conn.execute('COMMIT')
+            inserted += conn.total_changes - before
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        batch.clear()
+        pending.clear()
+
+    try:
+        for line_number, record in read_records(stream, fmt):
+            read += 1
+            try:
+                row = build_row(record, hash_password)
+                if args.on_conflict == 'replace':
+                    check_discord_owner(conn, row, pending)
+                batch.append(row)
+            except (RowError, ValueError, TypeError) as e:
+                rejected += 1
+                if not args.skip_invalid:
+                    raise RowError(f'line {line_number}: {e}')
+                print(f"⚠️  Skipping line {line_number}: {e}", file=sys.stderr)
+            if len(batch) >= args.batch_size:
+                flush()
+                if read % 100000 < args.batch_size:
+                    print(f"   {read} rows read...", file=sys.stderr)
+        flush()
+    except sqlite3.IntegrityError as e:
+        sys.exit(f"❌ Import stopped, batch rolled back: {e} (use --on-conflict skip or replace)")
+    except RowError as e:
+        sys.exit(f"❌ Import stopped at {e}")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        # Rebuild what was dropped in one pass each, then refresh the stats
+        for name, sql in dropped:
+            conn.execute(sql)
+        conn.execute('ANALYZE users')
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Imported {inserted} users ({read} read, {rejected} rejected, "
+          f"{read - rejected - inserted} skipped) in {elapsed:.1f}s "
+          f"({read / elapsed if elapsed else 0:.0f} rows/s)", file=sys.stderr)
+    if args.on_conflict == 'replace':
+        print("⚠️  Running backends keep cached statuses for replaced users until USER_CACHE_TTL passes", file=sys.stderr)
+
+
+def export_users(args):
+    conn = open_database(args.database)
+    fmt = detect_format(args.output, args.format)
+    stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='' if fmt == 'csv' else None)
+
+    where = '' if args.include_inactive else 'WHERE is_active = 1'
+    cursor = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM users {where} ORDER BY id')
+
+    started = time.perf_counter()
+    count = 0
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(args.batch_size)
+            if not rows:
+                break
+            lines = []
+            for row in rows:
+                row = list(row)
+                if isinstance(row[1], bytes):
+                    row[1] = row[1].decode()
+                if writer:
+                    lines.append(row)
+                else:
+                    lines.append(json.dumps(dict(zip(COLUMNS, row)), separators=(',', ':')))
+            if writer:
+                writer.writerows(lines)
+            else:
+                stream.write('\n'.join(lines) + '\n')
+            count += len(rows)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Exported {count} users in {elapsed:.1f}s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import/export of Silica users')
+    parser.add_argument('--database', default='users.db', help='SQLite database (default users.db)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help='load users from CSV or NDJSON')
+    importer.add_argument('input', help="input file, or '-' for stdin")
+    importer.add_argument('--format', choices=['auto', 'csv', 'ndjson'], default='auto')
+    importer.add_argument('--on-conflict', choices=CONFLICT_CHOICES, default='fail',
+                          help='existing email or discord_id: fail (default), skip the row, or replace '
+                               'the user with that email (a discord_id owned by another email is rejected)')
+    importer.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    importer.add_argument('--skip-invalid', action='store_true', help='report and skip malformed rows')
+    importer.add_argument('--keep-indexes', action='store_true',
+                          help="don't drop/rebuild secondary indexes (small loads into a live database)")
+    importer.set_defaults(handler=import_users)
+
+    exporter = commands.add_parser('export', help='stream users to CSV or NDJSON')
+    exporter.add_argument('output', help="output file, or '-' for stdout")
+    exporter.add_argument('--format', choices=['auto', 'csv', 'ndjson'], default='auto')
+    exporter.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    exporter.add_argument('--active-only', dest='include_inactive', action='store_false',
+                          help='only export active accounts')
+    exporter.set_defaults(handler=export_users)
+
+    args = parser.parse_args(argv)
+    if args.batch_size <= 0:
+        parser.error('--batch-size must be positive')
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+In-process cache of per-user validation status.
+
+/auth/validate only needs (hwid, is_active, expires_at) for the token's user.
+Those fields change rarely, so they are served from a bounded LRU with a TTL
+and dropped by every route that mutates them.
+
+With several worker processes, CacheSync carries those drops to the other
+workers through a log kept in the store.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+# Seconds between checks of the shared invalidation log; 0 checks before
+# every answer served from cache
+CACHE_SYNC_INTERVAL = float(os.environ.get('CACHE_SYNC_INTERVAL', 0))
+
+
+class UserStatusCache:
+    """Thread-safe LRU/TTL cache keyed by user_id"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (expires, email, status)
+        self._ids_by_email = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Called with the user_id (None for clear()) of every local invalidation
+        self.on_invalidate = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self):
+        """Changes on every invalidation; pass it back to put()"""
+        return self._generation
+
+    def get(self, user_id, email):
+        """Return the cached (hwid, is_active, expires_at) tuple or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] != email:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, user_id, email, status, generation=None):
+        """Store a status read from the database.
+
+        If an invalidation happened since `generation` was taken the value
+        may already be stale, so it is not cached.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._drop(user_id)
+            self._entries[user_id] = (time.monotonic() + self.ttl, email, tuple(status))
+            self._ids_by_email[email] = user_id
+            while len(self._entries) > self.max_size:
+                old_id, old_entry = self._entries.popitem(last=False)
+                self._ids_by_email.pop(old_entry[1], None)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Forget a single user by id"""
+        self.forget(user_id)
+        if self.on_invalidate is not None:
+            self.on_invalidate(user_id)
+
+    def clear(self):
+        """Forget everything (bulk resets)"""
+        self.forget(None)
+        if self.on_invalidate is not None:
+            self.on_invalidate(None)
+
+    def forget(self, user_id):
+        """Drop one user (None: everyone) without calling on_invalidate"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if user_id is None:
+                self._entries.clear()
+                self._ids_by_email.clear()
+            else:
+                self._drop(user_id)
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._ids_by_email.pop(entry[1], None)
+
+    def stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Remove and return a value (or None)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry is not None else None
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class GenerationCache(TTLCache):
+    """user_id -> security generation, which only ever grows
+
+    Login and refresh read the generation before their slow steps (bcrypt,
+    TOTP); an admin bump landing meanwhile must not be overwritten with
+    that older value, so put() never lowers a cached generation.
+    """
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > value:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class CacheSync:
+    """Replays the cache invalidations other worker processes logged in the store"""
+
+    def __init__(self, store, interval=CACHE_SYNC_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._targets = []
+        self._last_id = None
+        self._pid = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.replayed = 0
+
+    def add_target(self, forget):
+        """Call forget(user_id) for every logged invalidation (None: everyone)"""
+        self._targets.append(forget)
+
+    def publish(self, user_id):
+        """Log a local invalidation for the other workers"""
+        self.store.log_invalidation(user_id)
+        self.published += 1
+
+    def poll(self):
+        """Apply the invalidations logged since the last poll"""
+        now = time.monotonic()
+        if self.interval and now - self._checked_at < self.interval:
+            return
+        if self._pid != os.getpid():
+            # A new (forked) worker starts with empty caches: only later entries matter
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._last_id = self.store.last_invalidation_id()
+                    self._pid = os.getpid()
+            return
+        entries = self.store.invalidations_after(self._last_id)
+        self._checked_at = now
+        if not entries:
+            return
+        with self._lock:
+            for entry_id, user_id in entries:
+                if entry_id <= self._last_id:
+                    continue  # applied by another thread meanwhile
+                for forget in self._targets:
+                    forget(user_id)
+                self._last_id = entry_id
+                self.replayed += 1
+
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'last_id': self._last_id,
+            'published': self.published,
+            'replayed': self.replayed
+        }
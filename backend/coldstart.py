@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Silica Client Authentication Backend
+Cold-start benchmark for `import app`
+
+Imports the backend in fresh interpreters, the way a scale-to-zero platform
+boots it: once against an empty data directory (first boot, schema created)
+and --runs times against the now existing database (restart, schema stamp
+current). Each run also times the first /auth/validate call. Prints a JSON
+report and exits with status 1 when cold start regressed:
+
+  - a module that must stay lazy (LAZY_MODULES) was loaded by `import app`
+  - the median restart import exceeds --max-ms
+  - the median restart import is more than --tolerance slower than the
+    report given with --baseline
+
+    python coldstart.py --runs 7 --output coldstart.json
+    python coldstart.py --baseline coldstart.json --tolerance 0.25
+"""
+
+import argparse
+import compileall
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Loaded on first use only; /auth/validate needs none of them
+LAZY_MODULES = ('qrcode', 'PIL', 'requests', 'urllib3', 'bcrypt', 'pyotp', 'asyncio', 'cProfile')
+
+# Runs inside the fresh interpreter; writes its measurements to argv[1]
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, {backend_dir!r})
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+loaded = [name for name in {lazy!r} if name in sys.modules]
+client = app.app.test_client()
+started = time.perf_counter()
+status = client.post('/auth/validate', json={{'token': 'x', 'hwid': 'x'}}).status_code
+validate_ms = (time.perf_counter() - started) * 1000
+with open(sys.argv[1], 'w') as f:
+    json.dump({{'import_ms': import_ms, 'first_validate_ms': validate_ms,
+               'validate_status': status, 'lazy_loaded': loaded}}, f)
+'''
+
+
+def log(message):
+    # stdout is reserved for the JSON report
+    print(message, file=sys.stderr)
+
+
+def child_env():
+    env = dict(os.environ)
+    # No sweeper/outbox threads: only what the import itself costs
+    env['SILICA_MANAGED_STARTUP'] = '1'
+    env['STORAGE_ENGINE'] = 'sqlite'
+    env['BCRYPT_ROUNDS'] = env.get('BCRYPT_ROUNDS', '12')
+    return env
+
+
+def boot(workdir, importtime=False):
+    """Import the app in a new interpreter; returns the child's measurements"""
+    result_path = os.path.join(workdir, 'coldstart-result.json')
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', CHILD.format(backend_dir=BACKEND_DIR, lazy=LAZY_MODULES), result_path]
+    process = subprocess.run(command, cwd=workdir, env=child_env(), stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'import app failed:\n{process.stderr[-2000:]}')
+    with open(result_path) as f:
+        result = json.load(f)
+    if importtime:
+        result['stderr'] = process.stderr
+    return result
+
+
+def slowest_imports(importtime_output, count):
+    """Top-level modules with the largest cumulative import time (-X importtime)"""
+    modules = []
+    for line in importtime_output.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match and len(match.group(3)) <= 2:
+            modules.append((int(match.group(2)) / 1000, match.group(4).strip()))
+    modules.sort(reverse=True)
+    return [{'module': name, 'cumulative_ms': round(ms, 2)} for ms, name in modules[:count]]
+
+
+def summarize(values):
+    return {
+        'median': round(statistics.median(values), 2),
+        'min': round(min(values), 2),
+        'max': round(max(values), 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure and guard the backend cold-start time')
+    parser.add_argument('--runs', type=int, default=5, help='restart imports to measure (default 5)')
+    parser.add_argument('--max-ms', type=float, help='fail when the median restart import exceeds this')
+    parser.add_argument('--baseline', help='earlier JSON report to compare the median restart import with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against --baseline (default 0.25 = 25%%)')
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to report (default 10)')
+    parser.add_argument('--no-compile', action='store_true',
+                        help='do not byte-compile the backend first (measures source compilation too)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.runs <= 0:
+        parser.error('--runs must be positive')
+
+    if not args.no_compile:
+        # Deployments ship bytecode (Dockerfile, nixpacks), so measure with it
+        compileall.compile_dir(BACKEND_DIR, maxlevels=0, quiet=1)
+
+    started_at = datetime.utcnow().isoformat() + 'Z'
+    workdir = tempfile.mkdtemp(prefix='silica-coldstart-')
+    try:
+        log(f"🧊 First boot in {workdir}...")
+        first = boot(workdir)
+        log(f"🔁 {args.runs} restarts...")
+        restarts = [boot(workdir) for _ in range(args.runs)]
+        profiled = boot(workdir, importtime=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import_ms = summarize([run['import_ms'] for run in restarts])
+    report = {
+        'started_at': started_at,
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'first_boot_import_ms': round(first['import_ms'], 2),
+        'restart_import_ms': import_ms,
+        'first_validate_ms': summarize([run['first_validate_ms'] for run in restarts]),
+        'lazy_loaded': sorted({name for run in [first] + restarts for name in run['lazy_loaded']}),
+        'slowest_imports': slowest_imports(profiled['stderr'], args.top)
+    }
+
+    failures = []
+    if report['lazy_loaded']:
+        failures.append(f"import app loaded lazy modules: {', '.join(report['lazy_loaded'])}")
+    if args.max_ms is not None and import_ms['median'] > args.max_ms:
+        failures.append(f"median restart import {import_ms['median']} ms > --max-ms {args.max_ms:g}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['restart_import_ms']['median']
+        report['baseline_import_ms'] = baseline
+        if import_ms['median'] > baseline * (1 + args.tolerance):
+            failures.append(f"median restart import {import_ms['median']} ms is more than "
+                            f"{args.tolerance:.0%} over the baseline {baseline} ms")
+    report['failures'] = failures
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"✅ Report written to {args.output}")
+    else:
+        print(output)
+
+    log(f"   first boot {report['first_boot_import_ms']} ms, restart median {import_ms['median']} ms, "
+        f"first validate median {report['first_validate_ms']['median']} ms")
+    for failure in failures:
+        log(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+SQLite connection management for the Silica auth backend.
+
+Each worker thread keeps one long-lived connection instead of opening the
+database file on every request. Connections are opened in WAL mode so
+readers never block on the occasional admin write.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Tuning knobs (overridable through the environment)
+CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 8192))
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+STATEMENT_CACHE_SIZE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 256))
+BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 10))
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor recording statement execution time as the 'sqlite' stage"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_stage('sqlite', time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_stage('sqlite', time.perf_counter() - started)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() hands it back to the pool instead of closing"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def close(self):
+        # Discard anything the caller left uncommitted (early returns, errors)
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        """Close the underlying database handle"""
+        super().close()
+
+
+class ConnectionPool:
+    """Keeps one tuned connection per worker thread (and per process)"""
+
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=BUSY_TIMEOUT,
+            factory=PooledConnection,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def _check_fork(self):
+        """Drop connections inherited from a parent process (gunicorn preload)"""
+        pid = os.getpid()
+        if pid != self._pid:
+            with self._lock:
+                if pid != self._pid:
+                    self._local = threading.local()
+                    self._connections = []
+                    self._pid = pid
+
+    def connect(self):
+        """Return this thread's connection, ready for a fresh unit of work"""
+        self._check_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        elif conn.in_transaction:
+            # A previous request died mid-transaction on this thread
+            conn.rollback()
+        return conn
+
+    def close_all(self):
+        """Close every connection opened by this process"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.really_close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        """Basic pool information for diagnostics"""
+        with self._lock:
+            return {
+                'database': self.database,
+                'pid': self._pid,
+                'connections': len(self._connections)
+            }
@@ -0,0 +1,64 @@
+"""
+Gunicorn configuration for the Silica auth backend (multi-worker mode)
+
+    cd backend && gunicorn -c gunicorn.conf.py app:app
+
+The app is preloaded in the master, which runs init_db() once and loads or
+creates the shared JWT signing key before any worker exists. Workers are
+threaded: request threads mostly wait on SQLite, while bcrypt runs on each
+worker's small hashing pool, sized so all workers together roughly match
+the number of cores.
+"""
+
+import glob
+import os
+
+# Usable cores, respecting CPU affinity where the platform exposes it
+try:
+    CPU_COUNT = len(os.sched_getaffinity(0))
+except AttributeError:
+    CPU_COUNT = os.cpu_count() or 1
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+
+# Capped by default: hosts often report far more cores than a container may use
+workers = int(os.environ.get('GUNICORN_WORKERS', min(CPU_COUNT, 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+preload_app = True
+# The app writes sampled JSON access records itself (logs.py); set
+# GUNICORN_ACCESSLOG=- to get gunicorn's unsampled line per request as well
+accesslog = os.environ.get('GUNICORN_ACCESSLOG') or None
+errorlog = '-'
+
+# Read by app.py while it is being preloaded (this file runs first)
+os.environ['SILICA_MANAGED_STARTUP'] = '1'
+# Tells app.py to share cache invalidations with the other workers
+os.environ['SILICA_WORKERS'] = str(workers)
+os.environ.setdefault('BCRYPT_WORKERS', str(max(1, CPU_COUNT // workers)))
+# /metrics has to merge the snapshots of every worker
+os.environ.setdefault('METRICS_DIR', os.path.join('/tmp', f"silica-metrics-{os.environ.get('PORT', '5000')}"))
+
+
+def on_starting(server):
+    # Snapshots left by a previous run may carry pids that get reused now
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], 'backend-*.json')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_tasks()
+
+
+def worker_exit(server, worker):
+    # Counts since the last periodic snapshot would otherwise be lost
+    import metrics
+    metrics.registry.flush(force=True)
@@ -0,0 +1,248 @@
+"""
+Bounded worker pool for bcrypt password work.
+
+bcrypt releases the GIL while hashing, so running it on a small dedicated
+pool keeps request threads free for cheap calls such as /auth/validate and
+/health while a burst of logins is being processed.
+
+The bcrypt cost is a policy: a fixed BCRYPT_ROUNDS, or BCRYPT_ROUNDS=auto to
+measure this host at startup and pick the highest cost whose hash time
+stays within BCRYPT_TARGET_MS. Hashes made at any other cost are rehashed
+in the background after a successful login.
+
+bcrypt itself is imported on first use, so processes that only validate
+tokens never load it.
+
+    python hashing.py    # print the cost 'auto' would pick on this host
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import logs
+import metrics
+
+log = logs.get_logger('hashing')
+
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', 32))
+BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 30))
+
+# 12 is bcrypt.gensalt()'s default, which every existing hash was made with
+BCRYPT_ROUNDS = os.environ.get('BCRYPT_ROUNDS', '12')
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', 250))
+BCRYPT_MIN_ROUNDS = int(os.environ.get('BCRYPT_MIN_ROUNDS', 10))
+BCRYPT_MAX_ROUNDS = int(os.environ.get('BCRYPT_MAX_ROUNDS', 16))
+
+
+def hash_rounds(stored_hash):
+    """Cost of a '$2b$12$...' hash, or None when it is not a bcrypt hash"""
+    if isinstance(stored_hash, bytes):
+        stored_hash = stored_hash.decode('ascii', 'replace')
+    parts = str(stored_hash).split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def calibrate_rounds(target_ms=BCRYPT_TARGET_MS, min_rounds=BCRYPT_MIN_ROUNDS,
+                     max_rounds=BCRYPT_MAX_ROUNDS, samples=2):
+    """(rounds, estimated_ms): the highest cost hashing within target_ms here
+
+    Each extra round doubles the work, so one measurement at min_rounds
+    (best of `samples`, to skip warm-up noise) predicts every other cost.
+    """
+    measured = min(_time_hash(min_rounds) for _ in range(samples))
+    extra = math.floor(math.log2(target_ms / measured)) if measured < target_ms else 0
+    rounds = max(min_rounds, min(max_rounds, min_rounds + extra))
+    return rounds, measured * 2 ** (rounds - min_rounds)
+
+
+def _time_hash(rounds):
+    import bcrypt
+
+    started = time.perf_counter()
+    bcrypt.hashpw(b'calibration password', bcrypt.gensalt(rounds))
+    return (time.perf_counter() - started) * 1000
+
+
+def resolve_rounds(setting=BCRYPT_ROUNDS):
+    """bcrypt cost for a BCRYPT_ROUNDS setting ('auto' calibrates on this host)"""
+    if str(setting).strip().lower() == 'auto':
+        rounds, estimated_ms = calibrate_rounds()
+        log.info("Calibrated bcrypt cost", extra={'rounds': rounds, 'estimated_ms': round(estimated_ms), 'target_ms': BCRYPT_TARGET_MS})
+        return rounds
+    rounds = int(setting)
+    if not 4 <= rounds <= 31:
+        raise ValueError(f'BCRYPT_ROUNDS must be between 4 and 31 or auto, got {setting!r}')
+    return rounds
+
+
+class HashingBusyError(Exception):
+    """Raised when the password pool queue is full"""
+
+
+class HashingTimeoutError(HashingBusyError):
+    """Raised when a hash/verify call does not finish within BCRYPT_TIMEOUT"""
+
+
+class PasswordHasher:
+    """Runs bcrypt hash/verify calls on a fixed-size thread pool"""
+
+    def __init__(self, workers=BCRYPT_WORKERS, max_queue=BCRYPT_MAX_QUEUE, timeout=BCRYPT_TIMEOUT,
+                 rounds=None):
+        # Resolved once: under gunicorn that is in the preloading master
+        self.rounds = resolve_rounds() if rounds is None else rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_pending = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.rehashed = 0
+        self.rehash_skipped = 0
+
+    def _get_executor(self):
+        # Executors do not survive fork, so build one lazily per process
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='bcrypt'
+                    )
+                    self._pid = pid
+        return self._executor
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashingBusyError('Password hashing queue is full')
+            self._pending += 1
+            self.max_pending = max(self.max_pending, self._pending)
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                finished = time.perf_counter()
+                metrics.observe_stage('bcrypt_queue_wait', started - submitted)
+                metrics.observe_stage('bcrypt', finished - started)
+                with self._lock:
+                    wait = started - submitted
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    self.total_run += finished - started
+                    # Released by the job itself: a caller that gave up waiting
+                    # must not free a slot bcrypt is still using
+                    self._pending -= 1
+                    self.completed += 1
+
+        future = self._get_executor().submit(task)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timed_out += 1
+                # Still queued: it will never run, so release its slot here
+                if future.cancel():
+                    self._pending -= 1
+            raise HashingTimeoutError('Password hashing timed out') from None
+
+    def _hashpw(self, password):
+        import bcrypt
+
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds))
+
+    def hash(self, password):
+        """bcrypt-hash a password string at the policy cost, returning the hash bytes"""
+        return self._run(self._hashpw, password)
+
+    def needs_rehash(self, stored_hash):
+        """True when a stored hash was made at a different cost than the policy"""
+        rounds = hash_rounds(stored_hash)
+        return rounds is not None and rounds != self.rounds
+
+    def rehash_later(self, password, on_hashed):
+        """Hash password at the policy cost in the background, then call on_hashed(new_hash)
+
+        Never blocks the caller. Skipped when the pool is saturated: the next
+        login simply tries again.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rehash_skipped += 1
+                return False
+            self._pending += 1
+
+        def task():
+            started = time.perf_counter()
+            try:
+                new_hash = self._hashpw(password)
+                metrics.observe_stage('bcrypt', time.perf_counter() - started)
+                on_hashed(new_hash)
+                with self._lock:
+                    self.rehashed += 1
+            except Exception:
+                log.exception("Password rehash failed")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        self._get_executor().submit(task)
+        return True
+
+    def verify(self, password, stored_hash):
+        """Check a password string against a stored bcrypt hash"""
+        import bcrypt
+
+        if isinstance(stored_hash, str):
+            stored_hash = stored_hash.encode()
+        return self._run(bcrypt.checkpw, password.encode(), stored_hash)
+
+    def stats(self):
+        """Queue depth and wait-time metrics"""
+        with self._lock:
+            in_flight = min(self._pending, self.workers)
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': in_flight,
+                'queue_depth': self._pending - in_flight,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_ms': round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'avg_run_ms': round(self.total_run / self.completed * 1000, 2) if self.completed else 0.0,
+                'rehashed': self.rehashed,
+                'rehash_skipped': self.rehash_skipped
+            }
+
+
+if __name__ == '__main__':
+    for rounds in range(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS + 1):
+        elapsed_ms = _time_hash(rounds)
+        print(f"   cost {rounds}: {elapsed_ms:.0f} ms")
+        if elapsed_ms > BCRYPT_TARGET_MS * 4:
+            break
+    rounds, estimated_ms = calibrate_rounds()
+    print(f"✅ BCRYPT_ROUNDS=auto picks {rounds} (~{estimated_ms:.0f} ms, target {BCRYPT_TARGET_MS:g} ms)")
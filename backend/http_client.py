@@ -0,0 +1,191 @@
+"""
+Shared outbound HTTP client.
+
+Every upstream (the Discord bot, the auth backend, ...) gets one pooled
+keep-alive requests.Session with its own timeouts, a small retry budget for
+connection failures and a circuit breaker, plus latency/error counters.
+Used by both the backend and the store (website/store.py).
+"""
+
+import os
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+HTTP_BREAKER_THRESHOLD = int(os.environ.get('HTTP_BREAKER_THRESHOLD', 5))
+HTTP_BREAKER_COOLDOWN = float(os.environ.get('HTTP_BREAKER_COOLDOWN', 30))
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES = {502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while an upstream's breaker is open"""
+
+
+def _never_sent(error):
+    """True when a failed request provably never reached the server"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class Upstream:
+    """Pooled client for one upstream service"""
+
+    def __init__(self, name, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, breaker_threshold=HTTP_BREAKER_THRESHOLD,
+                 breaker_cooldown=HTTP_BREAKER_COOLDOWN, pool_size=HTTP_POOL_SIZE):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.pool_size = pool_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Circuit breaker state
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        # Counters
+        self.requests = 0
+        self.errors = 0
+        self.retried = 0
+        self.rejected = 0
+        self.breaker_opens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.status_counts = {}
+
+    def _get_session(self):
+        # Pooled sockets must not be shared across a fork
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = pid
+        return self._session
+
+    def _before_request(self):
+        with self._lock:
+            if self._open_until:
+                if time.monotonic() < self._open_until or self._trial_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'Circuit open for upstream {self.name}')
+                # Half-open: let a single trial request through
+                self._trial_in_flight = True
+
+    def _record(self, elapsed, status=None, failed=False):
+        metrics.upstream_latency.observe(elapsed, self.name, 'error' if failed else 'ok')
+        with self._lock:
+            self.requests += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            if status is not None:
+                self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            self._trial_in_flight = False
+            if failed:
+                self.errors += 1
+                self._consecutive_failures += 1
+                if self._consecutive_failures >= self.breaker_threshold:
+                    now = time.monotonic()
+                    if now >= self._open_until:
+                        self.breaker_opens += 1
+                    self._open_until = now + self.breaker_cooldown
+            else:
+                self._consecutive_failures = 0
+                self._open_until = 0.0
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pool; raises requests exceptions on failure"""
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self._before_request()
+            started = time.perf_counter()
+            try:
+                response = self._get_session().request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self._record(time.perf_counter() - started, failed=True)
+                # Non-idempotent requests are only retried if they never left this host
+                retryable = method in IDEMPOTENT_METHODS or _never_sent(e)
+                if attempt < self.retries and retryable:
+                    attempt += 1
+                    self.retried += 1
+                    time.sleep(0.1 * attempt)
+                    continue
+                raise
+            except requests.exceptions.RequestException:
+                self._record(time.perf_counter() - started, failed=True)
+                raise
+
+            failed = response.status_code >= 500
+            self._record(time.perf_counter() - started, response.status_code, failed)
+            if failed and response.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS \
+                    and attempt < self.retries:
+                attempt += 1
+                self.retried += 1
+                time.sleep(0.1 * attempt)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        """GET through the pool"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """POST through the pool"""
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Latency and error counters for this upstream"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retried': self.retried,
+                'rejected_by_breaker': self.rejected,
+                'breaker_opens': self.breaker_opens,
+                'breaker_open': bool(self._open_until and time.monotonic() < self._open_until),
+                'avg_latency_ms': round(self.latency_total / self.requests * 1000, 2) if self.requests else 0.0,
+                'max_latency_ms': round(self.latency_max * 1000, 2),
+                'status_codes': {str(code): count for code, count in self.status_counts.items()}
+            }
+
+
+_upstreams = {}
+_registry_lock = threading.Lock()
+
+
+def get_upstream(name, **options):
+    """Return the shared client for `name`, creating it with `options` on first use"""
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _registry_lock:
+            upstream = _upstreams.get(name)
+            if upstream is None:
+                upstream = _upstreams[name] = Upstream(name, **options)
+    return upstream
+
+
+def upstream_stats():
+    """Counters for every upstream used by this process"""
+    return {name: upstream.stats() for name, upstream in list(_upstreams.items())}
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Silica Client Authentication Backend
+Load-testing harness for the auth endpoints
+
+Boots the app (gunicorn by default) against a throwaway database seeded with
+N users, drives a weighted mix of login / validate / register / admin calls
+at each requested concurrency level and prints throughput plus p50/p95/p99
+latency per operation as JSON.
+
+    python loadtest.py --users 1000 --concurrency 1,8,32 --duration 15
+    python loadtest.py --mix validate=90,login=5,admin=5 --output result.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+import pyotp
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = 'validate=80,login=10,register=5,admin=5'
+SEED_PASSWORD = 'loadtest-password'
+
+
+def parse_mix(text):
+    """Parse 'op=weight,...' into a dict, rejecting unknown operations"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name!r} (choose from {", ".join(OPERATIONS)})')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Invalid weight for {name!r}')
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError('Mix needs at least one positive weight')
+    return mix
+
+
+def parse_levels(text):
+    """Parse '1,8,32' into a list of positive ints"""
+    try:
+        levels = [int(part) for part in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Concurrency levels must be integers')
+    if not levels or min(levels) <= 0:
+        raise argparse.ArgumentTypeError('Concurrency levels must be positive')
+    return levels
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def log(message):
+    # stdout is reserved for the JSON report
+    print(message, file=sys.stderr, flush=True)
+
+
+class Server:
+    """The backend running in a child process with its own working directory"""
+
+    def __init__(self, kind, workers, threads, bcrypt_rounds):
+        self.kind = kind
+        self.workers = workers
+        self.threads = threads
+        self.bcrypt_rounds = bcrypt_rounds
+        self.workdir = tempfile.mkdtemp(prefix='silica-loadtest-')
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.admin_key = secrets.token_urlsafe(24)
+        self.process = None
+
+    @property
+    def database(self):
+        # app.py opens users.db relative to its working directory
+        return os.path.join(self.workdir, 'users.db')
+
+    def start(self, timeout=30):
+        env = dict(os.environ)
+        env.update({
+            'ADMIN_KEY': self.admin_key,
+            'SECRET_KEY': secrets.token_hex(32),
+            'PYTHONPATH': os.pathsep.join(filter(None, [BACKEND_DIR, env.get('PYTHONPATH')])),
+            'PORT': str(self.port),
+            'HOST': '127.0.0.1',
+            # Seeded hashes use this cost too, so logins never trigger rehashes
+            'BCRYPT_ROUNDS': str(self.bcrypt_rounds),
+            # Every simulated client shares 127.0.0.1: measure the routes, not 429s
+            'RATE_LIMIT_ENABLED': '0'
+        })
+        env.pop('METRICS_DIR', None)
+
+        if self.kind == 'gunicorn':
+            command = [
+                sys.executable, '-m', 'gunicorn', 'app:app',
+                '--config', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+                '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(self.workers),
+                '--threads', str(self.threads),
+                '--log-level', 'warning'
+            ]
+        else:
+            command = [
+                sys.executable, '-c',
+                'from app import app; '
+                f'app.run(host="127.0.0.1", port={self.port}, threaded=True, debug=False)'
+            ]
+
+        log_file = open(os.path.join(self.workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=env,
+                                        stdout=log_file, stderr=subprocess.STDOUT)
+        log_file.close()
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited early, see {self.workdir}/server.log')
+            try:
+                if requests.get(f'{self.url}/health', timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError('Server did not become healthy in time')
+
+    def stop(self, keep=False):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if keep:
+            log(f"📁 Kept working directory {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def seed_users(database, count, bcrypt_rounds):
+    """Insert `count` active users sharing one password; returns their credentials"""
+    # One bcrypt hash at the server's cost is reused so seeding stays fast
+    password_hash = bcrypt.hashpw(SEED_PASSWORD.encode(), bcrypt.gensalt(bcrypt_rounds)).decode()
+    expires_at = (datetime.now() + timedelta(days=30)).isoformat(' ')
+    users = [{
+        'email': f'seed{i}@loadtest.local',
+        'totp_secret': pyotp.random_base32(),
+        'hwid': f'loadtest-hwid-{i}'
+    } for i in range(count)]
+
+    conn = sqlite3.connect(database, timeout=30)
+    conn.executemany('''
+        INSERT INTO users (email, password_hash, totp_secret, hwid, is_active, expires_at)
+        VALUES (?, ?, ?, ?, 1, ?)
+    ''', [(u['email'], password_hash, u['totp_secret'], u['hwid'], expires_at) for u in users])
+    conn.commit()
+    conn.close()
+    return users
+
+
+class LoadContext:
+    """Shared state for the operation functions"""
+
+    def __init__(self, server, users, tokens):
+        self.url = server.url
+        self.admin_headers = {'X-Admin-Key': server.admin_key}
+        self.users = users
+        self.tokens = tokens
+        self.run_id = secrets.token_hex(4)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_email(self):
+        with self._lock:
+            self._counter += 1
+            return f'new-{self.run_id}-{self._counter}@loadtest.local'
+
+
+def login_request(ctx, session, user):
+    return session.post(f'{ctx.url}/auth/login', json={
+        'email': user['email'],
+        'password': SEED_PASSWORD,
+        'totp': pyotp.TOTP(user['totp_secret']).now(),
+        'hwid': user['hwid']
+    })
+
+
+def op_login(ctx, session, rng):
+    return login_request(ctx, session, rng.choice(ctx.users))
+
+
+def op_validate(ctx, session, rng):
+    token, hwid = rng.choice(ctx.tokens)
+    return session.post(f'{ctx.url}/auth/validate', json={'token': token, 'hwid': hwid})
+
+
+def op_register(ctx, session, rng):
+    return session.post(f'{ctx.url}/auth/register', json={'email': ctx.next_email()})
+
+
+def op_admin(ctx, session, rng):
+    choice = rng.random()
+    if choice < 0.4:
+        return session.get(f'{ctx.url}/auth/user-info', headers=ctx.admin_headers,
+                           params={'email': rng.choice(ctx.users)['email']})
+    if choice < 0.7:
+        return session.get(f'{ctx.url}/auth/users', headers=ctx.admin_headers, params={'limit': 50})
+    return session.post(f'{ctx.url}/auth/add-duration', headers=ctx.admin_headers,
+                        json={'email': rng.choice(ctx.users)['email'], 'days': 1})
+
+
+OPERATIONS = {
+    'login': op_login,
+    'validate': op_validate,
+    'register': op_register,
+    'admin': op_admin
+}
+
+
+def issue_tokens(ctx, count):
+    """Log in `count` seeded users so validate calls have real tokens"""
+    session = requests.Session()
+    tokens = []
+    for user in ctx.users[:count]:
+        response = login_request(ctx, session, user)
+        if response.status_code != 200:
+            raise RuntimeError(f'Warm-up login failed: {response.status_code} {response.text[:200]}')
+        tokens.append((response.json()['token'], user['hwid']))
+    return tokens
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """Throughput, error count and latency percentiles (ms) for a sample list"""
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    errors = 0
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            errors += 1
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None
+        },
+        'status_codes': statuses
+    }
+
+
+def run_level(ctx, mix, concurrency, duration, warmup, seed):
+    """Drive the mix with `concurrency` threads; returns the level report"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        local = {name: [] for name in names}
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = OPERATIONS[name](ctx, session, rng).status_code
+            except requests.exceptions.RequestException as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - started
+            # Requests started during warm-up are not recorded
+            if now >= start_at:
+                local[name].append((latency, status))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_samples = [sample for values in samples.values() for sample in values]
+    report = summarize(all_samples, duration)
+    report['concurrency'] = concurrency
+    report['operations'] = {name: summarize(values, duration) for name, values in samples.items() if values}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the Silica auth backend')
+    parser.add_argument('--users', type=int, default=1000, help='seeded users (default 1000)')
+    parser.add_argument('--concurrency', type=parse_levels, default=[1, 8, 32],
+                        help='comma-separated concurrency levels (default 1,8,32)')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per level (default 10)')
+    parser.add_argument('--warmup', type=float, default=1, help='unmeasured seconds before each level (default 1)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'operation weights (default {DEFAULT_MIX})')
+    parser.add_argument('--tokens', type=int, default=16, help='distinct login tokens used by validate (default 16)')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers (default 1)')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker (default 4)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the request mix')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='bcrypt cost of the server and seeded users (default 12)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the temp database and server log')
+    args = parser.parse_args(argv)
+
+    if args.users <= 0 or args.tokens <= 0:
+        parser.error('--users and --tokens must be positive')
+
+    started_at = datetime.utcnow().isoformat() + 'Z'
+    server = Server(args.server, args.workers, args.threads, args.bcrypt_rounds)
+    try:
+        log(f"🚀 Starting {args.server} on {server.url} (workdir {server.workdir})")
+        server.start()
+
+        log(f"🌱 Seeding {args.users} users...")
+        users = seed_users(server.database, args.users, args.bcrypt_rounds)
+        ctx = LoadContext(server, users, [])
+        ctx.tokens = issue_tokens(ctx, min(args.tokens, len(users)))
+
+        levels = []
+        for concurrency in args.concurrency:
+            log(f"📈 Concurrency {concurrency} for {args.duration:g}s...")
+            level = run_level(ctx, args.mix, concurrency, args.duration, args.warmup, args.seed)
+            log(f"   {level['throughput_rps']} req/s, p50 {level['latency_ms']['p50']} ms, "
+                f"p99 {level['latency_ms']['p99']} ms, {level['errors']} errors")
+            levels.append(level)
+    finally:
+        server.stop(keep=args.keep)
+
+    report = {
+        'started_at': started_at,
+        'config': {
+            'server': args.server,
+            'workers': args.workers,
+            'threads': args.threads,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'users': args.users,
+            'tokens': args.tokens,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'mix': args.mix,
+            'seed': args.seed
+        },
+        'levels': levels
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"✅ Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
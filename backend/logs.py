@@ -0,0 +1,240 @@
+"""
+Structured JSON logging for the backend and the store.
+
+Every record is written as one JSON object per line by a QueueListener
+thread, so request threads only pay for a queue put and never block on
+stdout. The queue is bounded: when the writer falls behind, records are
+dropped and counted instead of slowing requests down.
+
+instrument_flask() adds a request ID (X-Request-ID, generated when the
+client sends none) and timing to an access record per request. Successful
+calls on noisy routes are sampled through LOG_SAMPLE_RATES; errors and slow
+requests are always logged. Other records logged during a request carry
+its request ID as well.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Fraction of successful requests logged per route, e.g. '/health=0.01'
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '/auth/validate=0.01,/health=0.01,/metrics=0')
+LOG_SAMPLE_DEFAULT = float(os.environ.get('LOG_SAMPLE_DEFAULT', 1))
+# Requests at least this slow are logged whatever the sample rate
+LOG_SLOW_MS = float(os.environ.get('LOG_SLOW_MS', 1000))
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+MAX_REQUEST_ID_LENGTH = 128
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+current_request_id = ContextVar('request_id', default=None)
+
+root = logging.getLogger('silica')
+access_log = logging.getLogger('silica.access')
+
+
+def parse_sample_rates(spec):
+    """'/a=0.01,/b=0' -> {'/a': 0.01, '/b': 0.0}"""
+    rates = {}
+    for item in spec.split(','):
+        route, _, rate = item.strip().rpartition('=')
+        if route:
+            rates[route] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, pid and extra fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve everything that depends on the calling thread, but leave
+        # the JSON encoding to the listener
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if not hasattr(record, 'request_id'):
+            request_id = current_request_id.get()
+            if request_id is not None:
+                record.request_id = request_id
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """The queue, its handler on the 'silica' logger and the writer thread"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.handler = None
+        self.listener = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def start(self):
+        """Route 'silica.*' records through the queue (idempotent)"""
+        with self._lock:
+            if self.handler is not None:
+                return
+            self.handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            root.addHandler(self.handler)
+            root.setLevel(LOG_LEVEL)
+            root.propagate = False
+            self._start_listener()
+
+    def _start_listener(self):
+        output = logging.StreamHandler(self.stream or sys.stdout)
+        output.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.handler.queue, output, respect_handler_level=False)
+        self.listener.start()
+
+    def _restart_after_fork(self):
+        # The writer thread does not survive fork(); records the parent had
+        # queued were (or will be) written by the parent itself
+        if self.handler is None:
+            return
+        self._lock = threading.Lock()
+        self.handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler.dropped = 0
+        self._start_listener()
+
+    def stop(self):
+        """Flush queued records and stop the writer thread"""
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def stats(self):
+        return {
+            'queued': self.handler.queue.qsize() if self.handler else 0,
+            'dropped': self.handler.dropped if self.handler else 0
+        }
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
+
+
+def get_logger(name):
+    """Logger under 'silica'; starts the pipeline on first use"""
+    pipeline.start()
+    return logging.getLogger(f'silica.{name}')
+
+
+def new_request_id(incoming=None):
+    """The client's request ID when it is usable, otherwise a fresh one"""
+    if incoming and len(incoming) <= MAX_REQUEST_ID_LENGTH and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+def should_log(route, status, duration_ms):
+    """Sampling decision for one access record -> (log it, sample rate)"""
+    if status >= 400 or duration_ms >= LOG_SLOW_MS:
+        return True, 1.0
+    rate = SAMPLE_RATES.get(route, LOG_SAMPLE_DEFAULT)
+    if rate >= 1.0:
+        return True, 1.0
+    return rate > 0.0 and random.random() < rate, rate
+
+
+def access(request_id, method, route, path, status, duration_ms, remote_addr=None, **fields):
+    """Log one finished request, subject to the route's sample rate"""
+    logged, rate = should_log(route, status, duration_ms)
+    if not logged:
+        return
+    access_log.info('request', extra={
+        'request_id': request_id,
+        'method': method,
+        'route': route,
+        'path': path,
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'remote_addr': remote_addr,
+        'sample_rate': rate,
+        **fields
+    })
+
+
+def instrument_flask(app, service):
+    """Request IDs, timing and sampled JSON access records for a Flask app"""
+    from flask import g, request
+
+    pipeline.start()
+
+    @app.before_request
+    def _start_access_record():
+        g.request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+        g.log_started = time.perf_counter()
+        g.log_context = current_request_id.set(g.request_id)
+
+    @app.after_request
+    def _write_access_record(response):
+        started = g.pop('log_started', None)
+        if started is not None:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+            access(
+                g.request_id,
+                request.method,
+                request.url_rule.rule if request.url_rule else 'unmatched',
+                request.path,
+                response.status_code,
+                (time.perf_counter() - started) * 1000,
+                request.remote_addr,
+                service=service
+            )
+        return response
+
+    @app.teardown_request
+    def _clear_request_id(exc):
+        context = g.pop('log_context', None)
+        if context is not None:
+            current_request_id.reset(context)
@@ -0,0 +1,324 @@
+"""
+Prometheus-compatible metrics for the backend and the store.
+
+Counters and histograms live in process memory behind one small lock per
+metric. When METRICS_DIR is set (required with several gunicorn workers)
+each process periodically writes a snapshot file there and /metrics merges
+the snapshots of all live workers, so any worker can answer a scrape. The
+snapshot of a worker that died is folded into an archive file, so merged
+counters never decrease when gunicorn replaces a worker.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import logs
+
+log = logs.get_logger('metrics')
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label values are joined with a character that cannot appear in them
+_SEP = '\x1f'
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """Add `amount` to the series identified by label_values"""
+        key = _SEP.join(str(value) for value in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Record one observation for the series identified by label_values"""
+        key = _SEP.join(str(label) for label in label_values)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    """All metrics of one service plus the multi-process snapshot plumbing"""
+
+    def __init__(self, service):
+        self.service = service
+        self._metrics = {}
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+        # A forked worker must not re-export what the master recorded
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def counter(self, name, help_text, labels=()):
+        return self._metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help_text, labels, buckets))
+
+    def _reset_after_fork(self):
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            metric.reset()
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(METRICS_DIR, f'{self.service}-{pid}.json')
+
+    def flush(self, force=False):
+        """Write this process's snapshot for other workers (rate-limited)"""
+        if not METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = now
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = self._snapshot_path(os.getpid())
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.error("Failed to write metrics snapshot", extra={'error': str(e)})
+        finally:
+            self._flush_lock.release()
+
+    def _collect(self):
+        """Merge the snapshots of every live worker (or just this process)"""
+        merged = self.snapshot()
+        if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+            return merged
+
+        self.flush(force=True)
+        prefix = f'{self.service}-'
+        own = os.getpid()
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.startswith(prefix) or not filename.endswith('.json'):
+                continue
+            try:
+                pid = int(filename[len(prefix):-5])
+            except ValueError:
+                continue
+            if pid == own:
+                continue
+            path = os.path.join(METRICS_DIR, filename)
+            if not _pid_alive(pid):
+                self._archive(path)
+                continue
+            _merge(merged, _load(path))
+        _merge(merged, _load(self._archive_path()))
+        return merged
+
+    def _archive_path(self):
+        return os.path.join(METRICS_DIR, f'{self.service}-archive.json')
+
+    def _archive(self, path):
+        """Fold a dead worker's snapshot into the archive, so merged counters never go back"""
+        import fcntl
+
+        archive_path = self._archive_path()
+        try:
+            with open(f'{archive_path}.lock', 'w') as lock:
+                # Several workers may find the same dead snapshot at once
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(path):
+                    return
+                archive = _load(archive_path)
+                _merge(archive, _load(path))
+                tmp_path = f'{archive_path}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(archive, f)
+                os.replace(tmp_path, archive_path)
+                os.remove(path)
+        except OSError:
+            log.exception("Failed to archive metrics snapshot")
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        merged = self._collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(merged.get(name, {}).items()):
+                values = key.split(_SEP) if metric.labels else []
+                pairs = [('service', self.service)] + list(zip(metric.labels, values))
+                if metric.type == 'counter':
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else repr(float(bound))
+                    lines.append(f'{name}_bucket{_format_labels(pairs + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _load(path):
+    """A snapshot file's contents, or {} when it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _merge(merged, other):
+    """Add the samples of snapshot `other` into `merged`"""
+    for name, samples in other.items():
+        target = merged.setdefault(name, {})
+        for key, value in samples.items():
+            if key not in target:
+                target[key] = value
+            elif isinstance(value, list):
+                target[key] = [a + b for a, b in zip(target[key], value)]
+            else:
+                target[key] += value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_labels(pairs):
+    escaped = []
+    for label, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{label}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# One registry per process; the service name is set by whichever app imports it
+registry = Registry(os.environ.get('METRICS_SERVICE', 'silica'))
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status',
+    ('endpoint', 'method', 'status'))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint',
+    ('endpoint', 'method'))
+stage_latency = registry.histogram(
+    'stage_duration_seconds', 'Time spent in expensive stages (bcrypt, qr, sqlite, jwt, ...)',
+    ('stage',))
+upstream_latency = registry.histogram(
+    'upstream_request_duration_seconds', 'Outbound HTTP latency by upstream and outcome',
+    ('upstream', 'outcome'))
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of one expensive stage"""
+    stage_latency.observe(seconds, stage)
+
+
+@contextmanager
+def timed(stage):
+    """Context manager timing a block as `stage`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_latency.observe(time.perf_counter() - started, stage)
+
+
+def instrument_flask(app, service):
+    """Record per-endpoint counts/latency and serve GET /metrics on a Flask app"""
+    from flask import Response, g, request
+
+    registry.service = service
+    token = os.environ.get('METRICS_TOKEN')
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            http_requests.inc(endpoint, request.method, response.status_code)
+            http_latency.observe(time.perf_counter() - started, endpoint, request.method)
+            registry.flush()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Prometheus scrape endpoint"""
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), content_type=CONTENT_TYPE)
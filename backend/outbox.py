@@ -0,0 +1,322 @@
+"""
+Transactional outbox for webhooks sent by the backend.
+
+Messages are inserted into the outbox table in the same transaction as the
+change that caused them, then delivered by a background dispatcher in
+batches with exponential backoff. Messages that keep failing end up in the
+'dead' state where an admin can inspect them. Payloads may carry
+credentials, so they are dropped once a message is delivered or dead;
+only dead messages from before that change can be re-queued.
+
+The HTTP client (requests) and asyncio are imported on first use: storage
+imports this module for enqueue(), and a cold process that only validates
+tokens should not pay for either.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+import logs
+
+log = logs.get_logger('outbox')
+
+OUTBOX_INTERVAL = float(os.environ.get('OUTBOX_INTERVAL', 5))
+OUTBOX_BATCH = int(os.environ.get('OUTBOX_BATCH', 20))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_TIMEOUT = float(os.environ.get('OUTBOX_TIMEOUT', 10))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 5))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', 3600))
+
+# A claimed message is retried by any worker once its lease runs out. The
+# dispatcher renews the lease of the rest of its batch after every send.
+CLAIM_LEASE_SECONDS = 60
+
+
+def create_outbox_table(cursor):
+    """Create the outbox table and its due-message index"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            target_url TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON outbox (next_attempt_at) WHERE status IN ('pending', 'sending')
+    ''')
+
+
+def enqueue(cursor, kind, target_url, payload):
+    """Queue a message inside the caller's transaction, returning its id"""
+    cursor.execute('''
+        INSERT INTO outbox (kind, target_url, payload, next_attempt_at)
+        VALUES (?, ?, ?, ?)
+    ''', (kind, target_url, json.dumps(payload), time.time()))
+    return cursor.lastrowid
+
+
+def post_json(url, payload):
+    """Deliver a message; returns (delivered, retryable, error)"""
+    import http_client
+    import requests
+
+    upstream = http_client.get_upstream('discord-bot', read_timeout=OUTBOX_TIMEOUT)
+    try:
+        response = upstream.post(url, json=payload)
+    except requests.exceptions.RequestException as e:
+        # Includes CircuitOpenError while the bot is known to be down
+        return False, True, str(e)
+    if response.status_code < 300:
+        return True, False, None
+    retryable = response.status_code >= 500 or response.status_code in (408, 429)
+    return False, retryable, f'HTTP {response.status_code}: {response.text[:500]}'
+
+
+class OutboxDispatcher:
+    """Background thread delivering queued outbox messages"""
+
+    def __init__(self, pool, send=post_json, interval=OUTBOX_INTERVAL, batch_size=OUTBOX_BATCH,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.pool = pool
+        self.send = send
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+
+    def notify(self):
+        """Deliver new messages now instead of waiting for the next tick"""
+        self._wakeup.set()
+
+    def backoff(self, attempts):
+        """Seconds to wait before the next attempt (exponential, jittered)"""
+        delay = min(OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX)
+        return delay * random.uniform(0.8, 1.2)
+
+    def _claim(self):
+        """Lease a batch of due messages so no other worker sends them"""
+        now = time.time()
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id, target_url, payload, attempts
+                FROM outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, self.batch_size))
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany('''
+                    UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?
+                ''', [(now + CLAIM_LEASE_SECONDS, row[0]) for row in rows])
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def _outcome(self, message_id, attempts, delivered, retryable, error):
+        """UPDATE (sql, params) recording the result of one delivery attempt"""
+        attempts += 1
+        if delivered:
+            self.delivered += 1
+            # Payloads may carry credentials; don't keep them once delivered
+            return ('''
+                UPDATE outbox
+                SET status = 'delivered', attempts = ?, payload = NULL,
+                    last_error = NULL, delivered_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (attempts, message_id))
+        if not retryable or attempts >= self.max_attempts:
+            self.dead_lettered += 1
+            log.error("Outbox message dead-lettered", extra={'message_id': message_id, 'error': error})
+            return ('''
+                UPDATE outbox SET status = 'dead', attempts = ?, payload = NULL, last_error = ?
+                WHERE id = ?
+            ''', (attempts, error, message_id))
+        self.failed_attempts += 1
+        return ('''
+            UPDATE outbox
+            SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?
+            WHERE id = ?
+        ''', (attempts, error, time.time() + self.backoff(attempts), message_id))
+
+    def _renew(self, message_ids):
+        """UPDATE (sql, params) extending the lease on claimed messages not sent yet"""
+        placeholders = ', '.join('?' * len(message_ids))
+        return (f'''
+            UPDATE outbox SET next_attempt_at = ?
+            WHERE status = 'sending' AND id IN ({placeholders})
+        ''', (time.time() + CLAIM_LEASE_SECONDS, *message_ids))
+
+    def _apply(self, outcomes):
+        if not outcomes:
+            return
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            for sql, params in outcomes:
+                cursor.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def dispatch(self):
+        """Deliver one batch of due messages, returning how many were handled"""
+        rows = self._claim()
+        for index, (message_id, target_url, payload, attempts) in enumerate(rows):
+            result = self.send(target_url, json.loads(payload))
+            outcomes = [self._outcome(message_id, attempts, *result)]
+            # Sends are sequential, so a batch can outlast one lease: record
+            # each result at once and renew the lease on the rest
+            waiting = [row[0] for row in rows[index + 1:]]
+            if waiting:
+                outcomes.append(self._renew(waiting))
+            self._apply(outcomes)
+        return len(rows)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                # Keep going while full batches come back
+                while self.dispatch() >= self.batch_size:
+                    pass
+            except Exception:
+                log.exception("Outbox dispatch failed")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the dispatcher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the dispatcher thread"""
+        self._stop.set()
+        self._wakeup.set()
+
+    def retry_dead(self):
+        """Re-queue every dead-lettered message that still has its payload, returning how many"""
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ?
+                WHERE status = 'dead' AND payload IS NOT NULL
+            ''', (time.time(),))
+            count = cursor.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        self.notify()
+        return count
+
+    def stats(self):
+        """Message counts by status plus dispatcher counters"""
+        conn = self.pool.connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        finally:
+            conn.close()
+        return {
+            'queued': counts.get('pending', 0) + counts.get('sending', 0),
+            'delivered': counts.get('delivered', 0),
+            'dead': counts.get('dead', 0),
+            'running': bool(self._thread and self._thread.is_alive()),
+            'delivered_by_this_worker': self.delivered,
+            'failed_attempts': self.failed_attempts,
+            'dead_lettered': self.dead_lettered
+        }
+
+
+class AsyncOutboxDispatcher(OutboxDispatcher):
+    """Outbox dispatcher running as a task on an asyncio event loop
+
+    `send` is a coroutine function with the same contract as post_json; the
+    messages of a batch are delivered concurrently while the SQLite claim and
+    bookkeeping run on the loop's default executor.
+    """
+
+    def __init__(self, pool, send, **options):
+        super().__init__(pool, send=send, **options)
+        self._event_loop = None
+        self._task = None
+        self._wakeup_async = None
+
+    def notify(self):
+        """Deliver new messages now; safe to call from any thread"""
+        if self._event_loop is not None:
+            self._event_loop.call_soon_threadsafe(self._wakeup_async.set)
+
+    async def dispatch_async(self):
+        """Deliver one batch of due messages, returning how many were handled"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(None, self._claim)
+        results = await asyncio.gather(*(self.send(target_url, json.loads(payload))
+                                         for _, target_url, payload, _ in rows))
+        outcomes = [self._outcome(row[0], row[3], *result) for row, result in zip(rows, results)]
+        await loop.run_in_executor(None, self._apply, outcomes)
+        return len(rows)
+
+    async def _run(self):
+        import asyncio
+
+        while True:
+            try:
+                while await self.dispatch_async() >= self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Outbox dispatch failed")
+            try:
+                await asyncio.wait_for(self._wakeup_async.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup_async.clear()
+
+    def start(self):
+        """Start the dispatcher task on the running event loop"""
+        import asyncio
+
+        if self._task and not self._task.done():
+            return
+        self._event_loop = asyncio.get_running_loop()
+        self._wakeup_async = asyncio.Event()
+        self._task = self._event_loop.create_task(self._run())
+
+    def stop(self):
+        """Cancel the dispatcher task"""
+        if self._task:
+            self._task.cancel()
+        self._event_loop = None
+
+    def stats(self):
+        """Message counts by status plus dispatcher counters"""
+        stats = super().stats()
+        stats['running'] = bool(self._task and not self._task.done())
+        return stats
@@ -0,0 +1,339 @@
+"""
+On-demand and continuous CPU profiling for the backend and the store.
+
+An admin request (valid X-Admin-Key) that also sends `X-Profile: cprofile`
+runs under cProfile and leaves a .pstats file; `X-Profile: sample` samples
+the request thread's stack every PROFILE_REQUEST_INTERVAL seconds instead
+and leaves a .collapsed file (one `frame;frame;... count` line per stack,
+the input format of flamegraph.pl and speedscope). The response names the
+file in X-Profile-Name. Only one request per process runs under cProfile
+at a time; concurrent cprofile requests are sampled instead.
+
+With PROFILE_SAMPLE_INTERVAL > 0 a background thread also samples every
+thread of the process and writes one .collapsed file per
+PROFILE_SAMPLE_WINDOW. Sampling only reads sys._current_frames(), so at
+the suggested 10 ms interval it can stay on in production.
+
+Files go to PROFILE_DIR, which holds at most PROFILE_KEEP files and
+PROFILE_MAX_BYTES: the oldest are deleted first. Workers share the
+directory, and file names carry the service and pid.
+"""
+
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import logs
+
+log = logs.get_logger('profiling')
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'silica-profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', 50 * 1024 * 1024))
+PROFILE_REQUEST_INTERVAL = float(os.environ.get('PROFILE_REQUEST_INTERVAL', 0.001))
+# 0 disables the always-on sampler; 0.01 (100 Hz) is cheap enough for production
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0))
+PROFILE_SAMPLE_WINDOW = float(os.environ.get('PROFILE_SAMPLE_WINDOW', 60))
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_NAME_HEADER = 'X-Profile-Name'
+
+_NAME_PATTERN = re.compile(r'^[\w.-]+\.(pstats|collapsed)$')
+
+# Only one cProfile.Profile can be enabled per process (Python 3.12+ raises
+# otherwise); concurrent cprofile requests are sampled instead
+_cprofile_lock = threading.Lock()
+
+
+class ProfileStore:
+    """Bounded ring buffer of profile files in one directory"""
+
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP, max_bytes=PROFILE_MAX_BYTES):
+        self.directory = directory
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _new_name(self, service, label, kind):
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        label = re.sub(r'[^\w-]+', '-', label).strip('-') or 'root'
+        return f'{stamp}-{service}-{os.getpid()}-{sequence}-{label}{kind}'
+
+    def save(self, service, label, kind, write):
+        """Create a file with write(path) and trim the buffer; returns its name"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._new_name(service, label, kind)
+        path = os.path.join(self.directory, name)
+        tmp_path = f'{path}.tmp'
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        self.trim()
+        return name
+
+    def entries(self):
+        """Profile files, newest first: [{name, kind, bytes, created_at}]"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not _NAME_PATTERN.match(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # trimmed by another worker meanwhile
+            entries.append({
+                'name': name,
+                'kind': name.rsplit('.', 1)[1],
+                'bytes': stat.st_size,
+                'created_at': stat.st_mtime
+            })
+        entries.sort(key=lambda entry: (entry['created_at'], entry['name']), reverse=True)
+        return entries
+
+    def trim(self):
+        """Delete the oldest files beyond PROFILE_KEEP / PROFILE_MAX_BYTES"""
+        total = 0
+        for index, entry in enumerate(self.entries()):
+            total += entry['bytes']
+            if index >= self.keep or total > self.max_bytes:
+                try:
+                    os.remove(os.path.join(self.directory, entry['name']))
+                except FileNotFoundError:
+                    pass
+
+    def path(self, name):
+        """Absolute path of a stored profile, or None for unknown/unsafe names"""
+        if not _NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+class StackSampler:
+    """Counts collapsed stacks of sampled threads"""
+
+    def __init__(self, thread_ids=None):
+        # None samples every thread except the sampling one
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{os.path.basename(code.co_filename)}:{code.co_name}'
+        return label
+
+    def sample(self, skip=None):
+        """Record the current stack of every sampled thread"""
+        names = None
+        for ident, frame in sys._current_frames().items():
+            if ident == skip or (self.thread_ids is not None and ident not in self.thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if self.thread_ids is None:
+                # Pools are told apart by thread name (bcrypt, sqlite, wsgi...)
+                if names is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(re.sub(r'[_-]\d+$', '', names.get(ident, 'thread')))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class RequestSampler:
+    """Samples one thread from a helper thread until stopped"""
+
+    def __init__(self, thread_id, interval=PROFILE_REQUEST_INTERVAL):
+        self.sampler = StackSampler({thread_id})
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='request-sampler', daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sampler.sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.sampler
+
+
+class ContinuousSampler:
+    """Always-on statistical profiler writing one .collapsed file per window"""
+
+    def __init__(self, store, service, interval=PROFILE_SAMPLE_INTERVAL, window=PROFILE_SAMPLE_WINDOW):
+        self.store = store
+        self.service = service
+        self.interval = interval
+        self.window = window
+        self._thread = None
+        self._stop = threading.Event()
+        self.windows_written = 0
+
+    def _flush(self, sampler):
+        if sampler.samples:
+            self.store.save(self.service, 'sampled', '.collapsed', sampler.write)
+            self.windows_written += 1
+
+    def _loop(self):
+        sampler = StackSampler()
+        window_started = time.monotonic()
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            try:
+                sampler.sample(skip=own_id)
+                if time.monotonic() - window_started >= self.window:
+                    self._flush(sampler)
+                    sampler = StackSampler()
+                    window_started = time.monotonic()
+            except Exception:
+                log.exception("Profile sampling failed")
+        self._flush(sampler)
+
+    def start(self):
+        """Start the sampling thread (no-op when the interval is 0)"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the partial window"""
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'interval_seconds': self.interval,
+            'window_seconds': self.window,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'windows_written': self.windows_written
+        }
+
+
+def start_cprofile():
+    """An enabled cProfile.Profile, or None while another one is running"""
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler outside this module holds the hook (3.12+)
+        _cprofile_lock.release()
+        return None
+    return profiler
+
+
+def stop_cprofile(profiler):
+    """Disable a profiler from start_cprofile() and free the slot"""
+    try:
+        profiler.disable()
+    finally:
+        _cprofile_lock.release()
+
+
+def instrument_flask(app, service, admin_key, url_prefix):
+    """Per-request profiling for admins plus list/download routes under url_prefix"""
+    from flask import g, jsonify, request, send_file
+
+    store = ProfileStore()
+    sampler = ContinuousSampler(store, service)
+
+    def is_admin():
+        key = request.headers.get('X-Admin-Key')
+        return bool(key) and key == admin_key
+
+    @app.before_request
+    def _start_request_profile():
+        mode = request.headers.get(PROFILE_HEADER, '').strip().lower()
+        if not mode or not is_admin():
+            return
+        # Any other value means cProfile
+        if mode != 'sample':
+            g.profiler = start_cprofile()
+            if g.profiler is not None:
+                return
+            log.info("cProfile busy, sampling the request instead", extra={'path': request.path})
+        g.profiler = RequestSampler(threading.get_ident())
+        g.profiler.start()
+
+    def _finish_request_profile():
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return None
+        label = request.url_rule.rule if request.url_rule else 'unmatched'
+        if isinstance(profiler, RequestSampler):
+            return store.save(service, label, '.collapsed', profiler.stop().write)
+        stop_cprofile(profiler)
+        return store.save(service, label, '.pstats', profiler.dump_stats)
+
+    @app.after_request
+    def _save_request_profile(response):
+        try:
+            name = _finish_request_profile()
+        except OSError:
+            log.exception("Failed to save request profile")
+            return response
+        if name is not None:
+            response.headers[PROFILE_NAME_HEADER] = name
+            log.info("Saved request profile", extra={'profile': name})
+        return response
+
+    @app.teardown_request
+    def _discard_request_profile(exc):
+        # after_request did not run (unhandled error): never leave a profiler on
+        profiler = g.pop('profiler', None)
+        if isinstance(profiler, RequestSampler):
+            profiler.stop()
+        elif profiler is not None:
+            stop_cprofile(profiler)
+
+    @app.route(f'{url_prefix}/profiles', methods=['GET'])
+    def list_profiles():
+        """Stored profiles, newest first (admin only)"""
+        if not is_admin():
+            return jsonify({'error': 'Admin access required'}), 403
+        return jsonify({
+            'success': True,
+            'directory': store.directory,
+            'profiles': store.entries(),
+            'sampler': sampler.stats()
+        }), 200
+
+    @app.route(f'{url_prefix}/profiles/<name>', methods=['GET'])
+    def download_profile(name):
+        """Download one .pstats or .collapsed file (admin only)"""
+        if not is_admin():
+            return jsonify({'error': 'Admin access required'}), 403
+        path = store.path(name)
+        if path is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
+
+    return sampler
@@ -0,0 +1,102 @@
+"""
+TOTP provisioning QR rendering.
+
+Images are rendered on demand from the provisioning URI and kept in a small
+short-lived cache keyed by a SHA-256 of the URI, so a client re-fetching its
+setup code does not pay for the encode twice and no TOTP secret sits in the
+cache keys. SVG output is a single run-length encoded path; PNG output is a
+small bilevel image.
+
+pyotp and qrcode (with PIL behind it) are imported on first use: most
+requests are token validations that never draw a QR code.
+"""
+
+import base64
+import hashlib
+import io
+import os
+
+import metrics
+from cache import TTLCache
+
+ISSUER_NAME = "Silica Client"
+QR_PNG_BOX_SIZE = int(os.environ.get('QR_PNG_BOX_SIZE', 6))
+QR_BORDER = 4  # quiet zone required by the QR spec
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 256))
+QR_CACHE_TTL = float(os.environ.get('QR_CACHE_TTL', 300))
+
+CONTENT_TYPES = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png'
+}
+
+_qr_cache = TTLCache(QR_CACHE_SIZE, QR_CACHE_TTL)
+
+
+def provisioning_uri(email, secret):
+    """otpauth:// URI an authenticator app enrolls from"""
+    import pyotp
+
+    return pyotp.TOTP(secret).provisioning_uri(name=email, issuer_name=ISSUER_NAME)
+
+
+def render_qr(uri, fmt='svg'):
+    """Render `uri` as SVG or PNG bytes, served from cache when possible"""
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f'Unsupported QR format: {fmt}')
+
+    # The URI embeds the TOTP secret: keep only its digest in memory
+    key = (fmt, hashlib.sha256(uri.encode()).digest())
+    image = _qr_cache.get(key)
+    if image is not None:
+        return image
+
+    import qrcode
+
+    with metrics.timed(f'qr_{fmt}'):
+        qr = qrcode.QRCode(box_size=QR_PNG_BOX_SIZE, border=QR_BORDER)
+        qr.add_data(uri)
+        qr.make(fit=True)
+
+        if fmt == 'svg':
+            image = _matrix_to_svg(qr.get_matrix())
+        else:
+            buffer = io.BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG', optimize=True)
+            image = buffer.getvalue()
+
+    _qr_cache.put(key, image)
+    return image
+
+
+def _matrix_to_svg(matrix):
+    """Encode each row's runs of dark modules as one path (one unit per module)"""
+    size = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                run = x - start
+                path.append(f'M{start} {y}h{run}v1h-{run}z')
+            else:
+                x += 1
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'shape-rendering="crispEdges"><rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(path)}"/></svg>'
+    ).encode()
+
+
+def qr_data_uri(email, secret, fmt='png'):
+    """QR code as a data: URI for inlining in JSON responses"""
+    image = render_qr(provisioning_uri(email, secret), fmt)
+    return f"data:{CONTENT_TYPES[fmt]};base64,{base64.b64encode(image).decode()}"
+
+
+def cache_stats():
+    """Hit/miss counters of the rendered image cache"""
+    return _qr_cache.stats()
@@ -0,0 +1,172 @@
+"""
+Token-bucket rate limiting shared by every gunicorn worker.
+
+Each (route, kind, identity) key owns one row in a small SQLite database
+kept apart from users.db, so throttling bookkeeping never competes with
+account writes for the database lock. A bucket holds up to `capacity`
+tokens and refills at capacity/period tokens per second; a request takes
+one token from every bucket it touches or is rejected without taking any.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import logs
+
+log = logs.get_logger('ratelimit')
+
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', 'ratelimit.db')
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+
+# Full buckets carry no information; drop them every this many checks
+PURGE_EVERY = 1000
+
+
+def parse_limit(text):
+    """'10/60' -> (10, 60.0): 10 requests per 60 seconds; '0' or '' disables"""
+    if text is None or str(text).strip() in ('', '0'):
+        return None
+    count, _, period = str(text).partition('/')
+    count, period = int(count), float(period or 60)
+    if count <= 0 or period <= 0:
+        raise ValueError(f'Invalid rate limit {text!r}')
+    return count, period
+
+
+def route_limits(route, defaults):
+    """Limits for one route, each overridable as RATE_LIMIT_<ROUTE>_<KIND>"""
+    limits = {}
+    for kind, default in defaults.items():
+        limit = parse_limit(os.environ.get(f'RATE_LIMIT_{route}_{kind}'.upper(), default))
+        if limit:
+            limits[kind] = limit
+    return limits
+
+
+class RateLimiter:
+    """Token buckets stored in SQLite"""
+
+    def __init__(self, pool, enabled=RATE_LIMIT_ENABLED):
+        self.pool = pool
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._checks = 0
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def create_table(self):
+        """Create the bucket table if needed"""
+        conn = self.pool.connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    full_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def hit(self, route, limits, identities):
+        """Take a token for each identity; returns 0 if allowed, else seconds to wait
+
+        limits maps kind -> (capacity, period) and identities maps kind -> value;
+        kinds without a value (no email in the body, ...) are not checked.
+        """
+        buckets = [(f'{route}:{kind}:{identities[kind]}', capacity, period)
+                   for kind, (capacity, period) in limits.items() if identities.get(kind)]
+        if not self.enabled or not buckets:
+            return 0
+
+        now = time.time()
+        retry_after = 0.0
+        updates = []
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for key, capacity, period in buckets:
+                cursor.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,))
+                row = cursor.fetchone()
+                rate = capacity / period
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+                # full_at lets purge() drop the row once it is back to capacity
+                updates.append((key, tokens - 1, now, now + (capacity - tokens + 1) / rate))
+            if retry_after:
+                # A rejected request takes nothing from any of its buckets
+                conn.rollback()
+            else:
+                cursor.executemany('''
+                    INSERT INTO rate_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE
+                    SET tokens = excluded.tokens, updated_at = excluded.updated_at, full_at = excluded.full_at
+                ''', updates)
+                conn.commit()
+        except sqlite3.Error as e:
+            # Never lock everybody out because the limiter's store is unhappy
+            with self._lock:
+                self.errors += 1
+            log.warning("Rate limiter unavailable, allowing request", extra={'error': str(e)})
+            return 0
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._checks += 1
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+            purge = self._checks % PURGE_EVERY == 0
+        if purge:
+            self.purge()
+        return math.ceil(retry_after) if retry_after else 0
+
+    def purge(self):
+        """Delete buckets that have refilled completely (same as having no row)"""
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM rate_buckets WHERE full_at <= ?', (time.time(),))
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error:
+            return 0
+        finally:
+            conn.close()
+
+    def reset(self, prefix=''):
+        """Forget every bucket whose key starts with prefix (all by default)"""
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM rate_buckets WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Decision counters for this worker plus the shared bucket count"""
+        conn = self.pool.connect()
+        try:
+            buckets = conn.execute('SELECT COUNT(*) FROM rate_buckets').fetchone()[0]
+        finally:
+            conn.close()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'buckets': buckets,
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'store_errors': self.errors
+            }
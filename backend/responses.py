@@ -0,0 +1,149 @@
+"""
+Response encoding for the backend API.
+
+Launchers call /auth/validate and /auth/login constantly, so every jsonify()
+goes through FastJSONProvider: orjson when it is installed (compact, no key
+sorting), and MessagePack instead of JSON when the client asks for it with
+`Accept: application/msgpack`. Either way the response carries
+`Vary: Accept`, so caches keep the two encodings apart. Request bodies may be MessagePack as well
+(`Content-Type: application/msgpack`); request.get_json() decodes either.
+
+Bodies that never change (fixed error messages) are FixedBody instances
+whose encoded bytes are computed once per encoding.
+"""
+
+import json
+import threading
+
+from flask import Request, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+# Upper bound on distinct cached error bodies (messages come from fixed sets)
+ERROR_BODY_CACHE_SIZE = 256
+
+
+class FixedBody(dict):
+    """A response body that never changes; its encodings are cached"""
+
+    __slots__ = ('encoded',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded = {}
+
+
+_error_bodies = {}
+_error_lock = threading.Lock()
+
+
+def error_body(message):
+    """Shared FixedBody for {'error': message}"""
+    body = _error_bodies.get(message)
+    if body is None:
+        body = FixedBody(error=message)
+        with _error_lock:
+            if len(_error_bodies) < ERROR_BODY_CACHE_SIZE:
+                body = _error_bodies.setdefault(message, body)
+    return body
+
+
+def response_mimetype(accept):
+    """MSGPACK_MIMETYPE when an Accept header prefers it over JSON, else JSON_MIMETYPE"""
+    if msgpack is None or not accept or 'msgpack' not in accept:
+        return JSON_MIMETYPE
+    # Only parse the header when it can matter
+    best = parse_accept_header(accept, MIMEAccept).best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES)
+    return MSGPACK_MIMETYPE if best in MSGPACK_MIMETYPES else JSON_MIMETYPE
+
+
+def decode(data, content_type):
+    """Parse a JSON or MessagePack request body (raises ValueError)"""
+    if msgpack is not None and content_type and content_type.split(';')[0].strip() in MSGPACK_MIMETYPES:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ValueError(str(e))
+    if orjson is not None:
+        return orjson.loads(data or b'null')
+    return json.loads(data or b'null')
+
+
+def encode(obj, mimetype, default=None):
+    """Encode obj as JSON or MessagePack bytes"""
+    if isinstance(obj, FixedBody):
+        data = obj.encoded.get(mimetype)
+        if data is None:
+            data = obj.encoded[mimetype] = encode(dict(obj), mimetype, default)
+        return data
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(obj, use_bin_type=True, default=default)
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() with orjson and Accept-negotiated MessagePack"""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self._app.debug:
+            return super().response(obj)
+        mimetype = response_mimetype(request.headers.get('Accept'))
+        response = self._app.response_class(encode(obj, mimetype, self.default), mimetype=mimetype)
+        response.vary.add('Accept')
+        return response
+
+
+class NegotiatedRequest(Request):
+    """Request whose get_json() also accepts MessagePack bodies"""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if msgpack is None or self.mimetype not in MSGPACK_MIMETYPES:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        cached = getattr(self, '_msgpack_body', None)
+        if cached is not None:
+            return cached[0]
+        try:
+            value = msgpack.unpackb(self.get_data(cache=cache), raw=False)
+        except Exception as e:
+            if silent:
+                return None
+            return self.on_json_loading_failed(e)
+        if cache:
+            self._msgpack_body = (value,)
+        return value
+
+
+def install(app):
+    """Use the negotiated encoders for jsonify() and request.get_json()"""
+    app.json = FastJSONProvider(app)
+    app.request_class = NegotiatedRequest
@@ -0,0 +1,1252 @@
+"""
+Storage layer for users and purchases.
+
+Routes talk to a UserStore / PurchaseStore instead of issuing SQL, so query
+tuning (indexes, batching, transactions) happens in one place. Two engines
+implement each store:
+
+- SQLite* : the production engine, on the tuned per-thread ConnectionPool
+- Memory* : dicts behind a lock, for tests and benchmarks of a single
+  process (nothing is persisted or shared between gunicorn workers)
+
+Timestamps are kept as the text SQLite stores ('YYYY-MM-DD HH:MM:SS[.ffffff]'),
+so both engines hand the routes identical values.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import logs
+import outbox
+
+log = logs.get_logger('storage')
+
+# What the routes get back; plain tuples underneath
+LoginUser = namedtuple('LoginUser', 'id password_hash totp_secret hwid is_active expires_at security_generation')
+UserStatus = namedtuple('UserStatus', 'hwid is_active expires_at security_generation')
+Account = namedtuple('Account', 'id expires_at is_active discord_id security_generation')
+UserListRow = namedtuple('UserListRow', 'id created_at email last_login is_active has_hwid expires_at')
+ExpiryRow = namedtuple('ExpiryRow', 'id email discord_id expires_at')
+# A refresh token with its user's current state (license_expires_at is users.expires_at)
+RefreshRecord = namedtuple('RefreshRecord', 'id user_id family_id hwid security_generation expires_at '
+                                            'email is_active license_expires_at user_hwid user_generation')
+
+# Columns update_user()/update_batch() may change
+UPDATABLE_COLUMNS = ('hwid', 'is_active', 'expires_at', 'last_login', 'note')
+
+INFO_COLUMNS = ('email', 'discord_id', 'is_active', 'expires_at', 'last_login', 'created_at', 'hwid', 'note')
+
+# Rows per IN (...) lookup, well under SQLite's bound parameter limit
+LOOKUP_CHUNK = 500
+
+# Stored in users.db's PRAGMA user_version once init_schema() has run; bump it
+# with every change to the schema, indexes or the upgrade steps
+SCHEMA_VERSION = 2
+
+# Queries on request paths with sample parameters. Each one must be answered
+# with an index seek; check_query_plans() verifies this with EXPLAIN QUERY PLAN.
+HOT_QUERIES = {
+    'login': ('SELECT id, password_hash, totp_secret, hwid, is_active, expires_at, security_generation FROM users WHERE email = ?', ('user@example.com',)),
+    'validate': ('SELECT hwid, is_active, expires_at, security_generation FROM users WHERE id = ? AND email = ?', (1, 'user@example.com')),
+    'validate_batch': ('SELECT id, email, hwid, is_active, expires_at, security_generation FROM users WHERE id IN (?, ?, ?)', (1, 2, 3)),
+    'check_discord': ('SELECT 1 FROM users WHERE discord_id = ?', ('123456789',)),
+    'user_info': ('SELECT email, discord_id, is_active, expires_at, last_login, created_at, hwid, note FROM users WHERE email = ?', ('user@example.com',)),
+    'update_by_email': ('UPDATE users SET note = ? WHERE email = ?', ('note', 'user@example.com')),
+    'list_users_first_page': ('SELECT id, created_at, email FROM users ORDER BY created_at DESC, id DESC LIMIT ?', (101,)),
+    'list_users_next_page': ('SELECT id, created_at, email FROM users WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?', ('2024-01-01 00:00:00', 10, 101)),
+    'expiring': ('SELECT id FROM users WHERE expires_at IS NOT NULL AND expires_at < ?', ('2024-01-01 00:00:00',)),
+    'outbox_due': ("SELECT id, target_url, payload, attempts FROM outbox WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?", (0.0, 20)),
+    'sweep_expired': ('SELECT id, email, discord_id, expires_at FROM users WHERE is_active = 1 AND expires_at IS NOT NULL AND expires_at <= ? ORDER BY expires_at LIMIT ?', ('2024-01-01 00:00:00', 200)),
+    'refresh': ('SELECT r.id, u.email FROM refresh_tokens r JOIN users u ON u.id = r.user_id WHERE r.token_hash = ?', ('0' * 64,)),
+    'refresh_family': ('UPDATE refresh_tokens SET revoked = 1 WHERE family_id = ?', ('family',)),
+    'cache_invalidations': ('SELECT id, user_id FROM cache_invalidations WHERE id > ? ORDER BY id', (0,)),
+}
+
+
+def to_db_value(value):
+    """Datetimes are stored as text, exactly as sqlite3's default adapter writes them"""
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return value
+
+
+def check_columns(changes):
+    for column in changes:
+        if column not in UPDATABLE_COLUMNS:
+            raise ValueError(f'Column {column!r} cannot be updated')
+
+
+class UserStore:
+    """Interface every users engine implements
+
+    filters (list_users/count_users) is a dict with optional keys
+    'active' (0/1), 'expired' (bool, relative to 'now') and 'hwid' ('set'/'unset').
+    """
+
+    def init_schema(self):
+        """Create or upgrade whatever the engine needs"""
+        raise NotImplementedError
+
+    def email_exists(self, email):
+        raise NotImplementedError
+
+    def discord_exists(self, discord_id):
+        raise NotImplementedError
+
+    def create_user(self, email, password_hash, totp_secret, is_active, discord_id=None,
+                    expires_at=None, note=None, message=None):
+        """Insert a user, returning its id
+
+        message is an optional (kind, target_url, payload) outbox message
+        queued atomically with the account.
+        """
+        raise NotImplementedError
+
+    def get_login(self, email):
+        """LoginUser for an email, or None"""
+        raise NotImplementedError
+
+    def record_login(self, user_id, hwid=None):
+        """Stamp last_login, binding hwid when one is given (first login)"""
+        raise NotImplementedError
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        """Swap a user's password hash unless it changed since old_hash was read"""
+        raise NotImplementedError
+
+    def get_status(self, user_id, email):
+        """UserStatus of the user with this id and email, or None"""
+        raise NotImplementedError
+
+    def get_statuses(self, user_ids):
+        """Map user_id -> (email, UserStatus) for the ids that exist"""
+        raise NotImplementedError
+
+    def get_info(self, email):
+        """Admin view of one user (INFO_COLUMNS) as a dict, or None"""
+        raise NotImplementedError
+
+    def get_account(self, email):
+        """Account for an email, or None"""
+        accounts = self.get_accounts([email])
+        return accounts.get(email)
+
+    def get_accounts(self, emails):
+        """Map email -> Account for the emails that exist"""
+        raise NotImplementedError
+
+    def update_user(self, email, changes, bump_generation=False):
+        """Apply column changes to one user; returns (id, security_generation) or None
+
+        bump_generation revokes every token issued before the change.
+        """
+        raise NotImplementedError
+
+    def update_batch(self, emails, plan, bump_generation=False):
+        """Change many users inside a single write transaction
+
+        plan(email, account) returns (changes, result) for a user that should
+        be changed or (None, result) to skip it. bump_generation is a bool
+        for the whole batch or a function (account, changes) -> bool deciding
+        per user. Returns (results, changed) where changed lists the (email,
+        account) pairs updated.
+        """
+        raise NotImplementedError
+
+    def delete_user(self, email):
+        """Delete a user; returns (id, discord_id) or None"""
+        raise NotImplementedError
+
+    def reset_all(self):
+        """Clear HWID, activation, expiry and last login of every user; returns the count"""
+        raise NotImplementedError
+
+    def list_users(self, filters, after=None, limit=None):
+        """UserListRows newest first, strictly after the (created_at, id) key"""
+        raise NotImplementedError
+
+    def stream_users(self, filters, after=None, limit=None, batch_size=500):
+        """Like list_users, yielding the rows in lists of up to batch_size"""
+        raise NotImplementedError
+
+    def count_users(self, filters):
+        raise NotImplementedError
+
+    def expire_due(self, now, limit):
+        """Deactivate up to limit active users whose expiry is <= now; returns their ExpiryRows"""
+        raise NotImplementedError
+
+    def mark_expiring(self, now, soon, limit):
+        """Flag up to limit users expiring in (now, soon] not yet warned; returns their ExpiryRows"""
+        raise NotImplementedError
+
+    def create_refresh_token(self, user_id, token_hash, family_id, hwid, security_generation, expires_at):
+        """Store a refresh token (expires_at is a Unix timestamp)"""
+        raise NotImplementedError
+
+    def claim_refresh_token(self, token_hash, now):
+        """Atomically use up a refresh token; returns (status, RefreshRecord or None)
+
+        status is 'ok' (the token is now spent), 'unknown', 'expired',
+        'revoked' or 'reused': a token that was already rotated came back,
+        so its whole family has been revoked and the user's security
+        generation bumped (the record carries the new one).
+        """
+        raise NotImplementedError
+
+    def revoke_refresh_family(self, family_id):
+        raise NotImplementedError
+
+    def purge_refresh_tokens(self, now):
+        """Delete refresh tokens past their expiry; returns the count"""
+        raise NotImplementedError
+
+    def log_invalidation(self, user_id):
+        """Tell other processes to drop their cached state of user_id (None: every user)"""
+        raise NotImplementedError
+
+    def last_invalidation_id(self):
+        """Id of the newest logged invalidation (0 when there is none)"""
+        raise NotImplementedError
+
+    def invalidations_after(self, last_id):
+        """[(id, user_id)] logged after last_id, oldest first"""
+        raise NotImplementedError
+
+    def purge_invalidations(self, before):
+        """Delete invalidations logged before a Unix timestamp; returns the count"""
+        raise NotImplementedError
+
+    def _plan_batch(self, emails, accounts, plan):
+        """Run plan over a batch: (results, [(email, account, changes)])"""
+        results = []
+        planned = []
+        for email in emails:
+            account = accounts.get(email)
+            if account is None:
+                results.append({'email': email, 'success': False, 'error': 'User not found'})
+                continue
+            changes, result = plan(email, account)
+            result['email'] = email
+            results.append(result)
+            if changes is not None:
+                check_columns(changes)
+                planned.append((email, account, changes))
+        return results, planned
+
+    def _bumps(self, bump_generation, account, changes):
+        """Whether update_batch bumps this user's security generation"""
+        return bump_generation(account, changes) if callable(bump_generation) else bump_generation
+
+
+class SQLiteUserStore(UserStore):
+    """users table in SQLite, through a ConnectionPool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def init_schema(self):
+        """Create/upgrade the users table, its indexes and the outbox table"""
+        conn = self.pool.connect()
+        cursor = conn.cursor()
+
+        # A database stamped with the current version needs none of the checks
+        # below; skipping them keeps cold starts short
+        if cursor.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            conn.close()
+            return
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                hwid TEXT,
+                totp_secret TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                last_login TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1,
+                discord_id TEXT,
+                note TEXT,
+                security_generation INTEGER NOT NULL DEFAULT 0,
+                expiry_warned_for TIMESTAMP
+            )
+        ''')
+
+        # Ensure new columns exist when upgrading from older schema
+        cursor.execute("PRAGMA table_info(users)")
+        existing_cols = [row[1] for row in cursor.fetchall()]
+
+        if 'expires_at' not in existing_cols:
+            cursor.execute('ALTER TABLE users ADD COLUMN expires_at TIMESTAMP')
+        if 'discord_id' not in existing_cols:
+            cursor.execute('ALTER TABLE users ADD COLUMN discord_id TEXT')
+        if 'note' not in existing_cols:
+            cursor.execute('ALTER TABLE users ADD COLUMN note TEXT')
+        if 'security_generation' not in existing_cols:
+            cursor.execute('ALTER TABLE users ADD COLUMN security_generation INTEGER NOT NULL DEFAULT 0')
+        if 'expiry_warned_for' not in existing_cols:
+            cursor.execute('ALTER TABLE users ADD COLUMN expiry_warned_for TIMESTAMP')
+
+        # expires_at must sort as text: older rows were written with a 'T' separator
+        cursor.execute('''
+            UPDATE users SET expires_at = replace(expires_at, 'T', ' ')
+            WHERE instr(expires_at, 'T') > 0
+        ''')
+
+        # Only SHA-256 digests of refresh tokens are stored; a family is every
+        # token rotated from one login
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS refresh_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token_hash TEXT UNIQUE NOT NULL,
+                user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                family_id TEXT NOT NULL,
+                hwid TEXT,
+                security_generation INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                used_at REAL,
+                revoked INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # Cache invalidations for the other worker processes (cache.CacheSync);
+        # user_id NULL means every user
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+        self.create_indexes(cursor)
+        outbox.create_outbox_table(cursor)
+
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        conn.close()
+
+    def create_indexes(self, cursor):
+        """Create the secondary indexes every hot query relies on (see HOT_QUERIES)"""
+        # Keyset pagination of /auth/users walks this index newest-first
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at, id)')
+
+        # Expiry scans and filters
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_expires_at ON users (expires_at) WHERE expires_at IS NOT NULL')
+
+        # The expiry sweeper only ever looks at active accounts
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_active_expiry
+            ON users (expires_at) WHERE is_active = 1 AND expires_at IS NOT NULL
+        ''')
+
+        # One account per Discord user; older databases may already hold duplicates
+        try:
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_users_discord_id
+                ON users (discord_id) WHERE discord_id IS NOT NULL
+            ''')
+        except sqlite3.IntegrityError:
+            log.warning("Duplicate discord_id values found, creating a non-unique index instead")
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_discord_id_dup
+                ON users (discord_id) WHERE discord_id IS NOT NULL
+            ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family ON refresh_tokens (family_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens (expires_at)')
+
+        cursor.execute('PRAGMA optimize')
+
+    def check_query_plans(self):
+        """Return {name: plan} for every hot query SQLite would run as a full scan or sort"""
+        conn = self.pool.connect()
+        offenders = {}
+        try:
+            for name, (sql, params) in HOT_QUERIES.items():
+                plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+                for detail in plan:
+                    full_scan = detail.startswith('SCAN') and 'USING' not in detail
+                    if full_scan or 'TEMP B-TREE' in detail:
+                        offenders[name] = plan
+                        break
+        finally:
+            conn.close()
+        return offenders
+
+    def _fetchone(self, sql, params):
+        conn = self.pool.connect()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def email_exists(self, email):
+        return self._fetchone('SELECT 1 FROM users WHERE email = ?', (email,)) is not None
+
+    def discord_exists(self, discord_id):
+        # Discord IDs are unique (idx_users_discord_id)
+        return self._fetchone('SELECT 1 FROM users WHERE discord_id = ?', (discord_id,)) is not None
+
+    def create_user(self, email, password_hash, totp_secret, is_active, discord_id=None,
+                    expires_at=None, note=None, message=None):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO users (email, password_hash, totp_secret, is_active, discord_id, expires_at, note)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (email, password_hash, totp_secret, is_active, discord_id, to_db_value(expires_at), note))
+            user_id = cursor.lastrowid
+            if message:
+                outbox.enqueue(cursor, *message)
+            conn.commit()
+            return user_id
+        finally:
+            conn.close()
+
+    def get_login(self, email):
+        row = self._fetchone('''
+            SELECT id, password_hash, totp_secret, hwid, is_active, expires_at,
+                   security_generation
+            FROM users
+            WHERE email = ?
+        ''', (email,))
+        return LoginUser(*row) if row else None
+
+    def record_login(self, user_id, hwid=None):
+        conn = self.pool.connect()
+        try:
+            if hwid is None:
+                conn.execute('UPDATE users SET last_login = ? WHERE id = ?',
+                             (to_db_value(datetime.now()), user_id))
+            else:
+                conn.execute('UPDATE users SET hwid = ?, last_login = ? WHERE id = ?',
+                             (hwid, to_db_value(datetime.now()), user_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                           (new_hash, user_id, old_hash))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def get_status(self, user_id, email):
+        row = self._fetchone('''
+            SELECT hwid, is_active, expires_at, security_generation
+            FROM users
+            WHERE id = ? AND email = ?
+        ''', (user_id, email))
+        return UserStatus(*row) if row else None
+
+    def get_statuses(self, user_ids):
+        user_ids = list(user_ids)
+        statuses = {}
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            for start in range(0, len(user_ids), LOOKUP_CHUNK):
+                chunk = user_ids[start:start + LOOKUP_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT id, email, hwid, is_active, expires_at, security_generation
+                    FROM users
+                    WHERE id IN ({placeholders})
+                ''', chunk)
+                for row in cursor.fetchall():
+                    statuses[row[0]] = (row[1], UserStatus(*row[2:]))
+        finally:
+            conn.close()
+        return statuses
+
+    def get_info(self, email):
+        row = self._fetchone(f'''
+            SELECT {', '.join(INFO_COLUMNS)}
+            FROM users
+            WHERE email = ?
+        ''', (email,))
+        return dict(zip(INFO_COLUMNS, row)) if row else None
+
+    def _fetch_accounts(self, cursor, emails):
+        accounts = {}
+        for start in range(0, len(emails), LOOKUP_CHUNK):
+            chunk = emails[start:start + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT email, id, expires_at, is_active, discord_id, security_generation
+                FROM users
+                WHERE email IN ({placeholders})
+            ''', chunk)
+            for row in cursor.fetchall():
+                accounts[row[0]] = Account(*row[1:])
+        return accounts
+
+    def get_accounts(self, emails):
+        conn = self.pool.connect()
+        try:
+            return self._fetch_accounts(conn.cursor(), list(emails))
+        finally:
+            conn.close()
+
+    def _update_sql(self, columns, bump_generation, where):
+        assignments = [f'{column} = ?' for column in columns]
+        if bump_generation:
+            assignments.append('security_generation = security_generation + 1')
+        return f"UPDATE users SET {', '.join(assignments)} WHERE {where} = ?"
+
+    def update_user(self, email, changes, bump_generation=False):
+        check_columns(changes)
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self._update_sql(list(changes), bump_generation, 'email'),
+                           [to_db_value(value) for value in changes.values()] + [email])
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute('SELECT id, security_generation FROM users WHERE email = ?', (email,))
+            row = cursor.fetchone()
+            conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    def update_batch(self, emails, plan, bump_generation=False):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            accounts = self._fetch_accounts(cursor, emails)
+            results, planned = self._plan_batch(emails, accounts, plan)
+
+            # One executemany per distinct set of changed columns and bump
+            groups = {}
+            for email, account, changes in planned:
+                params = [to_db_value(value) for value in changes.values()] + [account.id]
+                key = (tuple(changes), self._bumps(bump_generation, account, changes))
+                groups.setdefault(key, []).append(params)
+            for (columns, bump), params in groups.items():
+                cursor.executemany(self._update_sql(columns, bump, 'id'), params)
+            conn.commit()
+        finally:
+            conn.close()
+
+        return results, [(email, account) for email, account, _ in planned]
+
+    def delete_user(self, email):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, discord_id FROM users WHERE email = ?', (email,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            cursor.execute('DELETE FROM users WHERE id = ?', (row[0],))
+            conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    def reset_all(self):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users
+                SET hwid = NULL,
+                    is_active = 0,
+                    expires_at = NULL,
+                    last_login = NULL,
+                    security_generation = security_generation + 1
+            ''')
+            affected_rows = cursor.rowcount
+            conn.commit()
+            return affected_rows
+        finally:
+            conn.close()
+
+    def _where(self, filters, after=None):
+        clauses = []
+        params = []
+
+        if filters.get('active') is not None:
+            clauses.append('is_active = ?')
+            params.append(int(filters['active']))
+
+        if filters.get('expired') is not None:
+            if filters['expired']:
+                clauses.append('expires_at IS NOT NULL AND datetime(expires_at) < datetime(?)')
+            else:
+                clauses.append('(expires_at IS NULL OR datetime(expires_at) >= datetime(?))')
+            params.append(to_db_value(filters.get('now') or datetime.now()))
+
+        if filters.get('hwid') == 'set':
+            clauses.append('hwid IS NOT NULL')
+        elif filters.get('hwid') == 'unset':
+            clauses.append('hwid IS NULL')
+
+        if after is not None:
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend(after)
+
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+    def _list_query(self, filters, after, limit):
+        where, params = self._where(filters, after)
+        query = f'''
+            SELECT id, created_at, email, last_login, is_active, hwid IS NOT NULL, expires_at
+            FROM users
+            {where}
+            ORDER BY created_at DESC, id DESC
+        '''
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return query, params
+
+    def list_users(self, filters, after=None, limit=None):
+        conn = self.pool.connect()
+        try:
+            rows = conn.execute(*self._list_query(filters, after, limit)).fetchall()
+        finally:
+            conn.close()
+        return [UserListRow(*row) for row in rows]
+
+    def stream_users(self, filters, after=None, limit=None, batch_size=500):
+        conn = self.pool.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(*self._list_query(filters, after, limit))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [UserListRow(*row) for row in rows]
+        finally:
+            cursor.close()
+            conn.close()
+
+    def count_users(self, filters):
+        where, params = self._where(filters)
+        return self._fetchone(f'SELECT COUNT(*) FROM users {where}', params)[0]
+
+    def _claim(self, select_sql, select_params, update_sql):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(select_sql, select_params)
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany(update_sql, [(row[0], row[3]) for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+        return [ExpiryRow(*row) for row in rows]
+
+    def expire_due(self, now, limit):
+        # Range scan over idx_users_active_expiry
+        return self._claim('''
+            SELECT id, email, discord_id, expires_at
+            FROM users
+            WHERE is_active = 1 AND expires_at IS NOT NULL AND expires_at <= ?
+            ORDER BY expires_at
+            LIMIT ?
+        ''', (to_db_value(now), limit), '''
+            UPDATE users SET is_active = 0
+            WHERE id = ? AND expires_at = ? AND is_active = 1
+        ''')
+
+    def mark_expiring(self, now, soon, limit):
+        return self._claim('''
+            SELECT id, email, discord_id, expires_at
+            FROM users
+            WHERE is_active = 1 AND expires_at IS NOT NULL
+              AND expires_at > ? AND expires_at <= ?
+              AND (expiry_warned_for IS NULL OR expiry_warned_for != expires_at)
+            ORDER BY expires_at
+            LIMIT ?
+        ''', (to_db_value(now), to_db_value(soon), limit), '''
+            UPDATE users SET expiry_warned_for = expires_at
+            WHERE id = ? AND expires_at = ?
+        ''')
+
+    def create_refresh_token(self, user_id, token_hash, family_id, hwid, security_generation, expires_at):
+        conn = self.pool.connect()
+        try:
+            conn.execute('''
+                INSERT INTO refresh_tokens (token_hash, user_id, family_id, hwid, security_generation, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (token_hash, user_id, family_id, hwid, security_generation, time.time(), expires_at))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def claim_refresh_token(self, token_hash, now):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            # One seek on the token_hash index plus the users primary key
+            cursor.execute('''
+                SELECT r.id, r.user_id, r.family_id, r.hwid, r.security_generation, r.expires_at,
+                       u.email, u.is_active, u.expires_at, u.hwid, u.security_generation,
+                       r.used_at, r.revoked
+                FROM refresh_tokens r JOIN users u ON u.id = r.user_id
+                WHERE r.token_hash = ?
+            ''', (token_hash,))
+            row = cursor.fetchone()
+            if row is None:
+                return 'unknown', None
+
+            record = RefreshRecord(*row[:11])
+            used_at, revoked = row[11:]
+            if revoked:
+                status = 'revoked'
+            elif used_at is not None:
+                # Access tokens minted from a stolen copy die with the family
+                cursor.execute('UPDATE refresh_tokens SET revoked = 1 WHERE family_id = ?', (record.family_id,))
+                cursor.execute('UPDATE users SET security_generation = security_generation + 1 WHERE id = ?',
+                               (record.user_id,))
+                record = record._replace(user_generation=record.user_generation + 1)
+                status = 'reused'
+            elif record.expires_at <= now:
+                status = 'expired'
+            else:
+                cursor.execute('UPDATE refresh_tokens SET used_at = ? WHERE id = ?', (now, record.id))
+                status = 'ok'
+            conn.commit()
+            return status, record
+        finally:
+            conn.close()
+
+    def revoke_refresh_family(self, family_id):
+        conn = self.pool.connect()
+        try:
+            conn.execute('UPDATE refresh_tokens SET revoked = 1 WHERE family_id = ?', (family_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def purge_refresh_tokens(self, now):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM refresh_tokens WHERE expires_at <= ?', (now,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def log_invalidation(self, user_id):
+        conn = self.pool.connect()
+        try:
+            conn.execute('INSERT INTO cache_invalidations (user_id, created_at) VALUES (?, ?)',
+                         (user_id, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def last_invalidation_id(self):
+        row = self._fetchone('SELECT MAX(id) FROM cache_invalidations', ())
+        return row[0] or 0
+
+    def invalidations_after(self, last_id):
+        conn = self.pool.connect()
+        try:
+            return conn.execute('SELECT id, user_id FROM cache_invalidations WHERE id > ? ORDER BY id',
+                                (last_id,)).fetchall()
+        finally:
+            conn.close()
+
+    def purge_invalidations(self, before):
+        conn = self.pool.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM cache_invalidations WHERE created_at < ?', (before,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+
+class MemoryUserStore(UserStore):
+    """users kept in process memory (tests and benchmarks)
+
+    Outbox messages still go to the SQLite outbox_pool when one is given, so
+    the regular dispatcher delivers them; without it they are collected in
+    self.messages.
+    """
+
+    def __init__(self, outbox_pool=None):
+        self.outbox_pool = outbox_pool
+        self.messages = []
+        self._lock = threading.Lock()
+        self._users = {}
+        self._by_email = {}
+        self._by_discord = {}
+        self._next_id = 1
+        self._refresh_tokens = {}
+        self._next_refresh_id = 1
+
+    def init_schema(self):
+        if self.outbox_pool is None:
+            return
+        conn = self.outbox_pool.connect()
+        try:
+            outbox.create_outbox_table(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _get(self, email):
+        user_id = self._by_email.get(email)
+        return self._users[user_id] if user_id is not None else None
+
+    def email_exists(self, email):
+        return email in self._by_email
+
+    def discord_exists(self, discord_id):
+        return discord_id in self._by_discord
+
+    def create_user(self, email, password_hash, totp_secret, is_active, discord_id=None,
+                    expires_at=None, note=None, message=None):
+        with self._lock:
+            if email in self._by_email:
+                raise sqlite3.IntegrityError('UNIQUE constraint failed: users.email')
+            if discord_id is not None and discord_id in self._by_discord:
+                raise sqlite3.IntegrityError('UNIQUE constraint failed: users.discord_id')
+            user_id = self._next_id
+            self._next_id += 1
+            self._users[user_id] = {
+                'id': user_id,
+                'email': email,
+                'password_hash': password_hash,
+                'totp_secret': totp_secret,
+                'hwid': None,
+                # CURRENT_TIMESTAMP: UTC, whole seconds
+                'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                'expires_at': to_db_value(expires_at),
+                'last_login': None,
+                'is_active': int(bool(is_active)),
+                'discord_id': discord_id,
+                'note': note,
+                'security_generation': 0,
+                'expiry_warned_for': None
+            }
+            self._by_email[email] = user_id
+            if discord_id is not None:
+                self._by_discord[discord_id] = user_id
+        if message:
+            self._enqueue(message)
+        return user_id
+
+    def _enqueue(self, message):
+        if self.outbox_pool is None:
+            self.messages.append(message)
+            return
+        conn = self.outbox_pool.connect()
+        try:
+            outbox.enqueue(conn.cursor(), *message)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_login(self, email):
+        with self._lock:
+            user = self._get(email)
+            if user is None:
+                return None
+            return LoginUser(*(user[field] for field in LoginUser._fields))
+
+    def record_login(self, user_id, hwid=None):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return
+            if hwid is not None:
+                user['hwid'] = hwid
+            user['last_login'] = to_db_value(datetime.now())
+
+    def replace_password_hash(self, user_id, old_hash, new_hash):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or user['password_hash'] != old_hash:
+                return False
+            user['password_hash'] = new_hash
+            return True
+
+    def get_status(self, user_id, email):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or user['email'] != email:
+                return None
+            return UserStatus(*(user[field] for field in UserStatus._fields))
+
+    def get_statuses(self, user_ids):
+        with self._lock:
+            return {
+                user_id: (user['email'], UserStatus(*(user[field] for field in UserStatus._fields)))
+                for user_id, user in ((user_id, self._users.get(user_id)) for user_id in user_ids)
+                if user is not None
+            }
+
+    def get_info(self, email):
+        with self._lock:
+            user = self._get(email)
+            return {column: user[column] for column in INFO_COLUMNS} if user else None
+
+    def _account(self, user):
+        return Account(*(user[field] for field in Account._fields))
+
+    def get_accounts(self, emails):
+        with self._lock:
+            return {email: self._account(self._get(email)) for email in emails if email in self._by_email}
+
+    def _apply(self, user, changes, bump_generation):
+        for column, value in changes.items():
+            user[column] = to_db_value(value)
+        if bump_generation:
+            user['security_generation'] += 1
+
+    def update_user(self, email, changes, bump_generation=False):
+        check_columns(changes)
+        with self._lock:
+            user = self._get(email)
+            if user is None:
+                return None
+            self._apply(user, changes, bump_generation)
+            return user['id'], user['security_generation']
+
+    def update_batch(self, emails, plan, bump_generation=False):
+        with self._lock:
+            accounts = {email: self._account(self._get(email)) for email in emails if email in self._by_email}
+            results, planned = self._plan_batch(emails, accounts, plan)
+            for email, account, changes in planned:
+                self._apply(self._users[account.id], changes, self._bumps(bump_generation, account, changes))
+        return results, [(email, account) for email, account, _ in planned]
+
+    def delete_user(self, email):
+        with self._lock:
+            user = self._get(email)
+            if user is None:
+                return None
+            del self._users[user['id']]
+            del self._by_email[email]
+            self._refresh_tokens = {token_hash: token for token_hash, token in self._refresh_tokens.items()
+                                    if token['user_id'] != user['id']}
+            if user['discord_id'] is not None:
+                self._by_discord.pop(user['discord_id'], None)
+            return user['id'], user['discord_id']
+
+    def reset_all(self):
+        with self._lock:
+            for user in self._users.values():
+                user.update(hwid=None, is_active=0, expires_at=None, last_login=None)
+                user['security_generation'] += 1
+            return len(self._users)
+
+    def _matching(self, filters):
+        """Users passing filters, newest first (caller holds the lock)"""
+        now = datetime.fromisoformat(to_db_value(filters.get('now') or datetime.now()))
+        users = []
+        for user in self._users.values():
+            if filters.get('active') is not None and bool(user['is_active']) != bool(filters['active']):
+                continue
+            if filters.get('expired') is not None:
+                expires_at = user['expires_at']
+                expired = expires_at is not None and datetime.fromisoformat(expires_at) < now
+                if expired != bool(filters['expired']):
+                    continue
+            if filters.get('hwid') == 'set' and user['hwid'] is None:
+                continue
+            if filters.get('hwid') == 'unset' and user['hwid'] is not None:
+                continue
+            users.append(user)
+        users.sort(key=lambda user: (user['created_at'], user['id']), reverse=True)
+        return users
+
+    def _list_row(self, user):
+        return UserListRow(user['id'], user['created_at'], user['email'], user['last_login'],
+                           user['is_active'], int(user['hwid'] is not None), user['expires_at'])
+
+    def list_users(self, filters, after=None, limit=None):
+        with self._lock:
+            users = self._matching(filters)
+            if after is not None:
+                after = tuple(after)
+                users = [user for user in users if (user['created_at'], user['id']) < after]
+            if limit is not None:
+                users = users[:limit]
+            return [self._list_row(user) for user in users]
+
+    def stream_users(self, filters, after=None, limit=None, batch_size=500):
+        rows = self.list_users(filters, after, limit)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def count_users(self, filters):
+        with self._lock:
+            return len(self._matching(filters))
+
+    def _claim(self, select, update, limit):
+        with self._lock:
+            users = sorted((user for user in self._users.values() if select(user)),
+                           key=lambda user: user['expires_at'])[:limit]
+            for user in users:
+                update(user)
+            return [ExpiryRow(user['id'], user['email'], user['discord_id'], user['expires_at'])
+                    for user in users]
+
+    def expire_due(self, now, limit):
+        now = to_db_value(now)
+        return self._claim(
+            lambda user: user['is_active'] and user['expires_at'] is not None and user['expires_at'] <= now,
+            lambda user: user.update(is_active=0),
+            limit
+        )
+
+    def mark_expiring(self, now, soon, limit):
+        now, soon = to_db_value(now), to_db_value(soon)
+        return self._claim(
+            lambda user: (user['is_active'] and user['expires_at'] is not None
+                          and now < user['expires_at'] <= soon
+                          and user['expiry_warned_for'] != user['expires_at']),
+            lambda user: user.update(expiry_warned_for=user['expires_at']),
+            limit
+        )
+
+    def create_refresh_token(self, user_id, token_hash, family_id, hwid, security_generation, expires_at):
+        with self._lock:
+            if token_hash in self._refresh_tokens:
+                raise sqlite3.IntegrityError('UNIQUE constraint failed: refresh_tokens.token_hash')
+            self._refresh_tokens[token_hash] = {
+                'id': self._next_refresh_id,
+                'user_id': user_id,
+                'family_id': family_id,
+                'hwid': hwid,
+                'security_generation': security_generation,
+                'expires_at': expires_at,
+                'used_at': None,
+                'revoked': False
+            }
+            self._next_refresh_id += 1
+
+    def claim_refresh_token(self, token_hash, now):
+        with self._lock:
+            token = self._refresh_tokens.get(token_hash)
+            user = self._users.get(token['user_id']) if token else None
+            if user is None:
+                return 'unknown', None
+
+            record = RefreshRecord(token['id'], token['user_id'], token['family_id'], token['hwid'],
+                                   token['security_generation'], token['expires_at'], user['email'],
+                                   user['is_active'], user['expires_at'], user['hwid'],
+                                   user['security_generation'])
+            if token['revoked']:
+                return 'revoked', record
+            if token['used_at'] is not None:
+                self._revoke_family(token['family_id'])
+                user['security_generation'] += 1
+                return 'reused', record._replace(user_generation=user['security_generation'])
+            if token['expires_at'] <= now:
+                return 'expired', record
+            token['used_at'] = now
+            return 'ok', record
+
+    def _revoke_family(self, family_id):
+        for token in self._refresh_tokens.values():
+            if token['family_id'] == family_id:
+                token['revoked'] = True
+
+    def revoke_refresh_family(self, family_id):
+        with self._lock:
+            self._revoke_family(family_id)
+
+    def purge_refresh_tokens(self, now):
+        with self._lock:
+            expired = [token_hash for token_hash, token in self._refresh_tokens.items() if token['expires_at'] <= now]
+            for token_hash in expired:
+                del self._refresh_tokens[token_hash]
+            return len(expired)
+
+    # A single process: its caches are invalidated directly
+
+    def log_invalidation(self, user_id):
+        pass
+
+    def last_invalidation_id(self):
+        return 0
+
+    def invalidations_after(self, last_id):
+        return []
+
+    def purge_invalidations(self, before):
+        return 0
+
+
+class PurchaseStore:
+    """Interface every purchases engine implements"""
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    def create_purchase(self, purchase_id, discord_username, email, product_type, amount):
+        """Record a pending purchase"""
+        raise NotImplementedError
+
+    def set_session(self, purchase_id, stripe_session_id):
+        raise NotImplementedError
+
+    def complete_purchase(self, purchase_id):
+        """Mark a purchase completed now"""
+        raise NotImplementedError
+
+    def get_purchase(self, purchase_id):
+        """Dict with status, discord_username, email and product_type, or None"""
+        raise NotImplementedError
+
+
+class SQLitePurchaseStore(PurchaseStore):
+    """purchases table in SQLite, through a ConnectionPool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def init_schema(self):
+        conn = self.pool.connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS purchases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    purchase_id TEXT UNIQUE NOT NULL,
+                    discord_username TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    product_type TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    stripe_session_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _write(self, sql, params):
+        conn = self.pool.connect()
+        try:
+            conn.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def create_purchase(self, purchase_id, discord_username, email, product_type, amount):
+        self._write('''
+            INSERT INTO purchases (purchase_id, discord_username, email, product_type, amount, status)
+            VALUES (?, ?, ?, ?, ?, 'pending')
+        ''', (purchase_id, discord_username, email, product_type, amount))
+
+    def set_session(self, purchase_id, stripe_session_id):
+        self._write('''
+            UPDATE purchases SET stripe_session_id = ? WHERE purchase_id = ?
+        ''', (stripe_session_id, purchase_id))
+
+    def complete_purchase(self, purchase_id):
+        self._write('''
+            UPDATE purchases
+            SET status = 'completed', completed_at = ?
+            WHERE purchase_id = ?
+        ''', (to_db_value(datetime.now()), purchase_id))
+
+    def get_purchase(self, purchase_id):
+        conn = self.pool.connect()
+        try:
+            row = conn.execute('''
+                SELECT status, discord_username, email, product_type
+                FROM purchases
+                WHERE purchase_id = ?
+            ''', (purchase_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return dict(zip(('status', 'discord_username', 'email', 'product_type'), row))
+
+
+class MemoryPurchaseStore(PurchaseStore):
+    """purchases kept in process memory (tests and benchmarks)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._purchases = {}
+
+    def init_schema(self):
+        pass
+
+    def create_purchase(self, purchase_id, discord_username, email, product_type, amount):
+        with self._lock:
+            if purchase_id in self._purchases:
+                raise sqlite3.IntegrityError('UNIQUE constraint failed: purchases.purchase_id')
+            self._purchases[purchase_id] = {
+                'discord_username': discord_username,
+                'email': email,
+                'product_type': product_type,
+                'amount': amount,
+                'status': 'pending',
+                'stripe_session_id': None,
+                'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                'completed_at': None
+            }
+
+    def set_session(self, purchase_id, stripe_session_id):
+        with self._lock:
+            if purchase_id in self._purchases:
+                self._purchases[purchase_id]['stripe_session_id'] = stripe_session_id
+
+    def complete_purchase(self, purchase_id):
+        with self._lock:
+            if purchase_id in self._purchases:
+                self._purchases[purchase_id].update(status='completed', completed_at=to_db_value(datetime.now()))
+
+    def get_purchase(self, purchase_id):
+        with self._lock:
+            purchase = self._purchases.get(purchase_id)
+            if purchase is None:
+                return None
+            return {field: purchase[field] for field in ('status', 'discord_username', 'email', 'product_type')}
+
+
+STORAGE_ENGINES = ('sqlite', 'memory')
+
+
+def open_user_store(engine, pool):
+    """UserStore for STORAGE_ENGINE; pool is users.db (the memory engine keeps only the outbox there)"""
+    if engine == 'memory':
+        return MemoryUserStore(outbox_pool=pool)
+    if engine == 'sqlite':
+        return SQLiteUserStore(pool)
+    raise ValueError(f'Unknown storage engine {engine!r} (expected one of {", ".join(STORAGE_ENGINES)})')
+
+
+def open_purchase_store(engine, pool):
+    """PurchaseStore for STORAGE_ENGINE"""
+    if engine == 'memory':
+        return MemoryPurchaseStore()
+    if engine == 'sqlite':
+        return SQLitePurchaseStore(pool)
+    raise ValueError(f'Unknown storage engine {engine!r} (expected one of {", ".join(STORAGE_ENGINES)})')
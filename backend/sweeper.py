@@ -0,0 +1,130 @@
+"""
+Background expiry sweeper.
+
+Expired licenses used to stay is_active = 1 forever because expiry was only
+checked lazily on login/validate. The sweeper asks the user store for
+expired accounts in small batches (the SQLite engine walks the partial index
+on active users' expires_at, one transaction per batch), deactivates them
+and emits "expiring soon" events once per expiry date.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import logs
+
+log = logs.get_logger('sweeper')
+
+EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60))
+EXPIRY_SWEEP_BATCH = int(os.environ.get('EXPIRY_SWEEP_BATCH', 200))
+EXPIRY_WARNING_HOURS = float(os.environ.get('EXPIRY_WARNING_HOURS', 72))
+
+
+class ExpirySweeper:
+    """Deactivates expired users and announces upcoming expiries"""
+
+    def __init__(self, store, interval=EXPIRY_SWEEP_INTERVAL, batch_size=EXPIRY_SWEEP_BATCH,
+                 warning_window=timedelta(hours=EXPIRY_WARNING_HOURS)):
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.warning_window = warning_window
+        self._expired_listeners = []
+        self._expiring_listeners = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self.runs = 0
+        self.total_expired = 0
+        self.total_warned = 0
+        self.last_run = None
+        self.last_duration_ms = 0.0
+
+    def on_expired(self, callback):
+        """Register callback(users) called with each deactivated batch"""
+        self._expired_listeners.append(callback)
+        return callback
+
+    def on_expiring_soon(self, callback):
+        """Register callback(users) called with each batch of upcoming expiries"""
+        self._expiring_listeners.append(callback)
+        return callback
+
+    def _emit(self, listeners, users):
+        for callback in listeners:
+            try:
+                callback(users)
+            except Exception:
+                log.exception("Expiry listener failed")
+
+    def _process(self, claim, listeners):
+        """Claim batches with claim(limit) and announce them until none are left"""
+        processed = 0
+        while True:
+            rows = claim(self.batch_size)
+            if not rows:
+                return processed
+
+            users = [row._asdict() for row in rows]
+            processed += len(users)
+            self._emit(listeners, users)
+
+            if len(rows) < self.batch_size:
+                return processed
+
+    def sweep(self):
+        """Run one pass, returning the number of expired and warned users"""
+        with self._run_lock:
+            started = time.perf_counter()
+            now = datetime.now()
+            soon = now + self.warning_window
+
+            expired = self._process(lambda limit: self.store.expire_due(now, limit),
+                                    self._expired_listeners)
+            warned = self._process(lambda limit: self.store.mark_expiring(now, soon, limit),
+                                   self._expiring_listeners)
+            # Spent and expired refresh tokens are only kept for reuse detection
+            self.store.purge_refresh_tokens(time.time())
+            # Workers replay the cache invalidation log within seconds
+            self.store.purge_invalidations(time.time() - 3600)
+
+            self.runs += 1
+            self.total_expired += expired
+            self.total_warned += warned
+            self.last_run = now.isoformat()
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            return expired, warned
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("Expiry sweep failed")
+
+    def start(self):
+        """Start the periodic sweep thread (no-op when the interval is 0)"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sweep thread"""
+        self._stop.set()
+
+    def stats(self):
+        """Counters for the admin endpoint"""
+        return {
+            'interval_seconds': self.interval,
+            'batch_size': self.batch_size,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'runs': self.runs,
+            'total_expired': self.total_expired,
+            'total_warned': self.total_warned,
+            'last_run': self.last_run,
+            'last_duration_ms': self.last_duration_ms
+        }
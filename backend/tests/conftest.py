@@ -0,0 +1,86 @@
+"""
+Shared pytest setup for the backend tests.
+
+    cd backend && python -m pytest -q
+
+The backend modules use flat imports (`import storage`), so the backend
+directory goes on sys.path here. Tests that need the Flask app use the
+`client` fixture; the app module is imported once per session.
+"""
+
+import itertools
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Read by the backend modules at import time, so set before any test imports them
+os.environ.update({
+    'SILICA_MANAGED_STARTUP': '1',  # no sweeper/outbox/profiler threads
+    'STORAGE_ENGINE': 'sqlite',
+    'BCRYPT_ROUNDS': '4',
+    'STATELESS_VALIDATION': 'false'
+})
+
+_emails = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    """The app module, imported once inside a scratch directory
+
+    users.db, ratelimit.db and secret.key are relative paths, so the working
+    directory stays there for the whole session.
+    """
+    workdir = tmp_path_factory.mktemp('backend')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    import app
+    yield app
+    os.chdir(previous)
+
+
+@pytest.fixture
+def client(backend):
+    """Flask test client with empty rate-limit buckets and caches"""
+    backend.rate_limiter.reset()
+    backend.user_cache.clear()
+    backend.token_generations.clear()
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def admin(backend):
+    """Headers of an admin request"""
+    return {'X-Admin-Key': backend.ADMIN_KEY}
+
+
+@pytest.fixture
+def make_user(client, admin):
+    """Register an active user with a unique email; returns the register response plus its email"""
+    def make(duration_days=30, is_active=True):
+        email = f'user{next(_emails)}@example.com'
+        response = client.post('/auth/register', headers=admin, json={
+            'email': email, 'is_active': is_active, 'duration_days': duration_days
+        })
+        assert response.status_code == 200, response.get_json()
+        return dict(response.get_json(), email=email)
+    return make
+
+
+@pytest.fixture
+def login(client):
+    """Log a user from make_user in on hwid; returns the response"""
+    def log_in(user, hwid='hwid-1'):
+        import pyotp
+        return client.post('/auth/login', json={
+            'email': user['email'],
+            'password': user['password'],
+            'totp': pyotp.TOTP(user['totp_secret']).now(),
+            'hwid': hwid
+        })
+    return log_in
@@ -0,0 +1,82 @@
+"""/auth/validate-batch and /auth/activate-batch: size limits, per-item errors, partial success"""
+
+
+def test_validate_batch_mixes_valid_and_failing_items(client, make_user, login):
+    valid = login(make_user()).get_json()['token']
+    other = login(make_user(), hwid='hwid-2').get_json()['token']
+
+    response = client.post('/auth/validate-batch', json={'items': [
+        {'token': valid, 'hwid': 'hwid-1'},
+        {'token': other, 'hwid': 'hwid-1'},
+        {'token': 'garbage', 'hwid': 'hwid-1'},
+        {'token': valid}
+    ]})
+
+    assert response.status_code == 200
+    statuses = [result['status'] for result in response.get_json()['results']]
+    assert statuses == [200, 403, 401, 400]
+
+
+def test_validate_batch_answers_from_cache_and_database_alike(client, make_user, login):
+    token = login(make_user()).get_json()['token']
+    item = {'token': token, 'hwid': 'hwid-1'}
+
+    cold = client.post('/auth/validate-batch', json={'items': [item]}).get_json()
+    warm = client.post('/auth/validate-batch', json={'items': [item, item]}).get_json()
+
+    assert cold['results'][0]['status'] == 200
+    assert [result['status'] for result in warm['results']] == [200, 200]
+
+
+def test_validate_batch_size_limit(client, backend, monkeypatch):
+    monkeypatch.setattr(backend, 'VALIDATE_BATCH_MAX', 2)
+    items = [{'token': 'x', 'hwid': 'x'}] * 3
+
+    response = client.post('/auth/validate-batch', json={'items': items})
+    assert response.status_code == 400
+    assert 'At most 2' in response.get_json()['error']
+
+    assert client.post('/auth/validate-batch', json={'items': items[:2]}).status_code == 200
+    assert client.post('/auth/validate-batch', json={}).status_code == 400
+
+
+def test_activate_batch_partial_success(client, admin, make_user):
+    inactive = make_user(is_active=False)
+
+    response = client.post('/auth/activate-batch', headers=admin, json={
+        'emails': [inactive['email'], 'nobody@example.com', inactive['email'].upper()],
+        'duration_days': 30
+    })
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['updated'], body['failed']) == (1, 1)
+    results = {result['email']: result for result in body['results']}
+    assert results[inactive['email']]['success'] is True
+    assert results['nobody@example.com'] == {'email': 'nobody@example.com', 'success': False, 'error': 'User not found'}
+
+
+def test_activate_batch_lets_users_log_in(client, admin, make_user, login):
+    user = make_user(is_active=False)
+    assert login(user).status_code == 403
+
+    client.post('/auth/activate-batch', headers=admin, json={'emails': [user['email']], 'duration_days': 30})
+
+    assert login(user).status_code == 200
+
+
+def test_activate_batch_validation(client, admin, backend, monkeypatch):
+    monkeypatch.setattr(backend, 'ADMIN_BATCH_MAX', 2)
+    emails = ['a@example.com', 'b@example.com', 'c@example.com']
+
+    too_many = client.post('/auth/activate-batch', headers=admin, json={'emails': emails, 'duration_days': 1})
+    assert too_many.status_code == 400
+    assert 'At most 2' in too_many.get_json()['error']
+
+    for body in ({'emails': [], 'duration_days': 1},
+                 {'emails': [1], 'duration_days': 1},
+                 {'emails': emails[:1]},
+                 {'emails': emails[:1], 'duration_days': 0}):
+        assert client.post('/auth/activate-batch', headers=admin, json=body).status_code == 400
+
+    assert client.post('/auth/activate-batch', json={'emails': emails[:1], 'duration_days': 1}).status_code == 403
@@ -0,0 +1,101 @@
+"""bulk_users.py export/import round trips against a real users.db"""
+
+import json
+
+import pytest
+
+import bulk_users
+from db import ConnectionPool
+from storage import SQLiteUserStore
+
+HASH = b'$2b$04$abcdefghijklmnopqrstuuSyrkMCaSBGOw1qj8MJ2h7uzdgzNR5Ai'
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'users.db')
+    pool = ConnectionPool(path)
+    store = SQLiteUserStore(pool)
+    store.init_schema()
+    store.create_user('alice@example.com', HASH, 'ALICESECRET', 1, discord_id='111')
+    store.create_user('bob@example.com', HASH, 'BOBSECRET', 1, discord_id='222')
+    yield path, store
+    pool.close_all()
+
+
+def export(path, tmp_path):
+    output = tmp_path / 'users.ndjson'
+    bulk_users.main(['--database', path, 'export', str(output)])
+    return [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def write_records(tmp_path, records):
+    path = tmp_path / 'import.ndjson'
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def test_export_then_import_into_empty_database(database, tmp_path):
+    path, store = database
+    records = export(path, tmp_path)
+    assert [record['email'] for record in records] == ['alice@example.com', 'bob@example.com']
+
+    target = str(tmp_path / 'copy.db')
+    pool = ConnectionPool(target)
+    SQLiteUserStore(pool).init_schema()
+    try:
+        bulk_users.main(['--database', target, 'import', write_records(tmp_path, records)])
+        copy = SQLiteUserStore(pool)
+        assert copy.get_account('bob@example.com').discord_id == '222'
+        assert copy.check_query_plans() == {}
+    finally:
+        pool.close_all()
+
+
+def test_conflicting_email_fails_by_default(database, tmp_path):
+    path, store = database
+    records = export(path, tmp_path)
+    with pytest.raises(SystemExit, match='rolled back'):
+        bulk_users.main(['--database', path, 'import', write_records(tmp_path, records)])
+
+
+def test_skip_keeps_existing_rows(database, tmp_path):
+    path, store = database
+    records = export(path, tmp_path)
+    records[0]['note'] = 'changed'
+    records.append(dict(records[1], email='carol@example.com', discord_id='333'))
+
+    bulk_users.main(['--database', path, 'import', write_records(tmp_path, records), '--on-conflict', 'skip'])
+
+    assert store.get_account('carol@example.com').discord_id == '333'
+    assert store.get_account('alice@example.com').security_generation == 0
+    conn = store.pool.connect()
+    assert conn.execute("SELECT note FROM users WHERE email = 'alice@example.com'").fetchone()[0] is None
+    conn.close()
+
+
+def test_replace_updates_in_place_and_bumps_generation(database, tmp_path):
+    path, store = database
+    before = store.get_account('alice@example.com')
+    records = export(path, tmp_path)
+    records[0]['expires_at'] = '2030-01-01 00:00:00'
+
+    bulk_users.main(['--database', path, 'import', write_records(tmp_path, records), '--on-conflict', 'replace'])
+
+    after = store.get_account('alice@example.com')
+    assert after.id == before.id
+    assert after.expires_at == '2030-01-01 00:00:00'
+    assert after.security_generation == before.security_generation + 1
+
+
+def test_replace_rejects_discord_id_of_another_email(database, tmp_path):
+    path, store = database
+    records = [{'email': 'carol@example.com', 'password_hash': HASH.decode(), 'discord_id': '111'}]
+    input_path = write_records(tmp_path, records)
+
+    with pytest.raises(SystemExit, match='discord_id 111 belongs to alice@example.com'):
+        bulk_users.main(['--database', path, 'import', input_path, '--on-conflict', 'replace'])
+
+    bulk_users.main(['--database', path, 'import', input_path, '--on-conflict', 'replace', '--skip-invalid'])
+    assert store.get_account('carol@example.com') is None
+    assert store.get_account('alice@example.com').security_generation == 0
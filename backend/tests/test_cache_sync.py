@@ -0,0 +1,87 @@
+"""Cache invalidations reaching other worker processes through the store"""
+
+import pytest
+
+from cache import CacheSync, TTLCache, UserStatusCache
+from db import ConnectionPool
+from storage import SQLiteUserStore
+
+
+class Worker:
+    """The per-process caches of one gunicorn worker"""
+
+    def __init__(self, store):
+        self.statuses = UserStatusCache()
+        self.generations = TTLCache(100, 60)
+        self.sync = CacheSync(store)
+        self.statuses.on_invalidate = self.sync.publish
+        self.sync.add_target(self.statuses.forget)
+        self.sync.add_target(lambda user_id: self.generations.pop(user_id) if user_id else self.generations.clear())
+        self.sync.poll()
+
+    def cache(self, user_id):
+        self.statuses.put(user_id, f'{user_id}@example.com', ('hwid', 1, None))
+        self.generations.put(user_id, 3)
+
+    def cached(self, user_id):
+        self.sync.poll()
+        return self.statuses.get(user_id, f'{user_id}@example.com'), self.generations.get(user_id)
+
+
+@pytest.fixture
+def store(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'users.db'))
+    store = SQLiteUserStore(pool)
+    store.init_schema()
+    yield store
+    pool.close_all()
+
+
+def test_invalidation_reaches_the_other_worker(store):
+    a, b = Worker(store), Worker(store)
+    b.cache(1)
+    b.cache(2)
+
+    a.statuses.invalidate(1)
+
+    assert b.cached(1) == (None, None)
+    assert b.cached(2) == (('hwid', 1, None), 3)
+
+
+def test_clear_reaches_every_worker(store):
+    a, b = Worker(store), Worker(store)
+    b.cache(1)
+
+    a.statuses.clear()
+
+    assert b.cached(1) == (None, None)
+    assert b.sync.stats()['replayed'] == 1
+
+
+def test_new_worker_skips_older_entries(store):
+    a = Worker(store)
+    a.statuses.invalidate(1)
+
+    late = Worker(store)
+    late.cache(1)
+    assert late.cached(1) == (('hwid', 1, None), 3)
+
+
+def test_interval_defers_the_check(store):
+    a, b = Worker(store), Worker(store)
+    b.sync.interval = 3600
+    b.sync.poll()
+    b.cache(1)
+
+    a.statuses.invalidate(1)
+    assert b.cached(1)[0] is not None
+
+    b.sync.interval = 0
+    assert b.cached(1) == (None, None)
+
+
+def test_old_entries_are_purged(store):
+    Worker(store).statuses.invalidate(1)
+    assert store.purge_invalidations(0) == 0
+    assert store.purge_invalidations(float('inf')) == 1
+    assert store.invalidations_after(0) == []
@@ -0,0 +1,18 @@
+"""Cold start: `import app` stays within budget and leaves LAZY_MODULES unloaded"""
+
+import os
+
+import coldstart
+
+# Generous for shared CI runners; coldstart.py --baseline tracks small regressions
+COLDSTART_MAX_MS = float(os.environ.get('COLDSTART_MAX_MS', 1500))
+
+
+def test_import_app_cold_start(tmp_path):
+    first = coldstart.boot(str(tmp_path))
+    restart = coldstart.boot(str(tmp_path))
+
+    for run in (first, restart):
+        assert run['lazy_loaded'] == []
+        assert run['validate_status'] == 401
+    assert restart['import_ms'] < COLDSTART_MAX_MS
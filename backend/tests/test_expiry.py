@@ -0,0 +1,37 @@
+"""Expired accounts report expiry, before and after the sweeper deactivates them"""
+
+from datetime import datetime, timedelta
+
+
+def expire(backend, email):
+    user_id, _ = backend.user_store.update_user(email, {'expires_at': datetime.now() - timedelta(minutes=1)})
+    backend.user_cache.invalidate(user_id)
+
+
+def test_expired_user_sees_expiry_after_the_sweep(client, backend, make_user, login):
+    user = make_user()
+    token = login(user).get_json()['token']
+    item = {'token': token, 'hwid': 'hwid-1'}
+    expire(backend, user['email'])
+
+    for swept in (False, True):
+        if swept:
+            expired, _ = backend.expiry_sweeper.sweep()
+            assert expired >= 1
+            assert backend.user_store.get_account(user['email']).is_active == 0
+
+        response = login(user)
+        assert response.status_code == 403
+        assert response.get_json()['error'] == 'Account has expired. Please contact an admin.'
+
+        response = client.post('/auth/validate', json=item)
+        assert response.get_json()['error'] == 'Account has expired'
+
+        batch = client.post('/auth/validate-batch', json={'items': [item]}).get_json()
+        assert batch['results'][0]['error'] == 'Account has expired'
+
+
+def test_inactive_user_without_expiry_is_not_activated(make_user, login):
+    response = login(make_user(is_active=False))
+    assert response.status_code == 403
+    assert 'not activated' in response.get_json()['error']
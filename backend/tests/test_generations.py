@@ -0,0 +1,33 @@
+"""Cached security generations never move backwards"""
+
+from cache import GenerationCache
+
+
+def test_put_never_lowers_a_generation():
+    generations = GenerationCache(10, 60)
+    generations.put(1, 4)
+    generations.put(1, 3)
+    assert generations.get(1) == 4
+    generations.put(1, 5)
+    assert generations.get(1) == 5
+
+
+def test_bump_during_login_survives_the_login(client, backend, admin, make_user, login, monkeypatch):
+    user = make_user()
+    verify = backend.password_hasher.verify
+
+    def verify_while_admin_bumps(password, stored_hash):
+        # Lands between login's read of the generation and its cache update
+        response = client.post('/auth/remove-duration', headers=admin, json={'email': user['email'], 'days': 1})
+        assert response.status_code == 200
+        return verify(password, stored_hash)
+
+    monkeypatch.setattr(backend.password_hasher, 'verify', verify_while_admin_bumps)
+    token = login(user).get_json()['token']
+    monkeypatch.undo()
+
+    account = backend.user_store.get_account(user['email'])
+    assert backend.token_generations.get(account.id) == account.security_generation
+    # The token minted with the older generation is already revoked
+    response = client.post('/auth/validate', json={'token': token, 'hwid': 'hwid-1'})
+    assert response.status_code == 401
@@ -0,0 +1,63 @@
+"""PasswordHasher: queue bound under slow jobs and the timeout mapped to busy"""
+
+import threading
+
+import pytest
+
+from hashing import HashingBusyError, HashingTimeoutError, PasswordHasher
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    hasher = PasswordHasher(workers=1, max_queue=0, timeout=0.05, rounds=4)
+    release = threading.Event()
+
+    with pytest.raises(HashingTimeoutError):
+        hasher._run(release.wait)
+
+    # bcrypt is still running: the pool stays full for new callers
+    assert hasher.stats()['in_flight'] == 1
+    with pytest.raises(HashingBusyError):
+        hasher._run(lambda: None)
+
+    release.set()
+    hasher._get_executor().submit(lambda: None).result()
+    stats = hasher.stats()
+    assert (stats['in_flight'], stats['completed'], stats['timed_out'], stats['rejected']) == (0, 1, 1, 1)
+    assert hasher._run(lambda: 'ok') == 'ok'
+
+
+def test_timed_out_queued_job_is_cancelled():
+    hasher = PasswordHasher(workers=1, max_queue=1, timeout=0.05, rounds=4)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    def hold_worker():
+        with pytest.raises(HashingTimeoutError):
+            hasher._run(block)
+
+    running = threading.Thread(target=hold_worker)
+    running.start()
+    started.wait()
+
+    # Never started, so its slot is released with the timeout
+    with pytest.raises(HashingTimeoutError):
+        hasher._run(lambda: None)
+    assert hasher.stats()['queue_depth'] == 0
+
+    release.set()
+    running.join()
+
+
+def test_login_timeout_is_a_503(backend, make_user, login, monkeypatch):
+    user = make_user()
+
+    def slow(*args):
+        raise HashingTimeoutError('Password hashing timed out')
+
+    monkeypatch.setattr(backend.password_hasher, 'verify', slow)
+    response = login(user)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,54 @@
+"""Merged multi-worker metrics survive worker restarts"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    registry = metrics.Registry('test')
+    registry.counter('requests_total', 'Requests', ('endpoint',)).inc('/a', amount=2)
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0)).observe(0.05)
+    return registry
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(tmp_path, pid, snapshot):
+    (tmp_path / f'test-{pid}.json').write_text(json.dumps(snapshot))
+
+
+def test_dead_worker_counts_are_kept(registry, tmp_path):
+    write_snapshot(tmp_path, dead_pid(), {
+        'requests_total': {'/a': 3, '/b': 1},
+        'latency_seconds': {'': [1, 0, 0, 0.05]}
+    })
+
+    for _ in range(2):
+        merged = registry._collect()
+        assert merged['requests_total'] == {'/a': 5, '/b': 1}
+        assert merged['latency_seconds'][''] == [2, 0, 0, pytest.approx(0.1)]
+
+    assert {path.name for path in tmp_path.glob('*.json')} == {
+        'test-archive.json', f'test-{os.getpid()}.json'
+    }
+
+
+def test_archive_accumulates_every_dead_worker(registry, tmp_path):
+    write_snapshot(tmp_path, dead_pid(), {'requests_total': {'/a': 3}})
+    registry._collect()
+    write_snapshot(tmp_path, dead_pid(), {'requests_total': {'/a': 4}})
+
+    assert registry._collect()['requests_total'] == {'/a': 9}
+    assert 'requests_total{service="test",endpoint="/a"} 9' in registry.render()
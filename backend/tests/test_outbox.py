@@ -0,0 +1,70 @@
+"""Outbox dispatcher: lease renewal across a slow batch and dead-lettered payloads"""
+
+import pytest
+
+import outbox
+from db import ConnectionPool
+from outbox import OutboxDispatcher
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'outbox.db'))
+    conn = pool.connect()
+    outbox.create_outbox_table(conn.cursor())
+    conn.commit()
+    conn.close()
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable outbox.time.time()"""
+    now = [1000.0]
+    monkeypatch.setattr(outbox.time, 'time', lambda: now[0])
+    return now
+
+
+def queue(pool, count):
+    conn = pool.connect()
+    for index in range(count):
+        outbox.enqueue(conn.cursor(), 'test', 'http://bot/webhook', {'index': index, 'password': 'secret'})
+    conn.commit()
+    conn.close()
+
+
+def rows(pool):
+    conn = pool.connect()
+    try:
+        return conn.execute('SELECT status, payload FROM outbox ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_slow_batch_is_never_claimed_twice(pool, clock):
+    queue(pool, 3)
+    rival = OutboxDispatcher(pool, send=None)
+    stolen = []
+
+    def slow_send(url, payload):
+        # Each send takes most of a lease; another worker polls meanwhile
+        clock[0] += outbox.CLAIM_LEASE_SECONDS - 1
+        stolen.extend(rival._claim())
+        return True, False, None
+
+    assert OutboxDispatcher(pool, send=slow_send).dispatch() == 3
+    assert stolen == []
+    assert rows(pool) == [('delivered', None)] * 3
+
+
+def test_dead_letter_drops_the_payload(pool, clock):
+    queue(pool, 1)
+    dispatcher = OutboxDispatcher(pool, send=lambda url, payload: (False, False, 'HTTP 400: bad'))
+
+    dispatcher.dispatch()
+
+    assert rows(pool) == [('dead', None)]
+    assert dispatcher.stats()['dead'] == 1
+    # Nothing left to resend
+    assert dispatcher.retry_dead() == 0
@@ -0,0 +1,39 @@
+"""Admin request profiling: one cProfile at a time, sampling as the fallback"""
+
+import os
+
+import profiling
+
+
+def profiled_health(client, admin):
+    response = client.get('/health', headers=dict(admin, **{'X-Profile': 'cprofile'}))
+    name = response.headers[profiling.PROFILE_NAME_HEADER]
+    os.remove(os.path.join(profiling.PROFILE_DIR, name))
+    return name
+
+
+def test_only_one_cprofile_at_a_time():
+    first = profiling.start_cprofile()
+    assert first is not None
+    try:
+        assert profiling.start_cprofile() is None
+    finally:
+        profiling.stop_cprofile(first)
+
+    again = profiling.start_cprofile()
+    assert again is not None
+    profiling.stop_cprofile(again)
+
+
+def test_busy_cprofile_falls_back_to_sampling(client, admin):
+    assert profiled_health(client, admin).endswith('.pstats')
+
+    running = profiling.start_cprofile()
+    try:
+        assert profiled_health(client, admin).endswith('.collapsed')
+    finally:
+        profiling.stop_cprofile(running)
+
+    # The request released its slot: the next one gets cProfile again
+    assert profiled_health(client, admin).endswith('.pstats')
+    assert profiled_health(client, admin).endswith('.pstats')
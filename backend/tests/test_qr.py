@@ -0,0 +1,40 @@
+"""/auth/qr: rendering, the secret-free cache keys and the per-IP rate limit"""
+
+import qr
+
+SECRET = 'JBSWY3DPEHPK3PXP'
+
+
+def test_qr_renders_svg_and_png(client):
+    svg = client.post('/auth/qr', json={'email': 'a@example.com', 'totp_secret': SECRET})
+    assert svg.status_code == 200
+    assert svg.mimetype == 'image/svg+xml'
+
+    png = client.post('/auth/qr', json={'email': 'a@example.com', 'totp_secret': SECRET, 'format': 'png'})
+    assert png.mimetype == 'image/png'
+    assert png.data.startswith(b'\x89PNG')
+
+    assert client.post('/auth/qr', json={'email': 'a@example.com'}).status_code == 400
+
+
+def test_cache_keys_do_not_hold_the_secret():
+    image = qr.render_qr(qr.provisioning_uri('b@example.com', SECRET), 'svg')
+    assert qr.render_qr(qr.provisioning_uri('b@example.com', SECRET), 'svg') is image
+
+    keys = list(qr._qr_cache._entries)
+    assert keys
+    assert not any(SECRET in repr(key) for key in keys)
+
+
+def test_qr_is_rate_limited_per_ip(client, backend, admin, monkeypatch):
+    monkeypatch.setitem(backend.RATE_LIMITS, 'qr', {'ip': (2, 60)})
+    body = {'email': 'c@example.com', 'totp_secret': SECRET}
+
+    assert client.post('/auth/qr', json=body).status_code == 200
+    assert client.post('/auth/qr', json=body).status_code == 200
+    limited = client.post('/auth/qr', json=body)
+    assert limited.status_code == 429
+    assert 'Retry-After' in limited.headers
+
+    # The Discord bot (admin key) renders on behalf of many users
+    assert client.post('/auth/qr', json=body, headers=admin).status_code == 200
@@ -0,0 +1,29 @@
+"""Every hot users query must be answered with an index (see storage.HOT_QUERIES)"""
+
+from db import ConnectionPool
+from storage import HOT_QUERIES, SQLiteUserStore
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'users.db'))
+    store = SQLiteUserStore(pool)
+    store.init_schema()
+    try:
+        assert HOT_QUERIES
+        assert store.check_query_plans() == {}
+    finally:
+        pool.close_all()
+
+
+def test_schema_is_stamped_and_rerun_is_a_no_op(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'users.db'))
+    store = SQLiteUserStore(pool)
+    store.init_schema()
+    store.init_schema()
+    try:
+        conn = pool.connect()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] > 0
+        conn.close()
+        assert store.check_query_plans() == {}
+    finally:
+        pool.close_all()
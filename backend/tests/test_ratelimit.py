@@ -0,0 +1,120 @@
+"""Token-bucket limiter: exhaustion, refill, and the admin-key exemption on routes"""
+
+import pytest
+
+import ratelimit
+from db import ConnectionPool
+from ratelimit import RateLimiter, parse_limit
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'ratelimit.db'))
+    limiter = RateLimiter(pool, enabled=True)
+    limiter.create_table()
+    yield limiter
+    pool.close_all()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable ratelimit.time.time()"""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: now[0])
+    return now
+
+
+def test_parse_limit():
+    assert parse_limit('10/60') == (10, 60.0)
+    assert parse_limit('5') == (5, 60.0)
+    assert parse_limit('0') is None
+    with pytest.raises(ValueError):
+        parse_limit('-1/60')
+
+
+def test_bucket_exhausts_then_refills(limiter, clock):
+    limits = {'ip': (2, 60)}
+    ip = {'ip': '10.0.0.1'}
+
+    assert limiter.hit('login', limits, ip) == 0
+    assert limiter.hit('login', limits, ip) == 0
+    # One token comes back every 30 seconds
+    assert limiter.hit('login', limits, ip) == 30
+
+    clock[0] += 29
+    assert limiter.hit('login', limits, ip) == 1
+    clock[0] += 1
+    assert limiter.hit('login', limits, ip) == 0
+    assert limiter.hit('login', limits, ip) > 0
+
+    assert limiter.stats()['rejected'] == 3
+
+
+def test_identities_have_separate_buckets(limiter, clock):
+    limits = {'ip': (1, 60)}
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1'}) == 0
+    assert limiter.hit('login', limits, {'ip': '10.0.0.2'}) == 0
+    assert limiter.hit('register', limits, {'ip': '10.0.0.1'}) == 0
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1'}) > 0
+
+
+def test_rejection_takes_no_token_from_other_buckets(limiter, clock):
+    limits = {'ip': (1, 60), 'email': (2, 60)}
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1', 'email': 'a@example.com'}) == 0
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1', 'email': 'a@example.com'}) > 0
+    # The email bucket still has its second token
+    assert limiter.hit('login', limits, {'ip': '10.0.0.2', 'email': 'a@example.com'}) == 0
+
+
+def test_missing_identities_and_disabled_limiter_allow(limiter, clock):
+    limits = {'ip': (1, 60)}
+    assert limiter.hit('login', limits, {'ip': None}) == 0
+    assert limiter.hit('login', limits, {'ip': None}) == 0
+
+    limiter.enabled = False
+    limiter.hit('login', limits, {'ip': '10.0.0.1'})
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1'}) == 0
+
+
+def test_reset_and_purge(limiter, clock):
+    limits = {'ip': (1, 60)}
+    limiter.hit('login', limits, {'ip': '10.0.0.1'})
+    limiter.hit('register', limits, {'ip': '10.0.0.1'})
+
+    assert limiter.reset('login:') == 1
+    assert limiter.hit('login', limits, {'ip': '10.0.0.1'}) == 0
+
+    clock[0] += 60
+    assert limiter.purge() == 2
+    assert limiter.stats()['buckets'] == 0
+
+
+def login_attempt(client, email, headers=None):
+    return client.post('/auth/login', headers=headers, json={'email': email, 'password': 'x', 'totp': '000000'})
+
+
+def test_route_returns_429_with_retry_after(client, backend, monkeypatch):
+    monkeypatch.setitem(backend.RATE_LIMITS, 'login', {'ip': (2, 60)})
+
+    assert login_attempt(client, 'a@example.com').status_code == 401
+    assert login_attempt(client, 'b@example.com').status_code == 401
+    limited = login_attempt(client, 'c@example.com')
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) > 0
+
+
+def test_admin_key_drops_only_the_ip_bucket(client, backend, admin, monkeypatch):
+    monkeypatch.setitem(backend.RATE_LIMITS, 'login', {'ip': (1, 60), 'email': (2, 60)})
+
+    # Many emails from one address: the IP bucket no longer applies
+    for index in range(3):
+        assert login_attempt(client, f'user{index}@example.com', admin).status_code == 401
+
+    # ...but the per-email bucket still does
+    assert login_attempt(client, 'user0@example.com', admin).status_code == 401
+    assert login_attempt(client, 'user0@example.com', admin).status_code == 429
+
+    # A wrong key is an ordinary client
+    wrong = {'X-Admin-Key': 'wrong'}
+    assert login_attempt(client, 'user5@example.com', wrong).status_code == 401
+    assert login_attempt(client, 'user6@example.com', wrong).status_code == 429
@@ -0,0 +1,85 @@
+"""/auth/refresh: rotation, reuse detection, family revocation and generation bumps"""
+
+
+def refresh(client, refresh_token, hwid='hwid-1'):
+    return client.post('/auth/refresh', json={'refresh_token': refresh_token, 'hwid': hwid})
+
+
+def test_refresh_rotates_the_token(client, make_user, login):
+    session = login(make_user()).get_json()
+
+    first = refresh(client, session['refresh_token'])
+    assert first.status_code == 200
+    rotated = first.get_json()
+    assert rotated['refresh_token'] != session['refresh_token']
+    assert client.post('/auth/validate', json={'token': rotated['token'], 'hwid': 'hwid-1'}).status_code == 200
+
+    second = refresh(client, rotated['refresh_token'])
+    assert second.status_code == 200
+    assert second.get_json()['refresh_token'] != rotated['refresh_token']
+
+
+def test_unknown_and_missing_tokens_are_rejected(client):
+    assert refresh(client, 'not-a-token').status_code == 401
+    assert client.post('/auth/refresh', json={}).status_code == 400
+
+
+def test_reused_token_revokes_its_family(client, make_user, login):
+    session = login(make_user()).get_json()
+    rotated = refresh(client, session['refresh_token']).get_json()
+
+    reused = refresh(client, session['refresh_token'])
+    assert reused.status_code == 401
+    assert 'reuse' in reused.get_json()['error']
+
+    # The token issued by the legitimate rotation dies with its family
+    assert refresh(client, rotated['refresh_token']).status_code == 401
+
+
+def test_reuse_revokes_access_tokens_and_other_sessions(client, make_user, login):
+    user = make_user()
+    stolen = login(user).get_json()
+    other = login(user).get_json()
+
+    minted = refresh(client, stolen['refresh_token']).get_json()
+    assert refresh(client, stolen['refresh_token']).status_code == 401
+
+    # The generation bump ends every token the user holds
+    validate = {'token': minted['token'], 'hwid': 'hwid-1'}
+    assert client.post('/auth/validate', json=validate).status_code == 401
+    assert refresh(client, other['refresh_token']).status_code == 401
+    assert refresh(client, login(user).get_json()['refresh_token']).status_code == 200
+
+
+def test_hwid_mismatch_revokes_the_family(client, make_user, login):
+    session = login(make_user()).get_json()
+
+    assert refresh(client, session['refresh_token'], hwid='hwid-2').status_code == 403
+    assert refresh(client, session['refresh_token']).status_code == 401
+
+
+def test_refresh_after_generation_bump_is_revoked(client, admin, make_user, login):
+    user = make_user()
+    session = login(user).get_json()
+
+    response = client.post('/auth/remove-duration', headers=admin, json={'email': user['email'], 'days': 1})
+    assert response.status_code == 200
+
+    revoked = refresh(client, session['refresh_token'])
+    assert revoked.status_code == 401
+    assert revoked.get_json()['error'] == 'Refresh token has been revoked'
+
+    # A fresh login carries the new generation
+    assert refresh(client, login(user).get_json()['refresh_token']).status_code == 200
+
+
+def test_shorter_reactivation_revokes_refresh_tokens(client, admin, make_user, login):
+    user = make_user(duration_days=30)
+    session = login(user).get_json()
+
+    longer = login(user).get_json()
+    client.post('/auth/activate', headers=admin, json={'email': user['email'], 'duration_days': 60})
+    assert refresh(client, longer['refresh_token']).status_code == 200
+
+    client.post('/auth/activate', headers=admin, json={'email': user['email'], 'duration_days': 1})
+    assert refresh(client, session['refresh_token']).status_code == 401
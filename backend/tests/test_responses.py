@@ -0,0 +1,38 @@
+"""Accept-negotiated JSON/MessagePack responses"""
+
+import asyncio
+
+import msgpack
+
+
+def test_json_and_msgpack_responses_vary_on_accept(client):
+    as_json = client.post('/auth/validate', json={})
+    assert as_json.mimetype == 'application/json'
+    assert 'Accept' in as_json.vary
+
+    as_msgpack = client.post('/auth/validate', json={}, headers={'Accept': 'application/msgpack'})
+    assert as_msgpack.mimetype == 'application/msgpack'
+    assert 'Accept' in as_msgpack.vary
+    assert msgpack.unpackb(as_msgpack.data) == as_json.get_json()
+
+
+def test_cors_response_keeps_vary(client):
+    response = client.get('/health', headers={'Origin': 'https://example.com'})
+    assert 'Accept' in response.vary
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+
+
+def test_asgi_native_routes_vary_on_accept(backend):
+    import asgi
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'headers': [(b'accept', b'application/msgpack')]}
+    asyncio.run(asgi.send_json(send, scope, {'status': 'ok'}, 200))
+
+    headers = dict(sent[0]['headers'])
+    assert headers[b'vary'] == b'Accept'
+    assert headers[b'content-type'] == b'application/msgpack'
@@ -0,0 +1,142 @@
+"""UserStore contract, run against every engine in STORAGE_ENGINES"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from db import ConnectionPool
+from storage import STORAGE_ENGINES, MemoryUserStore, SQLiteUserStore, to_db_value
+
+HASH = b'$2b$04$abcdefghijklmnopqrstuuSyrkMCaSBGOw1qj8MJ2h7uzdgzNR5Ai'
+
+
+@pytest.fixture(params=STORAGE_ENGINES)
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryUserStore()
+        return
+    pool = ConnectionPool(str(tmp_path / 'users.db'))
+    store = SQLiteUserStore(pool)
+    store.init_schema()
+    yield store
+    pool.close_all()
+
+
+def create(store, email, discord_id=None, is_active=1, expires_at=None):
+    return store.create_user(email, HASH, 'SECRET', is_active, discord_id=discord_id, expires_at=expires_at)
+
+
+def generation(store, email):
+    return store.get_account(email).security_generation
+
+
+def test_email_and_discord_id_are_unique(store):
+    create(store, 'a@example.com', discord_id='111')
+    assert store.email_exists('a@example.com')
+    assert store.discord_exists('111')
+    assert not store.discord_exists('222')
+
+    with pytest.raises(sqlite3.IntegrityError):
+        create(store, 'a@example.com')
+    with pytest.raises(sqlite3.IntegrityError):
+        create(store, 'b@example.com', discord_id='111')
+
+    # Deleting the account frees its Discord id
+    assert store.delete_user('a@example.com')[1] == '111'
+    assert not store.discord_exists('111')
+    create(store, 'b@example.com', discord_id='111')
+
+
+def test_update_user_bumps_on_request(store):
+    user_id = create(store, 'a@example.com')
+
+    assert store.update_user('a@example.com', {'hwid': 'hwid-1'}) == (user_id, 0)
+    assert store.update_user('a@example.com', {'hwid': None}, bump_generation=True) == (user_id, 1)
+    assert store.get_status(user_id, 'a@example.com').hwid is None
+    assert store.update_user('nobody@example.com', {'hwid': None}) is None
+
+
+def test_update_batch_bumps_per_user(store):
+    now = datetime.now()
+    create(store, 'long@example.com', expires_at=now + timedelta(days=30))
+    create(store, 'short@example.com', expires_at=now + timedelta(days=1))
+    target = now + timedelta(days=10)
+
+    def plan(email, account):
+        return {'expires_at': target}, {'success': True}
+
+    def shortened(account, changes):
+        return datetime.fromisoformat(account.expires_at) > changes['expires_at']
+
+    results, changed = store.update_batch(['long@example.com', 'short@example.com', 'nobody@example.com'],
+                                          plan, bump_generation=shortened)
+
+    assert [result['success'] for result in results] == [True, True, False]
+    assert [email for email, _ in changed] == ['long@example.com', 'short@example.com']
+    assert generation(store, 'long@example.com') == 1
+    assert generation(store, 'short@example.com') == 0
+    assert store.get_account('short@example.com').expires_at == to_db_value(target)
+
+    store.update_batch(['short@example.com'], plan, bump_generation=True)
+    assert generation(store, 'short@example.com') == 1
+
+
+def test_expire_due_claims_each_user_once(store):
+    now = datetime.now()
+    create(store, 'due1@example.com', discord_id='1', expires_at=now - timedelta(days=2))
+    create(store, 'due2@example.com', expires_at=now - timedelta(days=1))
+    create(store, 'later@example.com', expires_at=now + timedelta(days=1))
+    create(store, 'inactive@example.com', is_active=0, expires_at=now - timedelta(days=1))
+
+    first = store.expire_due(now, limit=1)
+    assert [(row.email, row.discord_id) for row in first] == [('due1@example.com', '1')]
+    assert [row.email for row in store.expire_due(now, limit=10)] == ['due2@example.com']
+    assert store.expire_due(now, limit=10) == []
+
+    assert store.get_account('due1@example.com').is_active == 0
+    assert store.get_account('later@example.com').is_active == 1
+
+
+def test_mark_expiring_warns_once_per_expiry(store):
+    now = datetime.now()
+    create(store, 'soon@example.com', expires_at=now + timedelta(hours=1))
+    create(store, 'later@example.com', expires_at=now + timedelta(days=30))
+
+    soon = now + timedelta(hours=72)
+    assert [row.email for row in store.mark_expiring(now, soon, limit=10)] == ['soon@example.com']
+    assert store.mark_expiring(now, soon, limit=10) == []
+
+    # A new expiry date is warned about again
+    store.update_user('soon@example.com', {'expires_at': now + timedelta(hours=2)})
+    assert [row.email for row in store.mark_expiring(now, soon, limit=10)] == ['soon@example.com']
+
+
+def test_refresh_token_claims(store):
+    user_id = create(store, 'a@example.com')
+    store.create_refresh_token(user_id, 'first', 'family', 'hwid-1', 0, 2000.0)
+    store.create_refresh_token(user_id, 'second', 'family', 'hwid-1', 0, 2000.0)
+    store.create_refresh_token(user_id, 'old', 'other', 'hwid-1', 0, 1000.0)
+
+    status, record = store.claim_refresh_token('first', 1500.0)
+    assert (status, record.email, record.user_generation) == ('ok', 'a@example.com', 0)
+    assert store.claim_refresh_token('missing', 1500.0) == ('unknown', None)
+    assert store.claim_refresh_token('old', 1500.0)[0] == 'expired'
+
+    # A spent token coming back revokes its family and bumps the generation
+    status, record = store.claim_refresh_token('first', 1500.0)
+    assert (status, record.user_generation) == ('reused', 1)
+    assert generation(store, 'a@example.com') == 1
+    assert store.claim_refresh_token('second', 1500.0)[0] == 'revoked'
+
+    assert store.purge_refresh_tokens(1500.0) == 1
+
+
+def test_get_statuses_skips_missing_ids(store):
+    first = create(store, 'a@example.com')
+    second = create(store, 'b@example.com')
+
+    statuses = store.get_statuses([first, second, 999])
+    assert sorted(statuses) == [first, second]
+    assert statuses[second][0] == 'b@example.com'
+    assert statuses[first][1].is_active == 1
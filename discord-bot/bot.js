@@ -284,7 +284,13 @@ async function handleRegister(message, args) {
             email: email,
             is_active: false,
             duration_days: 0,
-            discord_id: message.author.id
+            discord_id: message.author.id,
+            include_qr: true
+        }, {
+            // Registers for many users from one address: skip the per-IP limit
+            headers: {
+                'X-Admin-Key': ADMIN_KEY
+            }
         });
 
         if (registerResponse.data.success) {
@@ -456,14 +462,21 @@ async function handleListUsers(message) {
     }
 
     try {
+        // Only the newest page is displayed, so don't pull the whole table
+        const maxUsers = 10;
         const response = await axios.get(`${BACKEND_URL}/auth/users`, {
             headers: {
                 'X-Admin-Key': ADMIN_KEY
+            },
+            params: {
+                limit: maxUsers,
+                include_total: 1
             }
         });
 
         if (response.data.success) {
             const users = response.data.users;
+            const total = response.data.total;
             
             if (users.length === 0) {
                 await message.reply({
@@ -477,14 +490,10 @@ async function handleListUsers(message) {
                 .setColor('#0099FF')
                 .setTitle('👥 Registered Users')
                 .setTimestamp()
-                .setFooter({ text: `Total: ${users.length} users` });
+                .setFooter({ text: `Total: ${total} users` });
 
-            // Add users to embed (limit to prevent message being too long)
-            const maxUsers = 10;
-            const displayUsers = users.slice(0, maxUsers);
-            
             let description = '';
-            displayUsers.forEach((user, index) => {
+            users.forEach((user, index) => {
                 const status = user.is_active ? '🟢' : '🔴';
                 const hwid = user.hwid_status === 'Set' ? '🔒' : '🔓';
                 const lastLogin = user.last_login ? 
@@ -495,8 +504,8 @@ async function handleListUsers(message) {
                 description += `   ${hwid} HWID: ${user.hwid_status} | Last: ${lastLogin} | Exp: ${expiry}\n\n`;
             });
 
-            if (users.length > maxUsers) {
-                description += `... and ${users.length - maxUsers} more users`;
+            if (total > users.length) {
+                description += `... and ${total - users.length} more users`;
             }
 
             embed.setDescription(description);
@@ -1,18 +1,30 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for
 from flask_cors import CORS
 import os
+import sys
 import secrets
 import stripe
-import sqlite3
 from datetime import datetime, timedelta
-import requests
 import uuid
 from dotenv import load_dotenv
 
+# The pooled outbound HTTP client is shared with the backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+import http_client
+import logs
+import metrics
+import profiling
+from db import ConnectionPool
+from storage import open_purchase_store
+
 # Load environment variables
 load_dotenv()
 
+log = logs.get_logger('store')
+
 app = Flask(__name__)
+metrics.instrument_flask(app, 'store')
+logs.instrument_flask(app, 'store')
 
 # Configure CORS to allow requests from your domain
 CORS(app, resources={
@@ -34,6 +46,17 @@ STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', 'whsec_your_webh
 BACKEND_URL = os.environ.get('BACKEND_URL', 'http://localhost:5000')
 ADMIN_KEY = os.environ.get('ADMIN_KEY', 'rAwwIzAd-RGz8eYGo_6ymz8Wd4EFEnBC6R--MWQ8gK8')
 DATABASE = 'purchases.db'
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'sqlite')
+BACKEND_TIMEOUT = float(os.environ.get('BACKEND_TIMEOUT', 10))
+
+# Keep-alive connection pool, timeouts and circuit breaker for backend calls
+backend_client = http_client.get_upstream('auth-backend', read_timeout=BACKEND_TIMEOUT)
+
+# Purchases live behind a PurchaseStore (SQLite by default, 'memory' for tests)
+purchase_store = open_purchase_store(STORAGE_ENGINE, ConnectionPool(DATABASE))
+
+# X-Profile on admin requests; saved profiles under /api/profiles
+profile_sampler = profiling.instrument_flask(app, 'store', ADMIN_KEY, '/api')
 
 stripe.api_key = STRIPE_SECRET_KEY
 
@@ -55,26 +78,7 @@ PRODUCTS = {
 
 def init_db():
     """Initialize the purchases database"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS purchases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            purchase_id TEXT UNIQUE NOT NULL,
-            discord_username TEXT NOT NULL,
-            email TEXT NOT NULL,
-            product_type TEXT NOT NULL,
-            amount INTEGER NOT NULL,
-            status TEXT DEFAULT 'pending',
-            stripe_session_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            completed_at TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    purchase_store.init_schema()
 
 @app.route('/')
 def index():
@@ -106,16 +110,7 @@ def create_checkout_session():
         purchase_id = str(uuid.uuid4())
         
         # Store purchase in database
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO purchases (purchase_id, discord_username, email, product_type, amount, status)
-            VALUES (?, ?, ?, ?, ?, 'pending')
-        ''', (purchase_id, discord_username, email, product_type, product['price']))
-        
-        conn.commit()
-        conn.close()
+        purchase_store.create_purchase(purchase_id, discord_username, email, product_type, product['price'])
         
         # Create Stripe checkout session
         checkout_session = stripe.checkout.Session.create(
@@ -143,15 +138,7 @@ def create_checkout_session():
         )
         
         # Update purchase with Stripe session ID
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE purchases SET stripe_session_id = ? WHERE purchase_id = ?
-        ''', (checkout_session.id, purchase_id))
-        
-        conn.commit()
-        conn.close()
+        purchase_store.set_session(purchase_id, checkout_session.id)
         
         return jsonify({'checkout_url': checkout_session.url}), 200
         
@@ -184,24 +171,14 @@ def stripe_webhook():
         product_type = session['metadata']['product_type']
         
         # Update purchase status
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE purchases 
-            SET status = 'completed', completed_at = ?
-            WHERE purchase_id = ?
-        ''', (datetime.now(), purchase_id))
-        
-        conn.commit()
-        conn.close()
+        purchase_store.complete_purchase(purchase_id)
         
         # Register and activate the user through the backend API
         try:
             # Create account and activate it
             duration_days = PRODUCTS[product_type]['duration_days']
             
-            purchase_response = requests.post(f'{BACKEND_URL}/auth/purchase-complete', 
+            purchase_response = backend_client.post(f'{BACKEND_URL}/auth/purchase-complete', 
                 json={
                     'email': email,
                     'discord_username': discord_username,
@@ -214,8 +191,8 @@ def stripe_webhook():
                 # This can notify your Discord server about new purchases
                 pass
                     
-        except Exception as e:
-            print(f"Error processing purchase completion: {str(e)}")
+        except Exception:
+            log.exception("Error processing purchase completion")
     
     return 'Success', 200
 
@@ -229,31 +206,26 @@ def cancel():
     """Cancel page if payment is cancelled"""
     return render_template('cancel.html')
 
+@app.route('/api/upstream-stats')
+def upstream_stats():
+    """Outbound HTTP latency/error counters per upstream (admin only)"""
+    if request.headers.get('X-Admin-Key') != ADMIN_KEY:
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify({'upstreams': http_client.upstream_stats()}), 200
+
 @app.route('/api/check-purchase/<purchase_id>')
 def check_purchase(purchase_id):
     """Check purchase status"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT status, discord_username, email, product_type
-        FROM purchases
-        WHERE purchase_id = ?
-    ''', (purchase_id,))
+    purchase = purchase_store.get_purchase(purchase_id)
     
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return jsonify({
-            'status': result[0],
-            'discord_username': result[1],
-            'email': result[2],
-            'product_type': result[3]
-        }), 200
+    if purchase:
+        return jsonify(purchase), 200
     else:
         return jsonify({'error': 'Purchase not found'}), 404
 
+# start.py imports the app without running __main__, so create the table here
+init_db()
+profile_sampler.start()
+
 if __name__ == '__main__':
-    init_db()
     app.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file